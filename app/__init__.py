@@ -1,25 +1,30 @@
 from flask import Flask, jsonify, request, abort
-from flask_sqlalchemy import SQLAlchemy
-from cerberus import Validator
-import re
+import threading
 
 # local import
 from instance.config import app_config
+from app.normalization import format_inputs
+from app.tenants import TenantSQLAlchemy
 
-# initialize sql-alchemy
-db = SQLAlchemy()
+# initialize sql-alchemy, sessions follow the request's tenant
+db = TenantSQLAlchemy()
 
 
-# useful functions
-def format_inputs(word):
+class LazyValidator(threading.local):
 	"""
-	formats input string
-	:param word:
-	:return: string
+	cerberus validator built on first use. Each thread gets its own, since a
+	validator keeps the errors of its last run.
 	"""
-	json_input = word.lower().strip()
-	split_input = re.sub(' +', " ", json_input)
-	return "".join(split_input)
+
+	def __init__(self, schema):
+		self.schema = schema
+		self._validator = None
+
+	def __getattr__(self, name):
+		if self._validator is None:
+			from cerberus import Validator
+			self._validator = Validator(self.schema)
+		return getattr(self._validator, name)
 
 
 # schemas
@@ -44,19 +49,46 @@ update_book_schema = {
 	}
 }
 
-validate_book_schema = Validator(book_schema)
-validate_update_book_schema = Validator(update_book_schema)
+validate_book_schema = LazyValidator(book_schema)
+validate_update_book_schema = LazyValidator(update_book_schema)
 
 
 def create_app(config_name):
 	from app.models import Booklist
+	from app.ratelimit import RateLimiter, service_unavailable
+	from app.tracing import Tracer, span
+	from app.profiling import Profiler
+	from app.batching import GroupCommitter
+	from app.isbn import canonical, InvalidISBN
+	from app.warmup import WarmUp, prime_pool, load_hot_books
+	from app.readmodel import ReadModel, load_read_model
+	from app.tenants import TenantRouter
+	from app.audit import AuditLog
+	from app.auth.decorators import admin_required
+	from app.jobs.queue import enqueue_batches
+	from app.limits import BodyLimiter
+	from app.streaming import StreamError, iter_items
 
 	app = Flask(__name__, instance_relative_config=True)
 	app.config.from_object(app_config[config_name])
-	app.config.from_pyfile('config.py')
+	# instance/config.py is already loaded through app_config, only read overrides
+	app.config.from_envvar('HELLO_BOOKS_SETTINGS', silent=True)
 	app.url_map.strict_slashes = False
 	app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 	db.init_app(app)
+	Tracer(app)
+	BodyLimiter(app)
+	RateLimiter(app)
+	TenantRouter(app)
+	AuditLog(app)
+	Profiler(app)
+	app.extensions['group_commit'] = GroupCommitter.from_config(app)
+
+	warmup = WarmUp(app)
+	warmup.register('connection_pool', prime_pool)
+	warmup.register('hot_books', load_hot_books)
+	read_model = ReadModel(app)
+	warmup.register('read_model', load_read_model)
 
 	@app.errorhandler(404)
 	def page_not_found(e):
@@ -66,28 +98,43 @@ def create_app(config_name):
 	def bad_request(e):
 		return jsonify({"error": 'bad request'}), 400
 
+	@app.errorhandler(413)
+	def request_entity_too_large(e):
+		return jsonify({'error': 'request body too large'}), 413
+
 	@app.errorhandler(500)
 	def internal_server_error(e):
 		return jsonify({'error': 'internal server error'}), 500
 
+	def group_commit_timeout():
+		# the flusher is behind, the write may still land; the client retries later
+		return service_unavailable(app.config.get('CONCURRENCY_RETRY_AFTER', 1))
+
 	@app.route('/api/v2/books')
 	def api_get_all_books():
 		"""
 		:return: book list, 200
 		"""
-		all_books = Booklist.get_all()
-		books_result = []
-
-		for book in all_books:
-			book_obj = {
-				'id': book.id,
-				'title': book.title,
-				'isbn': book.isbn,
-				'dte_created': book.date_created,
-				'date_modified': book.date_modified
-			}
-			books_result.append(book_obj)
-		return jsonify({'books': books_result})
+		if read_model.serving:
+			with span('read_model'):
+				all_books = read_model.catalogue.all()
+		else:
+			with span('db'):
+				all_books = Booklist.get_all()
+
+		with span('serialization'):
+			books_result = []
+
+			for book in all_books:
+				book_obj = {
+					'id': book.id,
+					'title': book.title,
+					'isbn': book.isbn,
+					'dte_created': book.date_created,
+					'date_modified': book.date_modified
+				}
+				books_result.append(book_obj)
+			return jsonify({'books': books_result})
 
 	@app.route('/api/v2/books', methods=['POST'])
 	def api_create_book():
@@ -97,17 +144,26 @@ def create_app(config_name):
 			"""abort if no JSON object detected"""
 			abort(400)
 
-		if validate_book_schema.validate(req_data):
+		with span('validation'):
+			valid = validate_book_schema.validate(req_data)
+
+		if valid:
 			try:
 				title = format_inputs(req_data.get('title'))
-				isbn = format_inputs(req_data.get('isbn'))
-
-				if len(isbn) != 10:
-					return jsonify({'error': "isbn length must be 10"}), 400
-
-				if isbn.isnumeric():
+				try:
+					isbn = canonical(req_data.get('isbn'))
+				except InvalidISBN as e:
+					return jsonify({'error': str(e)}), 400
+
+				if app.config.get('GROUP_COMMIT_ENABLED'):
+					with span('db'):
+						book_json = app.extensions['group_commit'].create(title, isbn)
+					del book_json['date_modified']
+				else:
 					new_book = Booklist(title=title, isbn=isbn)
-					new_book.save()
+
+					with span('db'):
+						new_book.save()
 
 					book_json = {
 						'id': new_book.id,
@@ -116,9 +172,10 @@ def create_app(config_name):
 						'date_created': new_book.date_created
 					}
 
+				with span('serialization'):
 					return jsonify({"book_created": book_json}), 201
-
-				return jsonify({'error': "isbn must only include numbers"}), 400
+			except TimeoutError:
+				return group_commit_timeout()
 			except:
 				return jsonify({'error': f"book with ISBN {req_data.get('isbn')} already exists"}), 400
 
@@ -127,23 +184,31 @@ def create_app(config_name):
 	@app.route('/api/v2/books/<int:id>')
 	def api_get_book_with_id(id):
 
-		book = Booklist.query.filter(Booklist.id == id).first()
+		if read_model.serving:
+			with span('read_model'):
+				book = read_model.catalogue.get(id)
+		else:
+			with span('db'):
+				book = Booklist.live().filter(Booklist.id == id).first()
 
 		if not book:
 			abort(404)
 
-		return jsonify({
-			'id': book.id,
-			'title': book.title,
-			'isbn': book.isbn,
-			'date_created': book.date_created,
-			'date_modified': book.date_modified
-		})
+		with span('serialization'):
+			return jsonify({
+				'id': book.id,
+				'title': book.title,
+				'isbn': book.isbn,
+				'date_created': book.date_created,
+				'date_modified': book.date_modified
+			})
 
 	@app.route('/api/v2/books/<int:id>', methods=['PUT'])
 	def api_update_book(id):
 		req_data = request.get_json()
-		book = Booklist.query.filter(Booklist.id == id).first()
+
+		with span('db'):
+			book = Booklist.live().filter(Booklist.id == id).first()
 
 		if not req_data:
 			"""abort if no JSON object detected"""
@@ -152,35 +217,95 @@ def create_app(config_name):
 		if not book:
 			abort(404)
 
-		if validate_update_book_schema.validate(req_data):
+		with span('validation'):
+			valid = validate_update_book_schema.validate(req_data)
+
+		if valid:
 			title = format_inputs(req_data.get('title'))
-			book.title = title
-			book.save()
 
-			book_json = {
-				'id': book.id,
-				'title': book.title,
-				'isbn': book.isbn,
-				'date_created': book.date_created,
-				'date_modified': book.date_modified
-			}
+			if app.config.get('GROUP_COMMIT_ENABLED'):
+				try:
+					with span('db'):
+						book_json = app.extensions['group_commit'].update(book.id, title)
+				except TimeoutError:
+					return group_commit_timeout()
+
+				if not book_json:
+					abort(404)
+			else:
+				book.title = title
+
+				with span('db'):
+					book.save()
 
-			return jsonify({"book_updated": book_json}), 201
+				book_json = {
+					'id': book.id,
+					'title': book.title,
+					'isbn': book.isbn,
+					'date_created': book.date_created,
+					'date_modified': book.date_modified
+				}
+
+			with span('serialization'):
+				return jsonify({"book_updated": book_json}), 201
 
 		return jsonify({'error': validate_update_book_schema.errors})
 
 	@app.route('/api/v2/books/<int:id>', methods=['DELETE'])
 	def api_delete_book(id):
-		book = Booklist.query.filter(Booklist.id == id).first()
+		with span('db'):
+			book = Booklist.live().filter(Booklist.id == id).first()
 
 		if not book:
 			abort(404)
 
-		book.delete()
+		with span('db'):
+			book.delete()
 		return jsonify({'message': f'Book with ID {book.id} deleted'})
 
+	@app.route('/api/v2/books/import', methods=['POST'])
+	@admin_required
+	def api_import_books():
+		"""
+		queues a bulk import, a job per BOOK_IMPORT_BATCH_SIZE books, see app/imports.py.
+		The body is NDJSON, a list of books or {"books": [...]}, parsed as it arrives
+		:return: the ids of the queued jobs, 202
+		"""
+		limit = app.config.get('BOOK_IMPORT_LIMIT', 10000000)
+		count = 0
+
+		def books():
+			nonlocal count
+			for book in iter_items(request.stream, request.mimetype, key='books'):
+				count += 1
+				if count > limit:
+					raise StreamError(f"at most {limit} books can be imported at once")
+				yield book
+
+		try:
+			jobs = enqueue_batches('import_books', 'books', books(), app.config.get('BOOK_IMPORT_BATCH_SIZE', 1000))
+		except StreamError as e:
+			return jsonify({'error': str(e)}), 400
+
+		if not jobs:
+			return jsonify({'error': 'no books to import'}), 400
+
+		return jsonify({'books': count, 'jobs': jobs}), 202
+
 	# authentication blueprint
 	from .auth import auth_blueprint
 	app.register_blueprint(auth_blueprint)
 
+	# admin blueprint
+	from .admin import admin_blueprint
+	app.register_blueprint(admin_blueprint)
+
+	# background job status
+	from .jobs import jobs_blueprint
+	app.register_blueprint(jobs_blueprint)
+
+	# load balancer probes
+	from .health import health_blueprint
+	app.register_blueprint(health_blueprint)
+
 	return app
@@ -0,0 +1,5 @@
+from flask import Blueprint
+
+admin_blueprint = Blueprint('admin', __name__)
+
+from . import views
@@ -0,0 +1,205 @@
+from . import admin_blueprint
+from flask.views import MethodView
+from flask import request, jsonify, abort, current_app
+from app.auth.decorators import admin_required
+from app.profiling import Profiler
+from app import LazyValidator
+from app.models import APIUser, AuditEvent
+from app.tenants import current_tenant
+from app.jobs.queue import enqueue, accepted
+
+profile_schema = {
+	'endpoint': {
+		'type': 'string',
+		'required': True,
+		'empty': False
+	},
+	'mode': {
+		'type': 'string',
+		'allowed': list(Profiler.MODES)
+	},
+	'requests': {
+		'type': 'integer',
+		'min': 1
+	},
+	'seconds': {
+		'type': 'number',
+		'min': 0.1
+	}
+}
+
+validate_profile_schema = LazyValidator(profile_schema)
+
+archive_schema = {
+	'older_than_days': {
+		'type': 'integer',
+		'min': 0
+	},
+	'batch_size': {
+		'type': 'integer',
+		'min': 1
+	},
+	'pause': {
+		'type': 'number',
+		'min': 0
+	}
+}
+
+validate_archive_schema = LazyValidator(archive_schema)
+
+
+class ProfileView(MethodView):
+	"""arms and inspects on-demand profiling of this worker"""
+	decorators = [admin_required]
+
+	def get(self):
+		"""handle GET request for /api/v2/admin/profile"""
+		profiler = current_app.extensions['profiler']
+		session = profiler.session
+
+		return jsonify({
+			'active': session.describe() if session else None,
+			'last_result': profiler.last_result
+		})
+
+	def post(self):
+		"""handle POST request for /api/v2/admin/profile"""
+		post_data = request.get_json()
+
+		if not post_data:
+			abort(400)
+
+		if not validate_profile_schema.validate(post_data):
+			return jsonify({'error': validate_profile_schema.errors}), 400
+
+		if post_data['endpoint'] not in current_app.view_functions:
+			return jsonify({'error': f"unknown endpoint {post_data['endpoint']}"}), 400
+
+		session = current_app.extensions['profiler'].start(
+			post_data['endpoint'],
+			mode=post_data.get('mode', 'cprofile'),
+			requests=post_data.get('requests'),
+			seconds=post_data.get('seconds')
+		)
+
+		if session is None:
+			return jsonify({'error': "a profiling session is already active"}), 409
+
+		return jsonify({'profiling': session.describe()}), 202
+
+
+class ArchiveView(MethodView):
+	"""queues archival of soft-deleted books, see app/archival.py"""
+	decorators = [admin_required]
+
+	def post(self):
+		"""handle POST request for /api/v2/admin/archive"""
+		post_data = request.get_json(silent=True) or {}
+
+		if not validate_archive_schema.validate(post_data):
+			return jsonify({'error': validate_archive_schema.errors}), 400
+
+		config = current_app.config
+		return accepted(enqueue('archive_books', {
+			'older_than_days': post_data.get('older_than_days', config['ARCHIVE_AFTER_DAYS']),
+			'batch_size': post_data.get('batch_size', config['ARCHIVE_BATCH_SIZE']),
+			'pause': post_data.get('pause', config['ARCHIVE_PAUSE_SECONDS'])
+		}))
+
+
+def page_size():
+	"""
+	:return: the `limit` query argument, within ADMIN_MAX_PAGE_SIZE
+	"""
+	config = current_app.config
+	limit = request.args.get('limit', config.get('ADMIN_PAGE_SIZE', 100), type=int)
+	return max(1, min(limit, config.get('ADMIN_MAX_PAGE_SIZE', 1000)))
+
+
+class UsersView(MethodView):
+	"""pages through users, oldest first"""
+	decorators = [admin_required]
+
+	def get(self):
+		"""handle GET request for /api/v2/admin/users?after=<id>&limit=<n>"""
+		limit = page_size()
+		# keyset pages, `next` is the `after` of the following page
+		users = APIUser.query.filter(APIUser.id > request.args.get('after', 0, type=int)) \
+			.order_by(APIUser.id).limit(limit).all()
+
+		return jsonify({
+			'users': [{
+				'id': user.id,
+				'username': user.username,
+				'email': user.email,
+				'is_admin': user.is_admin,
+				'date_created': user.date_created
+			} for user in users],
+			'next': users[-1].id if len(users) == limit else None
+		})
+
+
+class AuditView(MethodView):
+	"""pages through audit events, newest first, see app/audit.py"""
+	decorators = [admin_required]
+
+	def get(self):
+		"""handle GET request for /api/v2/admin/audit?before=<id>&kind=<kind>&user_id=<id>&limit=<n>"""
+		limit = page_size()
+		# every library's events are in one table, an admin sees their own library's
+		query = AuditEvent.query.filter(AuditEvent.tenant == current_tenant())
+
+		before = request.args.get('before', type=int)
+		if before is not None:
+			query = query.filter(AuditEvent.id < before)
+		if request.args.get('kind'):
+			query = query.filter(AuditEvent.kind == request.args['kind'])
+		if request.args.get('user_id', type=int) is not None:
+			query = query.filter(AuditEvent.user_id == request.args.get('user_id', type=int))
+
+		events = query.order_by(AuditEvent.id.desc()).limit(limit).all()
+
+		return jsonify({
+			'events': [{
+				'id': event.id,
+				'kind': event.kind,
+				'user_id': event.user_id,
+				'username': event.username,
+				'remote_addr': event.remote_addr,
+				'tenant': event.tenant,
+				'created_at': event.created_at
+			} for event in events],
+			'next': events[-1].id if len(events) == limit else None,
+			# events still in this worker's buffer are not listed yet
+			'buffer': current_app.extensions['audit'].describe()
+		})
+
+
+profile_view = ProfileView.as_view('profile_view')
+users_view = UsersView.as_view('users_view')
+audit_view = AuditView.as_view('audit_view')
+archive_view = ArchiveView.as_view('archive_view')
+
+admin_blueprint.add_url_rule(
+	'/api/v2/admin/profile',
+	view_func=profile_view,
+	methods=['GET', 'POST'],
+)
+
+admin_blueprint.add_url_rule(
+	'/api/v2/admin/archive',
+	view_func=archive_view,
+	methods=['POST'],
+)
+
+admin_blueprint.add_url_rule(
+	'/api/v2/admin/users',
+	view_func=users_view,
+	methods=['GET'],
+)
+
+admin_blueprint.add_url_rule(
+	'/api/v2/admin/audit',
+	view_func=audit_view,
+	methods=['GET'],
+)
@@ -0,0 +1,75 @@
+"""
+moves soft-deleted books out of bookslist into bookslist_archive
+
+Books are moved in small batches, each in its own short transaction, with a
+pause in between. Rows locked by live requests are skipped rather than
+waited for, so archival never holds up online traffic. A batch that hits a
+lock timeout or a serialization failure is tried again after the pause; any
+other error is raised.
+
+Archival runs in the current tenant's database, the one of the job's
+library, or in the default database without one.
+"""
+import time
+
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app import db
+from app.tenants import current_tenant
+
+# lock_not_available, serialization_failure
+RETRYABLE = ('55P03', '40001')
+
+MOVE_BATCH = text("""
+WITH moved AS (
+	DELETE FROM bookslist
+	WHERE id IN (
+		SELECT id FROM bookslist
+		WHERE deleted_at IS NOT NULL
+			AND deleted_at < current_timestamp - :days * interval '1 day'
+		ORDER BY deleted_at
+		LIMIT :batch_size
+		FOR UPDATE SKIP LOCKED
+	)
+	RETURNING id, title, isbn, date_created, date_modified, deleted_at
+)
+INSERT INTO bookslist_archive (id, title, isbn, date_created, date_modified, deleted_at, archived_at)
+SELECT id, title, isbn, date_created, date_modified, deleted_at, current_timestamp FROM moved
+""")
+
+
+def archive_deleted_books(older_than_days=30, batch_size=500, pause=0.1, lock_timeout_ms=100, max_batches=None):
+	"""
+	archives books deleted more than `older_than_days` ago
+	:param pause: seconds to sleep between batches
+	:param max_batches: stop after this many batches, None runs until done
+	:return: number of books archived
+	"""
+	tenant = current_tenant()
+	# the job running this holds the tenant engine's lease, see run_handler
+	engine = db.engine if tenant is None else current_app.extensions['tenants'].engine(tenant)
+	archived = 0
+	batches = 0
+
+	while max_batches is None or batches < max_batches:
+		try:
+			with engine.begin() as connection:
+				connection.execute(text(f"SET LOCAL lock_timeout = '{int(lock_timeout_ms)}ms'"))
+				moved = connection.execute(MOVE_BATCH, days=older_than_days, batch_size=batch_size).rowcount
+		except OperationalError as e:
+			if getattr(e.orig, 'pgcode', None) not in RETRYABLE:
+				raise
+			# back off and try again
+			moved = None
+
+		batches += 1
+		if moved is not None:
+			archived += moved
+			if moved < batch_size:
+				break
+
+		time.sleep(pause)
+
+	return archived
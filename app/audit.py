@@ -0,0 +1,175 @@
+"""
+audit trail of registrations, logins and logouts
+
+Views call `audit(kind, ...)`, which appends a tuple to an in-memory ring
+buffer and returns; the request does no I/O for it. A background thread
+writes the buffer to audit_events in multi-row INSERTs, every
+AUDIT_FLUSH_INTERVAL seconds or as soon as AUDIT_FLUSH_BATCH events wait.
+
+The buffer holds at most AUDIT_BUFFER_SIZE events. When the database can't
+keep up, the oldest are dropped and counted rather than growing the worker's
+memory or slowing logins down; GET /api/v2/admin/audit reports the counters.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from flask import current_app, g, request
+
+from app import db
+
+logger = logging.getLogger('hello_books.audit')
+
+# of the buffered tuples, which end with the time.time() of the event
+COLUMNS = ('kind', 'user_id', 'username', 'remote_addr', 'tenant')
+
+
+class AuditLog(object):
+	"""ring buffer of audit events and the thread that writes them"""
+
+	def __init__(self, app=None):
+		self.app = None
+		self.buffer = deque()
+		self.capacity = 0
+		self.recorded = 0
+		self.dropped = 0
+		self.written = 0
+		self.pid = None
+		self.lock = threading.Lock()
+		# one batch is written at a time, in order
+		self.flushing = threading.Lock()
+		self.wake = threading.Event()
+		self.stopping = threading.Event()
+
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		self.app = app
+		self.capacity = app.config.get('AUDIT_BUFFER_SIZE', 10000)
+		app.extensions['audit'] = self
+
+	def record(self, kind, user_id=None, username=None):
+		"""
+		queues an event of the current request, dropping the oldest one when
+		the buffer is full
+		"""
+		# this runs on the login path: each context proxy costs a lookup, and
+		# the timestamp is only turned into a datetime by the writer
+		event = (
+			# a failed login names whatever was typed, the column fits 50 characters
+			kind, user_id, username[:50] if username else None,
+			request.remote_addr, g.get('tenant'), time.time())
+
+		with self.lock:
+			if len(self.buffer) >= self.capacity:
+				self.buffer.popleft()
+				self.dropped += 1
+			self.buffer.append(event)
+			self.recorded += 1
+			waiting = len(self.buffer)
+
+		if waiting >= self.app.config.get('AUDIT_FLUSH_BATCH', 500):
+			self.wake.set()
+
+		if self.pid != os.getpid():
+			self.start()
+
+	def take(self, count):
+		with self.lock:
+			return [self.buffer.popleft() for _ in range(min(count, len(self.buffer)))]
+
+	def put_back(self, batch):
+		"""returns an unwritten batch to the front of the buffer, as far as it has room"""
+		with self.lock:
+			room = max(0, self.capacity - len(self.buffer))
+			if len(batch) > room:
+				self.dropped += len(batch) - room
+				batch = batch[len(batch) - room:]
+			self.buffer.extendleft(reversed(batch))
+
+	def flush(self):
+		"""
+		writes the buffered events, in an app context
+		:return: number of events written
+		"""
+		from app.models import AuditEvent
+
+		size = self.app.config.get('AUDIT_FLUSH_BATCH', 500)
+		written = 0
+
+		with self.flushing:
+			while True:
+				batch = self.take(size)
+				if not batch:
+					return written
+
+				try:
+					# one INSERT ... VALUES per batch, executemany would send a statement per row
+					db.session.execute(AuditEvent.__table__.insert().values([
+						dict(zip(COLUMNS, event[:-1]), created_at=datetime.utcfromtimestamp(event[-1]))
+						for event in batch]))
+					db.session.commit()
+				except Exception:
+					# kept for the next flush, until newer events push them out
+					logger.exception("writing %s audit events failed", len(batch))
+					db.session.rollback()
+					self.put_back(batch)
+					return written
+
+				written += len(batch)
+				with self.lock:
+					self.written += len(batch)
+
+	def run(self):
+		interval = self.app.config.get('AUDIT_FLUSH_INTERVAL', 1.0)
+		with self.app.app_context():
+			while not self.stopping.is_set():
+				self.wake.wait(interval)
+				self.wake.clear()
+				self.flush()
+				db.session.remove()
+
+	def start(self):
+		"""starts the writer thread, once per process"""
+		with self.lock:
+			if self.pid == os.getpid():
+				return
+			self.pid = os.getpid()
+
+		if not self.app.config.get('AUDIT_FLUSH_THREAD', True):
+			return
+
+		self.stopping = threading.Event()
+		threading.Thread(target=self.run, name='audit-writer', daemon=True).start()
+		atexit.register(self.close)
+
+	def close(self):
+		"""stops the writer and writes what is left"""
+		self.stopping.set()
+		self.wake.set()
+		with self.app.app_context():
+			self.flush()
+			db.session.remove()
+
+	def describe(self):
+		with self.lock:
+			return {
+				'buffered': len(self.buffer),
+				'capacity': self.capacity,
+				'recorded': self.recorded,
+				'dropped': self.dropped,
+				'written': self.written
+			}
+
+
+def audit(kind, user_id=None, username=None):
+	"""records an audit event of the current request"""
+	app = current_app._get_current_object()
+
+	if app.config.get('AUDIT_ENABLED', True):
+		app.extensions['audit'].record(kind, user_id, username)
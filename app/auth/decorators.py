@@ -0,0 +1,41 @@
+from functools import wraps
+from flask import request, jsonify, g
+from app.models import APIUser
+
+
+def bearer_token():
+	"""
+	:return: the token of a `Authorization: Bearer <token>` header, or None
+	"""
+	auth_header = request.headers.get('Authorization', '')
+
+	if auth_header.startswith('Bearer '):
+		return auth_header[7:]
+
+	return None
+
+
+def admin_required(view):
+	"""only lets requests through whose access token belongs to an admin"""
+
+	@wraps(view)
+	def decorated(*args, **kwargs):
+		token = bearer_token()
+
+		if not token:
+			return jsonify({'error': "Authorization header with a Bearer token is required"}), 401
+
+		user_id = APIUser.decode_token(token)
+
+		if isinstance(user_id, str):
+			return jsonify({'error': user_id}), 401
+
+		user = APIUser.query.get(user_id)
+
+		if not user or not user.is_admin:
+			return jsonify({'error': "admin access required"}), 403
+
+		g.current_user = user
+		return view(*args, **kwargs)
+
+	return decorated
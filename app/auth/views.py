@@ -1,10 +1,18 @@
 from . import auth_blueprint
 from flask.views import MethodView
-from flask import make_response, request, jsonify, abort
+from flask import make_response, request, jsonify, abort, current_app
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from app.models import Booklist, APIUser
-from cerberus import Validator
-from app import db
-import re
+from app.auth.decorators import admin_required, bearer_token
+from app.tracing import span
+from app import db, LazyValidator
+from app.normalization import format_inputs, format_many, legacy_format
+from app.jobs.queue import enqueue, accepted
+from app.audit import audit
 
 login_schema = {
 	'username': {
@@ -40,27 +48,111 @@ user_schema = {
 		'minlength': 2,
 		'regex': '(?=^.{8,}$)((?=.*\d)|(?=.*\W+))(?![.\n])(?=.*[A-Z])(?=.*[a-z]).*$'
 
-	},
-	'is_admin': {
-		'type': 'boolean',
-		'required': False
 	}
 }
 
-validate_user_schema = Validator(user_schema)
-validate_login_schema = Validator(login_schema)
+# admins are only made by provisioning, never by public registration
+provision_schema = dict(user_schema, is_admin={
+	'type': 'boolean',
+	'required': False
+})
+
+refresh_schema = {
+	'refresh_token': {
+		'type': 'string',
+		'required': True,
+		'empty': False
+	}
+}
 
+validate_user_schema = LazyValidator(user_schema)
+validate_login_schema = LazyValidator(login_schema)
+validate_refresh_schema = LazyValidator(refresh_schema)
 
-# useful functions
-def format_inputs(word):
+
+def hash_passwords(passwords, workers=None, method='pbkdf2:sha256'):
 	"""
-	formats input string
-	:param word:
-	:return: string
+	hashes passwords in a thread pool; pbkdf2 runs in hashlib, which releases
+	the GIL, so the hashes are computed on several cores at once
+	:return: list of hashes in the order of passwords
 	"""
-	json_input = word.lower().strip()
-	split_input = re.sub(' +', " ", json_input)
-	return "".join(split_input)
+	with ThreadPoolExecutor(max_workers=workers) as pool:
+		return list(pool.map(partial(generate_password_hash, method=method), passwords))
+
+
+def hash_users(records, workers=None):
+	"""
+	validates users and hashes their passwords in parallel
+	:param records: list of dicts in the shape of provision_schema
+	:return: (rows of the users table, validation errors)
+	"""
+	errors = []
+	valid = []
+	validator = LazyValidator(provision_schema)
+
+	for index, record in enumerate(records):
+		if isinstance(record, dict) and validator.validate(record):
+			valid.append(record)
+		else:
+			errors.append({'index': index, 'error': validator.errors if isinstance(record, dict) else 'not an object'})
+
+	if not valid:
+		return [], errors
+
+	method = current_app.config.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+	hashes = hash_passwords([record['password'] for record in valid], workers, method)
+	usernames = format_many(record['username'] for record in valid)
+	rows = [{
+		'username': username,
+		'email': record['email'],
+		'password_hash': password_hash,
+		'is_admin': record.get('is_admin', False)
+	} for record, username, password_hash in zip(valid, usernames, hashes)]
+	return rows, errors
+
+
+def insert_users(rows, errors=()):
+	"""
+	inserts users hashed by hash_users in a single statement. Users whose
+	username or email is taken, or taken earlier in the batch, are skipped.
+	:return: dict of created usernames, skipped usernames and validation errors
+	"""
+	# both are unique, a user taking either one of an earlier user of the batch is a duplicate
+	usernames, emails = set(), set()
+	unique = []
+	for row in rows:
+		if row['username'] not in usernames and row['email'] not in emails:
+			usernames.add(row['username'])
+			emails.add(row['email'])
+			unique.append(row)
+
+	inserted = set()
+	if unique:
+		statement = insert(APIUser.__table__).values(unique).on_conflict_do_nothing() \
+			.returning(APIUser.username, APIUser.email)
+		inserted.update(tuple(row) for row in db.session.execute(statement))
+		db.session.commit()
+
+	created = []
+	skipped = []
+	for row in rows:
+		key = (row['username'], row['email'])
+		if key in inserted:
+			created.append(row['username'])
+			# later rows with the same username and email are duplicates of this one
+			inserted.discard(key)
+		else:
+			skipped.append(row['username'])
+
+	return {'created': created, 'skipped': skipped, 'errors': list(errors)}
+
+
+def provision_users(records, workers=None):
+	"""
+	validates users, hashes their passwords in parallel and inserts them in a
+	single statement, see hash_users and insert_users
+	"""
+	return insert_users(*hash_users(records, workers))
 
 
 class RegistrationView(MethodView):
@@ -74,50 +166,65 @@ class RegistrationView(MethodView):
 		if not post_data:
 			abort(400)
 
-		# check if uer already exists
-		user = APIUser.query.filter(db.or_(
-			APIUser.username == post_data['username'],
-			APIUser.email == post_data['email']
-		)).first()
-
-		if not user:
-			"""register user"""
-			try:
-				if validate_user_schema.validate(post_data):
-					username = format_inputs(post_data['username'])
-					email = post_data['email']
-					password = post_data['password']
-
-					new_user = APIUser(
-						username=username,
-						password=password,
-						email=email
-					)
+		with span('validation'):
+			valid = validate_user_schema.validate(post_data)
 
-					if 'is_admin' in post_data:
-						new_user.is_admin = post_data['is_admin']
-					new_user.save()
+		if not valid:
+			return jsonify({"error": validate_user_schema.errors}), 401
 
-					return make_response(
-						jsonify({
-							'message': "you successfully registered"
-						})
-					), 201
+		with span('hashing'):
+			new_user = APIUser(
+				username=format_inputs(post_data['username']),
+				password=post_data['password'],
+				email=post_data['email']
+			)
 
-				return jsonify({"error": validate_user_schema.errors}), 401
-
-			except Exception as e:
-				response = {
-					'message': str(e)
-				}
-
-				return make_response(jsonify(response)), 401
+		# the unique indexes on username and email decide whether the user exists
+		try:
+			with span('db'):
+				new_user.save()
+		except IntegrityError:
+			db.session.rollback()
+			return make_response(
+				jsonify({
+					'message': "user already exists. Please login"
+				})
+			), 409
 
+		audit('register', new_user.id, new_user.username)
 		return make_response(
 			jsonify({
-				'message': "user already exists. Please login"
+				'message': "you successfully registered"
 			})
-		), 202
+		), 201
+
+
+class BatchRegistrationView(MethodView):
+	"""lets admins create many users at once"""
+	decorators = [admin_required]
+
+	def post(self):
+		"""handle POST request for /api/v2/auth/users/batch"""
+		post_data = request.get_json()
+
+		if not post_data or not isinstance(post_data.get('users'), list):
+			abort(400)
+
+		limit = current_app.config.get('PROVISION_BATCH_LIMIT', 1000)
+		if len(post_data['users']) > limit:
+			return jsonify({'error': f"at most {limit} users can be created at once"}), 400
+
+		# validated and hashed by a worker, the passwords are kept out of the job's payload
+		users = post_data['users']
+		return accepted(enqueue('provision_users', {'count': len(users)}, secret={'users': users}))
+
+
+def find_user(username, email):
+	return APIUser.query.filter(
+		db.and_(
+			APIUser.username == username,
+			APIUser.email == email,
+		)).first()
 
 
 class Loginview(MethodView):
@@ -130,32 +237,52 @@ class Loginview(MethodView):
 		if not post_data:
 			abort(400)
 
-		user = APIUser.query.filter(
-			db.and_(
-				APIUser.username == post_data['username'],
-				APIUser.email == post_data['email'],
-			)).first()
+		username = post_data['username']
+		if isinstance(username, str):
+			# stored the way RegistrationView formatted it
+			username = format_inputs(username)
+
+		with span('db'):
+			user = find_user(username, post_data['email'])
+			if not user and isinstance(username, str):
+				# users migration 9c2e7b4d1a68 couldn't rename keep the old formatting
+				legacy_username = legacy_format(post_data['username'])
+				if legacy_username != username:
+					user = find_user(legacy_username, post_data['email'])
 
 		if not user:
+			audit('login_failed', username=username if isinstance(username, str) else None)
 			return jsonify({'error': "Invalid username or email. Please try again or register"}), 401
 
 		try:
 
-			if validate_login_schema.validate(post_data):
+			with span('validation'):
+				valid = validate_login_schema.validate(post_data)
+
+			if valid:
 				password = post_data['password']
 
-				if user.verify_password(password=password):
+				with span('hashing'):
+					password_matches = user.verify_password(password=password)
+
+				if password_matches:
 					# Generate the access token. This will be used as the authorization header
-					access_token = user.generate_token(user.id)
+					with span('token'):
+						access_token = user.generate_token(user.id)
+						refresh_token = user.generate_refresh_token(user.id)
 
 					if access_token:
-						return make_response(jsonify(
-							{
-								'message': "successfully logged in",
-								'access_token': access_token.decode()
-							}
-						)), 200
-
+						audit('login', user.id, user.username)
+						with span('serialization'):
+							return make_response(jsonify(
+								{
+									'message': "successfully logged in",
+									'access_token': access_token.decode(),
+									'refresh_token': refresh_token.decode()
+								}
+							)), 200
+
+				audit('login_failed', user.id, user.username)
 				return make_response(
 					jsonify(
 						{
@@ -173,8 +300,76 @@ class Loginview(MethodView):
 			), 500
 
 
+class RefreshView(MethodView):
+	"""exchanges a refresh token for new tokens without checking the password"""
+
+	def post(self):
+		"""handle POST request for /api/v2/auth/refresh"""
+		post_data = request.get_json()
+
+		if not post_data:
+			abort(400)
+
+		if not validate_refresh_schema.validate(post_data):
+			return jsonify({'error': validate_refresh_schema.errors}), 400
+
+		payload = APIUser.decode_payload(post_data['refresh_token'], token_type='refresh')
+
+		if isinstance(payload, str):
+			return jsonify({'error': payload}), 401
+
+		# the user may have been deleted since the token was issued
+		user = APIUser.query.get(payload['sub'])
+		if not user:
+			return jsonify({'error': "Invalid token. Please register or login"}), 401
+
+		# refresh tokens are single use, the old one is revoked on rotation
+		APIUser.revoke_token(payload)
+
+		return make_response(jsonify({
+			'message': "token refreshed",
+			'access_token': user.generate_token(user.id).decode(),
+			'refresh_token': user.generate_refresh_token(user.id).decode()
+		})), 200
+
+
+class LogoutView(MethodView):
+	"""revokes the access token and, when given, the refresh token"""
+
+	def post(self):
+		"""handle POST request for /api/v2/auth/logout"""
+		token = bearer_token()
+
+		if not token:
+			return jsonify({'error': "Authorization header with a Bearer token is required"}), 401
+
+		payload = APIUser.decode_payload(token)
+
+		if isinstance(payload, str):
+			return jsonify({'error': payload}), 401
+
+		post_data = request.get_json(silent=True) or {}
+		refresh_payload = None
+
+		if post_data.get('refresh_token'):
+			refresh_payload = APIUser.decode_payload(post_data['refresh_token'], token_type='refresh')
+
+			if isinstance(refresh_payload, str) or refresh_payload['sub'] != payload['sub']:
+				return jsonify({'error': "Invalid refresh token"}), 401
+
+		APIUser.revoke_token(payload)
+		if refresh_payload:
+			APIUser.revoke_token(refresh_payload)
+
+		audit('logout', payload['sub'])
+		return jsonify({'message': "successfully logged out"}), 200
+
+
 registration_view = RegistrationView.as_view('register_view')
 login_view = Loginview.as_view('login_view')
+refresh_view = RefreshView.as_view('refresh_view')
+logout_view = LogoutView.as_view('logout_view')
+batch_registration_view = BatchRegistrationView.as_view('batch_registration_view')
 
 auth_blueprint.add_url_rule(
 	'/api/v2/auth/register',
@@ -187,3 +382,21 @@ auth_blueprint.add_url_rule(
 	view_func=login_view,
 	methods=['POST'],
 )
+
+auth_blueprint.add_url_rule(
+	'/api/v2/auth/refresh',
+	view_func=refresh_view,
+	methods=['POST'],
+)
+
+auth_blueprint.add_url_rule(
+	'/api/v2/auth/logout',
+	view_func=logout_view,
+	methods=['POST'],
+)
+
+auth_blueprint.add_url_rule(
+	'/api/v2/auth/users/batch',
+	view_func=batch_registration_view,
+	methods=['POST'],
+)
@@ -0,0 +1,20 @@
+"""
+shared-state backends used by the in-process helpers (rate limits, revocation)
+"""
+
+try:
+	import redis
+except ImportError:  # pragma: no cover
+	redis = None
+
+
+def redis_from_url(url):
+	"""
+	creates a Redis protocol client for a storage url
+	:param url: redis://host:port/db
+	:return: redis client
+	"""
+	if redis is None:
+		raise RuntimeError(f"the 'redis' package is required to use {url}")
+
+	return redis.StrictRedis.from_url(url)
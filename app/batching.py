@@ -0,0 +1,263 @@
+"""
+group commit for book writes
+
+With GROUP_COMMIT_ENABLED, book creates and title updates are queued to a
+flusher thread instead of being committed by the request. The flusher
+collects the writes that arrive within GROUP_COMMIT_MAX_WAIT_MS, up to
+GROUP_COMMIT_MAX_BATCH of them, and applies them in one transaction: one
+multi-row INSERT for the creates and one UPDATE ... FROM (VALUES ...) for the
+updates. Each waiting request then gets its own row or error back.
+Writes of different tenants are committed separately, each in its library.
+
+A request waits GROUP_COMMIT_TIMEOUT seconds for its write, then gets a
+TimeoutError and answers 503; the write may still be applied after that. If
+the flusher thread dies, the writes it held fail at once and the next write
+starts a new thread, which takes over the queue.
+"""
+import os
+import queue
+import threading
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+
+from app import db
+from app.tenants import current_tenant
+
+
+class DuplicateISBN(Exception):
+	"""a live book already has this isbn"""
+
+
+class PendingWrite(object):
+	__slots__ = ('kind', 'values', 'tenant', 'done', 'result', 'error')
+
+	def __init__(self, kind, values, tenant=None):
+		self.kind = kind
+		self.values = values
+		self.tenant = tenant
+		self.done = threading.Event()
+		self.result = None
+		self.error = None
+
+	def resolve(self, result=None, error=None):
+		self.result = result
+		self.error = error
+		self.done.set()
+
+
+RETURNING = ('id', 'title', 'isbn', 'date_created', 'date_modified')
+
+
+class GroupCommitter(object):
+	"""coalesces concurrent book writes into shared transactions"""
+
+	STOP = object()
+
+	def __init__(self, app, max_batch=100, max_wait=0.002, timeout=5.0):
+		self.app = app
+		self.max_batch = max_batch
+		self.max_wait = max_wait
+		self.timeout = timeout
+		self.queue = queue.Queue()
+		self.thread = None
+		self.pid = None
+		self.lock = threading.Lock()
+		self.batches = 0
+		self.writes = 0
+
+	@classmethod
+	def from_config(cls, app):
+		return cls(
+			app,
+			max_batch=app.config.get('GROUP_COMMIT_MAX_BATCH', 100),
+			max_wait=app.config.get('GROUP_COMMIT_MAX_WAIT_MS', 2) / 1000.0,
+			timeout=app.config.get('GROUP_COMMIT_TIMEOUT', 5.0))
+
+	def create(self, title, isbn):
+		"""
+		:param isbn: an ISBN-13, see app.isbn.canonical
+		:return: dict of the created book
+		:raises DuplicateISBN: if a book with the isbn exists
+		"""
+		return self.submit('create', {'title': title, 'isbn': isbn, 'isbn_key': int(isbn)})
+
+	def update(self, id, title):
+		"""
+		:return: dict of the updated book, None if it doesn't exist
+		"""
+		return self.submit('update', {'id': id, 'title': title})
+
+	def submit(self, kind, values):
+		self.ensure_running()
+		pending = PendingWrite(kind, values, current_tenant())
+		self.queue.put(pending)
+
+		if not pending.done.wait(self.timeout):
+			raise TimeoutError('group commit timed out')
+		if pending.error is not None:
+			raise pending.error
+		return pending.result
+
+	def ensure_running(self):
+		# threads don't survive fork, each worker process starts its own
+		if self.pid == os.getpid() and self.thread.is_alive():
+			return
+
+		with self.lock:
+			if self.pid != os.getpid():
+				# the parent's queued writes are answered by the parent
+				self.queue = queue.Queue()
+			if self.pid != os.getpid() or not self.thread.is_alive():
+				self.thread = threading.Thread(target=self.run, name='group-commit', daemon=True)
+				self.thread.start()
+				self.pid = os.getpid()
+
+	def stop(self):
+		if self.thread is not None and self.thread.is_alive():
+			self.queue.put(self.STOP)
+			self.thread.join()
+
+	def collect(self):
+		"""
+		:return: the next batch, None once stopped
+		"""
+		first = self.queue.get()
+		if first is self.STOP:
+			return None
+
+		batch = [first]
+		try:
+			# writes already queued join without waiting
+			while len(batch) < self.max_batch:
+				batch.append(self.queue.get_nowait())
+		except queue.Empty:
+			pass
+
+		try:
+			while len(batch) < self.max_batch:
+				batch.append(self.queue.get(timeout=self.max_wait))
+		except queue.Empty:
+			pass
+
+		if self.STOP in batch:
+			batch.remove(self.STOP)
+			self.queue.put(self.STOP)
+		return batch
+
+	def engine(self, tenant):
+		"""
+		:return: the engine to commit the tenant's writes with, leased until
+		release(tenant)
+		"""
+		if tenant is None:
+			with self.app.app_context():
+				return db.engine
+		return self.app.extensions['tenants'].engine(tenant, lease=True)
+
+	def release(self, tenant):
+		if tenant is not None:
+			self.app.extensions['tenants'].release(tenant)
+
+	def run(self):
+		while True:
+			batch = self.collect()
+			if batch is None:
+				return
+
+			try:
+				self.commit_batch(batch)
+			except BaseException as e:
+				# the thread is going down, its writes mustn't wait for the timeout
+				for pending in batch:
+					if not pending.done.is_set():
+						pending.resolve(error=e)
+				raise
+
+			self.batches += 1
+			self.writes += len(batch)
+
+	def commit_batch(self, batch):
+		tenants = {}
+		for pending in batch:
+			tenants.setdefault(pending.tenant, []).append(pending)
+
+		for tenant, writes in tenants.items():
+			self.commit_tenant(tenant, writes)
+
+	def commit_tenant(self, tenant, writes):
+		try:
+			engine = self.engine(tenant)
+		except Exception as e:
+			for pending in writes:
+				pending.resolve(error=e)
+			return
+
+		try:
+			self.commit(engine, writes)
+		except Exception:
+			# one bad write must not fail the others, retry them one by one
+			for pending in writes:
+				try:
+					self.commit(engine, [pending])
+				except Exception as e:
+					pending.resolve(error=e)
+		finally:
+			self.release(tenant)
+
+	def commit(self, engine, batch):
+		with engine.begin() as connection:
+			resolved = self.apply(connection, batch)
+
+		# answered only once the transaction has committed
+		for pending, result, error in resolved:
+			pending.resolve(result, error)
+
+	def apply(self, connection, batch):
+		"""
+		:return: list of (pending write, result, error)
+		"""
+		creates = [pending for pending in batch if pending.kind == 'create']
+		updates = [pending for pending in batch if pending.kind == 'update']
+		resolved = []
+
+		if creates:
+			table = db.metadata.tables['bookslist']
+			statement = insert(table).values([pending.values for pending in creates]) \
+				.on_conflict_do_nothing() \
+				.returning(*[table.c[column] for column in RETURNING])
+			rows = {row['isbn']: dict(row) for row in connection.execute(statement)}
+
+			for pending in creates:
+				# the first write of an isbn in the batch gets the row
+				row = rows.pop(pending.values['isbn'], None)
+				if row is None:
+					resolved.append((pending, None, DuplicateISBN(pending.values['isbn'])))
+				else:
+					resolved.append((pending, row, None))
+
+		if updates:
+			# the last update of a book wins, as if the writes ran in order
+			latest = {}
+			for pending in updates:
+				latest[pending.values['id']] = pending.values['title']
+
+			params = {}
+			values = []
+			for index, (id, title) in enumerate(latest.items()):
+				params[f'id_{index}'] = id
+				params[f'title_{index}'] = title
+				values.append(f'(:id_{index}, :title_{index})')
+
+			statement = text(
+				"UPDATE bookslist SET title = v.title, date_modified = current_timestamp "
+				f"FROM (VALUES {', '.join(values)}) AS v(id, title) "
+				"WHERE bookslist.id = v.id::integer AND bookslist.deleted_at IS NULL "
+				f"RETURNING {', '.join('bookslist.' + c for c in RETURNING)}"
+			)
+			rows = {row['id']: dict(row) for row in connection.execute(statement, **params)}
+
+			for pending in updates:
+				resolved.append((pending, rows.get(pending.values['id']), None))
+
+		return resolved
@@ -0,0 +1,56 @@
+"""
+streaming export of users, for `manage.py users export`
+"""
+import csv
+import json
+
+from app import db
+
+USER_FIELDS = ('id', 'username', 'email', 'is_admin', 'date_created')
+
+
+def iter_users(batch_size=1000):
+	"""
+	yields users as dicts, without password hashes, a batch of rows at a time
+	"""
+	from app.models import APIUser
+
+	columns = [getattr(APIUser, field) for field in USER_FIELDS]
+	last_id = 0
+
+	while True:
+		# keyset pages, each as cheap as the first however far the export is
+		rows = db.session.query(*columns).filter(APIUser.id > last_id) \
+			.order_by(APIUser.id).limit(batch_size).all()
+		if not rows:
+			return
+		last_id = rows[-1].id
+
+		for row in rows:
+			user = dict(zip(USER_FIELDS, row))
+			user['date_created'] = user['date_created'].isoformat() if user['date_created'] else None
+			yield user
+
+		# the batch's rows needn't stay in the session
+		db.session.rollback()
+
+
+def export_users(out, fmt='ndjson', batch_size=1000):
+	"""
+	writes every user to `out`, one JSON object per line or as CSV
+	:return: number of users written
+	"""
+	count = 0
+
+	if fmt == 'csv':
+		writer = csv.DictWriter(out, fieldnames=USER_FIELDS)
+		writer.writeheader()
+		for user in iter_users(batch_size):
+			writer.writerow(user)
+			count += 1
+	else:
+		for user in iter_users(batch_size):
+			out.write(json.dumps(user) + '\n')
+			count += 1
+
+	return count
@@ -0,0 +1,83 @@
+from . import health_blueprint
+from flask.views import MethodView
+from flask import jsonify, current_app
+from functools import lru_cache
+import os
+
+from app import db
+
+
+@lru_cache(maxsize=None)
+def migration_heads(directory):
+	"""
+	:return: the head revisions in the migration scripts, read once per process
+	"""
+	from alembic.script import ScriptDirectory
+	return frozenset(ScriptDirectory(directory).get_heads())
+
+
+def migrations_directory(app):
+	return app.config.get('MIGRATIONS_DIR') or os.path.join(os.path.dirname(app.root_path), 'migrations')
+
+
+def check_database(connection):
+	connection.execute('SELECT 1')
+	return {'status': 'ok'}
+
+
+def check_migrations(connection):
+	heads = migration_heads(migrations_directory(current_app))
+	current = frozenset(row[0] for row in connection.execute('SELECT version_num FROM alembic_version'))
+
+	if current != heads:
+		return {'status': 'failed', 'current': sorted(current), 'head': sorted(heads)}
+	return {'status': 'ok', 'current': sorted(current)}
+
+
+class HealthzView(MethodView):
+	"""liveness: the worker is answering, the database is not touched"""
+
+	def get(self):
+		"""handle GET request for /healthz"""
+		return jsonify({'status': 'ok'})
+
+
+class ReadyzView(MethodView):
+	"""readiness: the worker can reach the database, which is migrated, and is warm"""
+
+	def get(self):
+		"""handle GET request for /readyz"""
+		warmup = current_app.extensions['warmup']
+		# workers start warming up when forked, other servers on the first probe
+		warmup.start()
+
+		checks = {}
+		try:
+			with db.engine.connect() as connection:
+				checks['database'] = check_database(connection)
+				if current_app.config.get('HEALTH_CHECK_MIGRATIONS', True):
+					checks['migrations'] = check_migrations(connection)
+		except Exception as e:
+			# the check that failed is the first one without a result
+			checks['migrations' if 'database' in checks else 'database'] = {'status': 'failed', 'error': str(e)}
+
+		checks['warmup'] = dict(warmup.describe(), status='ok' if warmup.finished else 'pending')
+
+		ready = all(check['status'] == 'ok' for check in checks.values())
+		return jsonify({'status': 'ready' if ready else 'unavailable', 'checks': checks}), 200 if ready else 503
+
+
+healthz_view = HealthzView.as_view('healthz_view')
+readyz_view = ReadyzView.as_view('readyz_view')
+
+health_blueprint.add_url_rule(
+	'/healthz',
+	view_func=healthz_view,
+	methods=['GET'],
+)
+
+health_blueprint.add_url_rule(
+	'/readyz',
+	view_func=readyz_view,
+	methods=['GET'],
+)
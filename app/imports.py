@@ -0,0 +1,86 @@
+"""
+bulk import of books, run as an `import_books` job
+"""
+from sqlalchemy.dialects.postgresql import insert
+
+from app import db, LazyValidator
+from app.isbn import validate_many, from_key
+from app.normalization import format_many
+
+import_book_schema = {
+	'title': {
+		'type': 'string',
+		'required': True,
+		'empty': False,
+		'maxlength': 150
+	},
+	'isbn': {
+		'type': 'string',
+		'required': True
+	}
+}
+
+validate_import_book_schema = LazyValidator(import_book_schema)
+
+
+def import_books(records, batch_size=1000, offset=0, batch=None):
+	"""
+	validates books and inserts them, `batch_size` per statement, in one
+	transaction. Books whose isbn a live book already has, or an earlier book
+	of the import, are skipped.
+	:param records: list of dicts in the shape of import_book_schema
+	:param offset: index of the first record in the whole import, errors are numbered from it
+	:param batch: unique id of these records; a batch already imported isn't
+	inserted again, its first result is returned
+	:return: dict of the number created, the skipped isbns and the errors
+	"""
+	from app.models import Booklist, ImportBatch
+
+	if batch is not None:
+		done = db.session.query(ImportBatch.result).filter(ImportBatch.id == batch).scalar()
+		if done is not None:
+			return done
+
+	errors = []
+	valid = []
+
+	for index, record in enumerate(records, offset):
+		if isinstance(record, dict) and validate_import_book_schema.validate(record):
+			valid.append((index, record))
+		else:
+			error = validate_import_book_schema.errors if isinstance(record, dict) else 'not an object'
+			errors.append({'index': index, 'error': error})
+
+	keys, ok = validate_many([record['isbn'] for _, record in valid])
+	titles = format_many(record['title'] for _, record in valid)
+	rows = []
+
+	for (index, record), key, is_valid, title in zip(valid, keys.tolist(), ok.tolist(), titles):
+		if is_valid:
+			rows.append({'title': title, 'isbn': from_key(key), 'isbn_key': key})
+		else:
+			errors.append({'index': index, 'error': {'isbn': ['invalid isbn']}})
+
+	created = set()
+	table = Booklist.__table__
+	for start in range(0, len(rows), batch_size):
+		statement = insert(table).values(rows[start:start + batch_size]) \
+			.on_conflict_do_nothing() \
+			.returning(table.c.isbn_key)
+		created.update(row[0] for row in db.session.execute(statement))
+
+	errors.sort(key=lambda error: error['index'])
+	skipped = []
+	for row in rows:
+		if row['isbn_key'] in created:
+			# later rows with the same isbn are duplicates of this one
+			created.discard(row['isbn_key'])
+		else:
+			skipped.append(row['isbn'])
+
+	result = {'created': len(rows) - len(skipped), 'skipped': skipped, 'errors': errors}
+	if batch is not None:
+		# committed with the books: a retry after the commit finds it, one before it starts over
+		db.session.add(ImportBatch(batch, result))
+	db.session.commit()
+	return result
@@ -0,0 +1,156 @@
+"""
+ISBN validation and canonicalization
+
+Books are stored under their ISBN-13, whichever form was submitted, and keyed
+by its integer value so an ISBN-10 and the matching ISBN-13 are the same book.
+`canonical` checks one ISBN for the routes, `validate_many` checks many at
+once with NumPy for bulk imports.
+"""
+import re
+
+SEPARATORS = re.compile(r'[ -]+')
+ISBN10 = re.compile(r'[0-9]{9}[0-9X]')
+ISBN13 = re.compile(r'[0-9]{13}')
+# the EAN-13 prefixes of books, other EAN-13s pass the check digit too
+BOOKLAND = ('978', '979')
+
+# weights of the ISBN-13 digits, alternating 1 and 3
+WEIGHTS_13 = (1, 3) * 6 + (1,)
+
+# rows validated at a time by validate_many, bounds its temporary arrays
+CHUNK = 1 << 18
+
+
+class InvalidISBN(ValueError):
+	"""the isbn is malformed or its check digit is wrong"""
+
+
+def check_digit_10(body):
+	"""
+	:param body: the first 9 digits of an ISBN-10
+	:return: the check digit, '0'-'9' or 'X'
+	"""
+	total = sum((10 - i) * int(digit) for i, digit in enumerate(body))
+	check = (11 - total % 11) % 11
+	return 'X' if check == 10 else str(check)
+
+
+def check_digit_13(body):
+	"""
+	:param body: the first 12 digits of an ISBN-13
+	:return: the check digit
+	"""
+	total = sum(weight * int(digit) for weight, digit in zip(WEIGHTS_13, body))
+	return str((10 - total % 10) % 10)
+
+
+def canonical(isbn):
+	"""
+	:param isbn: an ISBN-10 or ISBN-13, hyphens and spaces are ignored
+	:return: the ISBN-13
+	:raises InvalidISBN: with the reason
+	"""
+	if not isinstance(isbn, str):
+		raise InvalidISBN('isbn must be a string')
+
+	digits = SEPARATORS.sub('', isbn).upper()
+
+	if len(digits) == 10:
+		if not ISBN10.fullmatch(digits):
+			raise InvalidISBN('isbn must only include numbers')
+		if check_digit_10(digits[:9]) != digits[9]:
+			raise InvalidISBN('isbn check digit is wrong')
+		body = '978' + digits[:9]
+		return body + check_digit_13(body)
+
+	if len(digits) == 13:
+		if not ISBN13.fullmatch(digits):
+			raise InvalidISBN('isbn must only include numbers')
+		if not digits.startswith(BOOKLAND):
+			raise InvalidISBN('isbn-13 must start with 978 or 979')
+		if check_digit_13(digits[:12]) != digits[12]:
+			raise InvalidISBN('isbn check digit is wrong')
+		return digits
+
+	raise InvalidISBN('isbn must have 10 or 13 digits')
+
+
+def isbn_key(isbn):
+	"""
+	:return: the ISBN-13 of `isbn` as an integer, fits a BIGINT column
+	:raises InvalidISBN:
+	"""
+	return int(canonical(isbn))
+
+
+def from_key(key):
+	"""
+	:return: the ISBN-13 string of an isbn key
+	"""
+	return f'{key:013d}'
+
+
+def validate_many(isbns):
+	"""
+	vectorized `isbn_key` for bulk imports
+	:param isbns: sequence of str, or a NumPy bytes or str array
+	:return: (keys, valid) NumPy arrays; the keys of invalid isbns are 0
+	"""
+	import numpy as np
+
+	raw = np.asarray(isbns)
+	if raw.dtype.kind == 'U':
+		try:
+			raw = raw.astype(f'S{max(raw.dtype.itemsize // 4, 1)}')
+		except UnicodeEncodeError:
+			raw = None
+	if raw is None or raw.dtype.kind != 'S':
+		# an isbn is ascii, non-ascii text and non-strings fail validation below
+		raw = np.array([
+			value.encode('ascii', 'replace') if isinstance(value, str) else b''
+			for value in isbns
+		], dtype='S')
+
+	keys = np.zeros(len(raw), dtype=np.int64)
+	valid = np.zeros(len(raw), dtype=bool)
+
+	for start in range(0, len(raw), CHUNK):
+		chunk = raw[start:start + CHUNK]
+		keys[start:start + len(chunk)], valid[start:start + len(chunk)] = _validate_chunk(np, chunk)
+
+	return keys, valid
+
+
+def _validate_chunk(np, raw):
+	width = max(raw.dtype.itemsize, 13)
+	chars = np.zeros((len(raw), width), dtype=np.uint8)
+	chars[:, :raw.dtype.itemsize] = raw.view(np.uint8).reshape(len(raw), raw.dtype.itemsize)
+	chars[chars == ord('x')] = ord('X')
+
+	skipped = (chars == ord('-')) | (chars == ord(' ')) | (chars == 0)
+	if (skipped[:, :-1] & ~skipped[:, 1:]).any():
+		# separators inside an isbn, move the other characters to the front in order
+		order = np.argsort(skipped, axis=1, kind='stable')
+		chars = np.take_along_axis(chars, order, axis=1)
+	length = width - skipped.sum(axis=1)
+
+	digits = chars[:, :13].astype(np.int64) - ord('0')
+	is_digit = (digits >= 0) & (digits <= 9)
+	weights_13 = np.array(WEIGHTS_13, dtype=np.int64)
+
+	bookland = (digits[:, 0] == 9) & (digits[:, 1] == 7) & ((digits[:, 2] == 8) | (digits[:, 2] == 9))
+	valid_13 = (length == 13) & is_digit.all(axis=1) & bookland & ((digits @ weights_13) % 10 == 0)
+	key_13 = digits @ (10 ** np.arange(12, -1, -1, dtype=np.int64))
+
+	is_x = chars[:, 9] == ord('X')
+	last = np.where(is_x, 10, digits[:, 9])
+	valid_10 = (length == 10) & is_digit[:, :9].all(axis=1) & (is_digit[:, 9] | is_x) \
+		& ((digits[:, :9] @ np.arange(10, 1, -1, dtype=np.int64) + last) % 11 == 0)
+	# prefix 978, then the first 9 digits of the ISBN-10 and a new check digit
+	body = 978 * 10 ** 9 + digits[:, :9] @ (10 ** np.arange(8, -1, -1, dtype=np.int64))
+	total = 9 + 7 * 3 + 8 + digits[:, :9] @ weights_13[3:12]
+	key_10 = body * 10 + (10 - total % 10) % 10
+
+	valid = valid_13 | valid_10
+	keys = np.where(valid_13, key_13, np.where(valid_10, key_10, 0))
+	return keys, valid
@@ -0,0 +1,5 @@
+from flask import Blueprint
+
+jobs_blueprint = Blueprint('jobs', __name__)
+
+from . import views, handlers
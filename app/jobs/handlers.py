@@ -0,0 +1,24 @@
+"""
+the kinds of jobs a worker can run. Handlers take the job payload and return
+a JSON-serializable result, raising to have the job retried.
+"""
+from .queue import handler
+
+
+@handler('provision_users')
+def provision_users(payload):
+	# the users, passwords included, are the job's secret, see BatchRegistrationView
+	from app.auth.views import provision_users
+	return provision_users(payload['users'])
+
+
+@handler('import_books')
+def import_books(payload):
+	from app.imports import import_books
+	return import_books(payload['books'], offset=payload.get('offset', 0), batch=payload.get('batch'))
+
+
+@handler('archive_books')
+def archive_books(payload):
+	from app.archival import archive_deleted_books
+	return {'archived': archive_deleted_books(**payload)}
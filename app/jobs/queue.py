@@ -0,0 +1,304 @@
+"""
+durable job queue stored in the jobs table
+
+Requests enqueue work and answer 202; `manage.py worker` claims due jobs
+with SELECT ... FOR UPDATE SKIP LOCKED, so any number of worker threads and
+processes share the queue without handing out a job twice. A claimed job is
+leased for JOB_LEASE_SECONDS, and the lease is extended every
+JOB_HEARTBEAT_SECONDS while its handler runs; if its worker dies, another one
+takes it over once the lease runs out, unless that was its last attempt.
+Failed jobs are retried with exponential backoff until they run out of
+attempts.
+
+Jobs of every tenant share the queue in the default database; a job's
+handler runs with its tenant set, so its queries go to that library.
+
+What a job needs but must not show, passwords say, is queued as its secret:
+a job_secrets row merged into the payload when the handler runs, and
+deleted with the job's last attempt, so jobs.payload only holds what the
+jobs API and logs may show.
+"""
+import logging
+import os
+import socket
+import threading
+from datetime import timedelta
+from uuid import uuid4
+
+from flask import current_app, g, jsonify, url_for
+from sqlalchemy import text
+
+from app import db
+from app.models import Job, JobSecret
+from app.streaming import batches
+from app.tenants import current_tenant
+
+logger = logging.getLogger('hello_books.jobs')
+
+# kind -> function(payload) returning a JSON-serializable result
+HANDLERS = {}
+
+CLAIM = text("""
+UPDATE jobs
+SET status = 'running', attempts = attempts + 1, worker = :worker,
+	started_at = current_timestamp, locked_until = current_timestamp + :lease * interval '1 second'
+WHERE id = (
+	SELECT id FROM jobs
+	WHERE (status = 'queued' AND run_at <= current_timestamp)
+		OR (status = 'running' AND locked_until < current_timestamp AND attempts < max_attempts)
+	ORDER BY run_at, id
+	LIMIT 1
+	FOR UPDATE SKIP LOCKED
+)
+RETURNING id
+""")
+
+# a worker that died on a job's last attempt leaves it running, it is failed instead of taken over
+EXPIRE = text("""
+WITH expired AS (
+	UPDATE jobs
+	SET status = 'failed', locked_until = NULL, finished_at = current_timestamp,
+		error = 'lease ran out on the last attempt'
+	WHERE status = 'running' AND locked_until < current_timestamp AND attempts >= max_attempts
+	RETURNING id
+)
+DELETE FROM job_secrets WHERE job_id IN (SELECT id FROM expired)
+""")
+
+HEARTBEAT = text("""
+UPDATE jobs
+SET locked_until = current_timestamp + :lease * interval '1 second'
+WHERE id = :id AND status = 'running' AND worker = :worker
+""")
+
+
+def handler(kind):
+	"""registers the decorated function as the handler of `kind` jobs"""
+	def register(function):
+		HANDLERS[kind] = function
+		return function
+	return register
+
+
+def enqueue(kind, payload, secret=None):
+	"""
+	:param secret: dict merged into the payload when the job runs, kept out of jobs.payload
+	:return: the queued Job, committed
+	"""
+	if kind not in HANDLERS:
+		raise LookupError(f'no handler for {kind} jobs')
+
+	job = Job(kind, payload, max_attempts=current_app.config.get('JOB_MAX_ATTEMPTS', 3), tenant=current_tenant())
+	if secret is not None:
+		db.session.add(job)
+		db.session.flush()
+		db.session.add(JobSecret(job.id, secret))
+	job.save()
+	return job
+
+
+def enqueue_batches(kind, key, items, batch_size):
+	"""
+	queues a job per `batch_size` items, in one transaction: when `items`
+	raises, none is queued. Each payload holds its items under `key` and the
+	index of the first one under 'offset', and a unique 'batch' id that
+	lets the handler apply the batch only once when the job is retried.
+	:return: the ids of the queued jobs
+	"""
+	if kind not in HANDLERS:
+		raise LookupError(f'no handler for {kind} jobs')
+
+	max_attempts = current_app.config.get('JOB_MAX_ATTEMPTS', 3)
+	tenant = current_tenant()
+	ids = []
+	offset = 0
+	try:
+		for batch in batches(items, batch_size):
+			job = Job(kind, {key: batch, 'offset': offset, 'batch': uuid4().hex}, max_attempts=max_attempts,
+					  tenant=tenant)
+			db.session.add(job)
+			db.session.flush()
+			ids.append(job.id)
+			# the payload is sent, the session needn't keep it
+			db.session.expunge(job)
+			offset += len(batch)
+		db.session.commit()
+	except Exception:
+		db.session.rollback()
+		raise
+	return ids
+
+
+def job_json(job):
+	return {
+		'id': job.id,
+		'kind': job.kind,
+		'status': job.status,
+		'attempts': job.attempts,
+		'max_attempts': job.max_attempts,
+		'result': job.result,
+		'error': job.error,
+		'date_created': job.date_created,
+		'started_at': job.started_at,
+		'finished_at': job.finished_at
+	}
+
+
+def accepted(job):
+	"""
+	:return: 202 response pointing at the status of a queued job
+	"""
+	response = jsonify({'job': job_json(job)})
+	response.status_code = 202
+	response.headers['Location'] = url_for('jobs.job_view', id=job.id)
+	return response
+
+
+def worker_name():
+	return f'{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}'
+
+
+def run_handler(job):
+	"""runs the job's handler with the job's tenant, whose database its queries go to"""
+	secret = JobSecret.query.get(job.id)
+	payload = dict(job.payload, **secret.data) if secret is not None else job.payload
+
+	router = current_app.extensions['tenants']
+	if job.tenant is not None:
+		# kept from eviction while the handler uses it
+		router.engine(job.tenant, lease=True)
+
+	previous = g.get('tenant')
+	g.tenant = job.tenant
+	try:
+		return HANDLERS[job.kind](payload)
+	finally:
+		g.tenant = previous
+		if job.tenant is not None:
+			router.release(job.tenant)
+
+
+class Heartbeat(object):
+	"""extends the lease of a running job every `interval` seconds, on a connection of its own"""
+
+	def __init__(self, engine, job_id, worker, lease, interval):
+		self.engine = engine
+		self.params = {'id': job_id, 'worker': worker, 'lease': lease}
+		self.interval = interval
+		self.stopped = threading.Event()
+		self.thread = threading.Thread(target=self.run, name=f'job-heartbeat-{job_id}', daemon=True)
+
+	def __enter__(self):
+		self.thread.start()
+		return self
+
+	def __exit__(self, *exc_info):
+		self.stopped.set()
+		self.thread.join()
+
+	def run(self):
+		while not self.stopped.wait(self.interval):
+			try:
+				with self.engine.begin() as connection:
+					connection.execute(HEARTBEAT, self.params)
+			except Exception:
+				# the next beat may get through before the lease runs out
+				logger.exception("extending the lease of job %s failed", self.params['id'])
+
+
+def run_one():
+	"""
+	claims the next due job and runs it, inside an app context
+	:return: True if a job ran, False if none was due
+	"""
+	config = current_app.config
+	lease = config.get('JOB_LEASE_SECONDS', 300)
+	worker = worker_name()
+	db.session.execute(EXPIRE)
+	job_id = db.session.execute(CLAIM, {'worker': worker, 'lease': lease}).scalar()
+	db.session.commit()
+
+	if job_id is None:
+		return False
+
+	job = Job.query.get(job_id)
+	try:
+		with Heartbeat(db.engine, job_id, worker, lease, config.get('JOB_HEARTBEAT_SECONDS', lease / 3)):
+			result = run_handler(job)
+	except Exception as e:
+		logger.exception("job %s (%s) failed on attempt %s", job.id, job.kind, job.attempts)
+		db.session.rollback()
+
+		job = Job.query.get(job_id)
+		job.error = f'{type(e).__name__}: {e}'
+		job.locked_until = None
+		if job.attempts < job.max_attempts:
+			job.status = 'queued'
+			job.run_at = db.func.current_timestamp() + timedelta(seconds=2 ** job.attempts)
+		else:
+			job.status = 'failed'
+			job.finished_at = db.func.current_timestamp()
+	else:
+		job.status = 'done'
+		job.result = result
+		job.error = None
+		job.locked_until = None
+		job.finished_at = db.func.current_timestamp()
+
+	if job.status != 'queued':
+		# no attempt is left to need it
+		JobSecret.query.filter_by(job_id=job.id).delete()
+	job.save()
+	return True
+
+
+def run_pending(limit=None):
+	"""
+	runs due jobs in this thread until none is left, or `limit` ran
+	:return: number of jobs run
+	"""
+	ran = 0
+	while (limit is None or ran < limit) and run_one():
+		ran += 1
+	return ran
+
+
+class JobWorker(object):
+	"""runs jobs in `concurrency` threads until stopped"""
+
+	def __init__(self, app, concurrency=1, poll_interval=1.0):
+		self.app = app
+		self.concurrency = max(1, concurrency)
+		self.poll_interval = poll_interval
+		self.stopping = threading.Event()
+
+	def loop(self):
+		with self.app.app_context():
+			while not self.stopping.is_set():
+				try:
+					ran = run_one()
+				except Exception:
+					# the database went away, keep polling until it is back
+					logger.exception("claiming a job failed")
+					db.session.remove()
+					ran = False
+
+				if not ran:
+					self.stopping.wait(self.poll_interval)
+
+	def run(self):
+		threads = [
+			threading.Thread(target=self.loop, name=f'job-worker-{index}')
+			for index in range(self.concurrency)
+		]
+		for thread in threads:
+			thread.start()
+		logger.info("job worker %s running %s threads", os.getpid(), self.concurrency)
+
+		# jobs in progress finish before the threads exit
+		for thread in threads:
+			while thread.is_alive():
+				thread.join(0.5)
+
+	def stop(self, *args):
+		self.stopping.set()
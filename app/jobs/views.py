@@ -0,0 +1,31 @@
+from . import jobs_blueprint
+from flask.views import MethodView
+from flask import jsonify, abort
+from app.auth.decorators import admin_required
+from app.models import Job
+from app.tenants import current_tenant
+from .queue import job_json
+
+
+class JobView(MethodView):
+	"""reports the status and result of a background job"""
+	decorators = [admin_required]
+
+	def get(self, id):
+		"""handle GET request for /api/v2/jobs/<id>"""
+		# the queue is shared, a library only sees its own jobs
+		job = Job.query.filter(Job.id == id, Job.tenant == current_tenant()).first()
+
+		if not job:
+			abort(404)
+
+		return jsonify({'job': job_json(job)})
+
+
+job_view = JobView.as_view('job_view')
+
+jobs_blueprint.add_url_rule(
+	'/api/v2/jobs/<int:id>',
+	view_func=job_view,
+	methods=['GET'],
+)
@@ -0,0 +1,76 @@
+"""
+request body size limits
+
+Bodies are refused with 413 before the view runs when they are larger than
+MAX_CONTENT_LENGTH, or than ROUTE_BODY_LIMITS of their endpoint, which lets
+bulk endpoints that stream their body take more than the rest. A body sent
+chunked, with no Content-Length, is cut off as soon as it is read past the
+limit.
+"""
+from flask import abort, request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+
+class CappedStream(object):
+	"""wsgi.input that raises RequestEntityTooLarge once more than `limit` bytes are read"""
+
+	def __init__(self, stream, limit):
+		self.stream = stream
+		self.limit = limit
+		self.read_bytes = 0
+
+	def count(self, data):
+		self.read_bytes += len(data)
+		if self.read_bytes > self.limit:
+			raise RequestEntityTooLarge()
+		return data
+
+	def read(self, size=-1):
+		# never more than one byte past the limit, to tell it was crossed
+		if size is None or size < 0:
+			size = self.limit - self.read_bytes + 1
+		return self.count(self.stream.read(min(size, self.limit - self.read_bytes + 1)))
+
+	def readline(self, size=-1):
+		if size is None or size < 0:
+			size = self.limit - self.read_bytes + 1
+		return self.count(self.stream.readline(min(size, self.limit - self.read_bytes + 1)))
+
+	def __iter__(self):
+		return iter(self.readline, b'')
+
+
+class BodyLimiter(object):
+	"""applies the body size limit of the matched endpoint"""
+
+	def __init__(self, app=None):
+		self.app = None
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		self.app = app
+		app.extensions['body_limit'] = self
+		app.before_request(self.before_request)
+
+	def limit(self, endpoint):
+		"""
+		:return: the most bytes a body of `endpoint` may have, None for no limit
+		"""
+		config = self.app.config
+		routes = config.get('ROUTE_BODY_LIMITS', {})
+		return routes[endpoint] if endpoint in routes else config.get('MAX_CONTENT_LENGTH')
+
+	def before_request(self):
+		limit = self.limit(request.endpoint)
+		if limit is None:
+			return None
+
+		length = request.content_length
+		if length is not None:
+			if length > limit:
+				abort(413)
+		elif request.environ.get('wsgi.input_terminated'):
+			# chunked: the size is only known once the body is read
+			request.environ['wsgi.input'] = CappedStream(request.environ['wsgi.input'], limit)
+		return None
@@ -1,6 +1,11 @@
 from app import db
+from sqlalchemy.dialects.postgresql import JSONB
 from werkzeug.security import generate_password_hash, check_password_hash
+from app.revocation import revoked_tokens
+from app.isbn import canonical
+from app.tenants import current_tenant
 import jwt
+import uuid
 from datetime import datetime, timedelta
 from flask import current_app
 
@@ -8,38 +13,193 @@ from flask import current_app
 class Booklist(db.Model):
 	"""instances a book"""
 	__tablename__ = 'bookslist'
+	# deleted books keep their row until archived, only live ones count
+	__table_args__ = (
+		db.Index('ix_bookslist_isbn_key_live', 'isbn_key', unique=True, postgresql_where=db.text('deleted_at IS NULL')),
+		db.Index('ix_bookslist_deleted_at', 'deleted_at', postgresql_where=db.text('deleted_at IS NOT NULL')),
+	)
 
 	id = db.Column(db.Integer, primary_key=True)
 	title = db.Column(db.String(150), nullable=False)
-	isbn = db.Column(db.String(10), nullable=False, unique=True)
+	isbn = db.Column(db.String(20), nullable=False)
+	# the ISBN-13 as a number, see app/isbn.py. NULL for old isbns that don't validate
+	isbn_key = db.Column(db.BigInteger, nullable=True)
 	date_created = db.Column(db.DateTime, default=db.func.current_timestamp())
 	date_modified = db.Column(
 		db.DateTime, default=db.func.current_timestamp(),
-		onupdate=db.func.current_timestamp())
+		onupdate=db.func.current_timestamp(), index=True)
+	deleted_at = db.Column(db.DateTime, nullable=True)
 
 	def __init__(self, title, isbn):
+		"""
+		:param isbn: an ISBN-10 or ISBN-13, stored as ISBN-13
+		:raises InvalidISBN:
+		"""
 		self.title = title
-		self.isbn = isbn
+		self.isbn = canonical(isbn)
+		self.isbn_key = int(self.isbn)
 
 	def save(self):
 		db.session.add(self)
 		db.session.commit()
 
+	@staticmethod
+	def live():
+		"""query of the books that are not deleted"""
+		return Booklist.query.filter(Booklist.deleted_at.is_(None))
+
 	@staticmethod
 	def get_all():
-		return Booklist.query.all()
+		return Booklist.live().all()
 
 	def delete(self):
-		db.session.delete(self)
-		db.session.commit()
+		"""soft deletes the book, `manage.py archive` moves it out later"""
+		self.deleted_at = db.func.current_timestamp()
+		self.save()
 
 	def __repr__(self):
 		return f"<Book {self.title}"
 
 
+class ArchivedBook(db.Model):
+	"""a deleted book moved out of bookslist"""
+	__tablename__ = 'bookslist_archive'
+
+	id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+	title = db.Column(db.String(150), nullable=False)
+	isbn = db.Column(db.String(20), nullable=False)
+	date_created = db.Column(db.DateTime)
+	date_modified = db.Column(db.DateTime)
+	deleted_at = db.Column(db.DateTime, nullable=False)
+	archived_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+
+	def __repr__(self):
+		return f"<ArchivedBook {self.title}"
+
+
+class Job(db.Model):
+	"""a unit of background work, run by `manage.py worker`, see app/jobs"""
+	__tablename__ = 'jobs'
+	# workers claim the oldest due job, and take over running ones whose lease ran out.
+	# One queue for all tenants, in the default database, see app/tenants.py
+	__table_args__ = (
+		db.Index('ix_jobs_queued', 'run_at', postgresql_where=db.text("status = 'queued'")),
+		db.Index('ix_jobs_running', 'locked_until', postgresql_where=db.text("status = 'running'")),
+		{'info': {'shared': True}},
+	)
+
+	id = db.Column(db.Integer, primary_key=True)
+	kind = db.Column(db.String(50), nullable=False)
+	payload = db.Column(JSONB, nullable=False)
+	# queued, running, done or failed
+	status = db.Column(db.String(20), nullable=False, default='queued')
+	attempts = db.Column(db.Integer, nullable=False, default=0)
+	max_attempts = db.Column(db.Integer, nullable=False, default=3)
+	result = db.Column(JSONB, nullable=True)
+	error = db.Column(db.Text, nullable=True)
+	worker = db.Column(db.String(100), nullable=True)
+	run_at = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+	locked_until = db.Column(db.DateTime, nullable=True)
+	date_created = db.Column(db.DateTime, default=db.func.current_timestamp())
+	started_at = db.Column(db.DateTime, nullable=True)
+	finished_at = db.Column(db.DateTime, nullable=True)
+	# the library the job runs in, None for the default database
+	tenant = db.Column(db.String(40), nullable=True)
+
+	def __init__(self, kind, payload, max_attempts=3, tenant=None):
+		self.kind = kind
+		self.payload = payload
+		self.max_attempts = max_attempts
+		self.tenant = tenant
+
+	def save(self):
+		db.session.add(self)
+		db.session.commit()
+
+	def __repr__(self):
+		return f"<Job {self.id} {self.kind} {self.status}>"
+
+
+class JobSecret(db.Model):
+	"""
+	the part of a job's payload that must not be shown, e.g. passwords, kept
+	out of jobs.payload and deleted once the job has finished, see app/jobs
+	"""
+	__tablename__ = 'job_secrets'
+	__table_args__ = {'info': {'shared': True}}
+
+	job_id = db.Column(db.Integer, db.ForeignKey('jobs.id', ondelete='CASCADE'), primary_key=True)
+	data = db.Column(JSONB, nullable=False)
+
+	def __init__(self, job_id, data):
+		self.job_id = job_id
+		self.data = data
+
+	def __repr__(self):
+		return f"<JobSecret {self.job_id}>"
+
+
+class ImportBatch(db.Model):
+	"""a batch of a bulk import that was applied, and its result, see app/imports.py"""
+	__tablename__ = 'import_batches'
+
+	# the 'batch' id of the import_books job
+	id = db.Column(db.String(32), primary_key=True)
+	result = db.Column(JSONB, nullable=False)
+	date_created = db.Column(db.DateTime, default=db.func.current_timestamp())
+
+	def __init__(self, id, result):
+		self.id = id
+		self.result = result
+
+	def __repr__(self):
+		return f"<ImportBatch {self.id}>"
+
+
+class AuditEvent(db.Model):
+	"""a login, logout or registration, written in batches by app/audit.py"""
+	__tablename__ = 'audit_events'
+	# one trail for all tenants, in the default database, see app/tenants.py.
+	# AuditView pages through a tenant's events newest first
+	__table_args__ = (
+		db.Index('ix_audit_events_tenant_id', 'tenant', 'id'),
+		{'info': {'shared': True}},
+	)
+
+	id = db.Column(db.BigInteger, primary_key=True)
+	# register, login, login_failed or logout
+	kind = db.Column(db.String(20), nullable=False)
+	# no foreign key, events outlive the users they name
+	user_id = db.Column(db.Integer, nullable=True, index=True)
+	username = db.Column(db.String(50), nullable=True)
+	remote_addr = db.Column(db.String(45), nullable=True)
+	tenant = db.Column(db.String(40), nullable=True)
+	# when it happened, not when the batch was written
+	created_at = db.Column(db.DateTime, nullable=False)
+
+	def __repr__(self):
+		return f"<AuditEvent {self.id} {self.kind} {self.username}>"
+
+
+class RevokedToken(db.Model):
+	"""a token id revoked before its token expires, see app/revocation.py"""
+	__tablename__ = 'revoked_tokens'
+	# token ids are unique across tenants, one table in the default database, see app/tenants.py
+	__table_args__ = {'info': {'shared': True}}
+
+	jti = db.Column(db.String(32), primary_key=True)
+	expires_at = db.Column(db.DateTime, nullable=False)
+	# workers read the ids revoked since their last read
+	revoked_at = db.Column(db.DateTime, nullable=False, index=True, default=db.func.current_timestamp())
+
+	def __repr__(self):
+		return f"<RevokedToken {self.jti}>"
+
+
 class APIUser(db.Model):
 	"""defines users"""
 	__tablename__ = 'users'
+
 	id = db.Column(db.Integer, primary_key=True)
 	username = db.Column(db.String(50), index=True, unique=True, nullable=False)
 	email = db.Column(db.String(100), index=True, unique=True, nullable=False)
@@ -62,7 +222,8 @@ class APIUser(db.Model):
 		"""
 		Set password to a hashed password
 		"""
-		self.password_hash = generate_password_hash(password)
+		self.password_hash = generate_password_hash(
+			password, method=current_app.config.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256'))
 
 	def verify_password(self, password):
 		"""
@@ -80,16 +241,27 @@ class APIUser(db.Model):
 	def __repr__(self):
 		return f'<user: {self.username}>'
 
-	def generate_token(self, user_id):
+	def generate_token(self, user_id, token_type='access'):
 		""" Generates the access token"""
 
 		try:
-			# set up a payload with an expiration time
+			if token_type == 'refresh':
+				lifetime = timedelta(days=current_app.config.get('REFRESH_TOKEN_DAYS', 14))
+			else:
+				lifetime = timedelta(minutes=current_app.config.get('ACCESS_TOKEN_MINUTES', 30))
+
+			# set up a payload with an expiration time and an id it can be revoked by
 			payload = {
-				'exp': datetime.utcnow() + timedelta(minutes=30),
+				'exp': datetime.utcnow() + lifetime,
 				'iat': datetime.utcnow(),
-				'sub': user_id
+				'sub': user_id,
+				'jti': uuid.uuid4().hex,
+				'type': token_type
 			}
+			# tokens issued on a library's host are routed to it, see app/tenants.py
+			tenant = current_tenant()
+			if tenant is not None:
+				payload['tenant'] = tenant
 			# create the byte string token using the payload and the SECRET key
 			jwt_string = jwt.encode(
 				payload=payload,
@@ -103,16 +275,51 @@ class APIUser(db.Model):
 			# return an error in string format if an exception occurs
 			return str(e)
 
+	def generate_refresh_token(self, user_id):
+		"""Generates the refresh token used to renew access tokens"""
+		return self.generate_token(user_id, token_type='refresh')
+
 	@staticmethod
-	def decode_token(token):
-		"""Decodes the access token from the Authorization header."""
+	def decode_payload(token, token_type='access'):
+		"""
+		Decodes a token and checks its type and revocation
+		:return: payload dict, or an error string
+		"""
 		try:
-			# try to decode the token using our SECRET variable
-			payload = jwt.decode(token, current_app.config.get('SECRET'))
-			return payload['sub']
+			payload = jwt.decode(token, str(current_app.config.get('SECRET')), algorithms=['HS256'])
 		except jwt.ExpiredSignatureError:
 			# the token is expired, return an error string
 			return "Expired token. Please login to get a new token"
 		except jwt.InvalidTokenError:
 			# the token is invalid, return an error string
 			return "Invalid token. Please register or login"
+
+		# tokens issued before refresh tokens existed carry no type or jti
+		if payload.get('type', 'access') != token_type:
+			return "Invalid token. Please register or login"
+
+		# the user id is only meaningful in the library that issued the token,
+		# this also covers refresh tokens, which come in the body
+		if payload.get('tenant') != current_tenant():
+			return "Invalid token. Please register or login"
+
+		if 'jti' in payload and payload['jti'] in revoked_tokens():
+			return "Revoked token. Please login to get a new token"
+
+		return payload
+
+	@staticmethod
+	def decode_token(token):
+		"""Decodes the access token from the Authorization header."""
+		payload = APIUser.decode_payload(token)
+
+		if isinstance(payload, str):
+			return payload
+
+		return payload['sub']
+
+	@staticmethod
+	def revoke_token(payload):
+		"""Revokes a decoded token until it expires"""
+		if 'jti' in payload:
+			revoked_tokens().add(payload['jti'], payload['exp'])
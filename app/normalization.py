@@ -0,0 +1,69 @@
+"""
+normalization of titles and usernames before they are stored or looked up
+
+Text is NFKC normalized, so compatibility forms such as full-width letters or
+ligatures compare equal to their plain form, then case folded, and every run
+of whitespace, tabs and Unicode spaces included, becomes a single space.
+"""
+import re
+import unicodedata
+from functools import lru_cache
+
+WHITESPACE = re.compile(r'\s+')
+SPACES = re.compile(' +')
+
+# longer inputs are normalized without the cache, so it stays small
+CACHED_LENGTH = 256
+
+
+def normalize(word):
+	"""
+	:param word: str
+	:return: the normalized string
+	"""
+	return WHITESPACE.sub(' ', unicodedata.normalize('NFKC', word).casefold()).strip()
+
+
+_cached_normalize = lru_cache(maxsize=4096)(normalize)
+
+
+def format_inputs(word):
+	"""
+	formats input string, the same title or username arrives again and again
+	so results are memoized
+	:param word: str
+	:return: string
+	"""
+	if len(word) > CACHED_LENGTH:
+		return normalize(word)
+	return _cached_normalize(word)
+
+
+def format_many(words):
+	"""
+	formats the strings of a bulk import, each distinct one once. Doesn't go
+	through the cache of format_inputs, which a large import would flush.
+	:param words: iterable of str
+	:return: list of formatted strings
+	"""
+	seen = {}
+	formatted = []
+
+	for word in words:
+		result = seen.get(word)
+		if result is None:
+			result = seen[word] = normalize(word)
+		formatted.append(result)
+
+	return formatted
+
+
+def legacy_format(word):
+	"""
+	the formatting usernames were stored with before normalize: lower cased
+	and runs of spaces collapsed. Rows migration 9c2e7b4d1a68 couldn't
+	rename still have it.
+	:param word: str
+	:return: string
+	"""
+	return SPACES.sub(' ', word.lower().strip())
@@ -0,0 +1,315 @@
+"""
+pre-forking HTTP server for serving the app on every core
+
+The master process binds the listening socket, warms the app once and forks
+`workers` children that accept from the shared socket. Each worker handles up
+to `threads` requests at a time.
+
+Signals sent to the master:
+	SIGHUP          restart the workers gracefully, one at a time
+	SIGUSR1         log per-worker request counts
+	SIGTERM/SIGINT  stop gracefully
+
+On SIGHUP the next old worker is only stopped once the replacement of the
+previous one accepts requests, so all but one worker keep serving and a
+broken release stops the reload after the first worker. A worker that exits
+before it accepts is respawned after a backoff that doubles each time, from
+`respawn_backoff` up to `max_respawn_backoff` seconds.
+"""
+import errno
+import logging
+import multiprocessing
+import os
+import select
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer
+
+from app.startup import after_fork, prepare_for_fork, warm_app
+
+logger = logging.getLogger('hello_books.prefork')
+
+
+class CountingMiddleware(object):
+	"""counts requests handled by a worker into its slot of a shared array"""
+
+	def __init__(self, app, counts, slot):
+		self.app = app
+		self.counts = counts
+		self.slot = slot
+		self.lock = threading.Lock()
+
+	def __call__(self, environ, start_response):
+		with self.lock:
+			self.counts[self.slot] += 1
+		return self.app(environ, start_response)
+
+
+class Worker(object):
+	"""accept loop of a single forked worker"""
+
+	def __init__(self, app, sock, slot, counts, started, threads=1, max_requests=0):
+		self.app = app
+		self.sock = sock
+		self.slot = slot
+		self.counts = counts
+		self.started = started
+		self.threads = max(1, threads)
+		self.max_requests = max_requests
+		self.alive = True
+
+	def stop(self, signum, frame):
+		self.alive = False
+
+	def handle(self, server, request, client_address, slots):
+		try:
+			server.finish_request(request, client_address)
+		except Exception:
+			server.handle_error(request, client_address)
+		finally:
+			server.shutdown_request(request)
+			slots.release()
+
+	def run(self):
+		signal.signal(signal.SIGTERM, self.stop)
+		signal.signal(signal.SIGINT, signal.SIG_IGN)
+		signal.signal(signal.SIGHUP, signal.SIG_IGN)
+		signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+		after_fork(self.app)
+		# /readyz reports this worker ready once its pool and caches are warm
+		self.app.extensions['warmup'].start()
+
+		self.counts[self.slot] = 0
+		host, port = self.sock.getsockname()[:2]
+		wsgi_app = CountingMiddleware(self.app, self.counts, self.slot)
+		server = BaseWSGIServer(host, port, wsgi_app, fd=self.sock.fileno())
+		server.socket.setblocking(False)
+
+		# a slot is taken before accepting, so a busy worker leaves new
+		# connections in the listen queue for its idle siblings
+		slots = threading.BoundedSemaphore(self.threads)
+		pool = ThreadPoolExecutor(self.threads) if self.threads > 1 else None
+		# tells the master this worker came up
+		self.started[self.slot] = os.getpid()
+
+		while self.alive:
+			if self.max_requests and self.counts[self.slot] >= self.max_requests:
+				logger.info("worker %s recycling after %s requests", os.getpid(), self.counts[self.slot])
+				break
+
+			if not slots.acquire(timeout=1.0):
+				continue
+
+			try:
+				readable = select.select([server.socket], [], [], 1.0)[0]
+				request, client_address = server.get_request() if readable else (None, None)
+			except (InterruptedError, BlockingIOError, ConnectionAbortedError):
+				request = None
+			except OSError as e:
+				if e.errno not in (errno.EAGAIN, errno.ECONNABORTED, errno.EINTR):
+					raise
+				request = None
+
+			if request is None:
+				slots.release()
+				continue
+
+			request.setblocking(True)
+			if pool is not None:
+				pool.submit(self.handle, server, request, client_address, slots)
+			else:
+				self.handle(server, request, client_address, slots)
+
+		if pool is not None:
+			pool.shutdown(wait=True)
+
+		logger.info("worker %s exiting after %s requests", os.getpid(), self.counts[self.slot])
+
+
+class Arbiter(object):
+	"""master process keeping `workers` children alive"""
+
+	def __init__(self, app, host='127.0.0.1', port=5000, workers=None, threads=1,
+				max_requests=0, graceful_timeout=30, sock=None, respawn_backoff=0.5, max_respawn_backoff=30):
+		self.app = app
+		self.host = host
+		self.port = port
+		self.num_workers = workers or os.cpu_count() or 1
+		self.threads = threads
+		self.max_requests = max_requests
+		self.graceful_timeout = graceful_timeout
+		self.respawn_backoff = respawn_backoff
+		self.max_respawn_backoff = max_respawn_backoff
+		self.sock = sock
+		self.counts = multiprocessing.RawArray('Q', self.num_workers)
+		# pid of the last worker of each slot that started accepting
+		self.started = multiprocessing.RawArray('q', self.num_workers)
+		# pid -> slot
+		self.workers = {}
+		# slot -> when to spawn its next worker, and its workers that exited on start in a row
+		self.respawn_at = {}
+		self.failures = [0] * self.num_workers
+		# workers still to replace on reload, and the (slot, pid) being replaced
+		self.stale = []
+		self.replacing = None
+		self.reloading = False
+		self.stopping = False
+		self.reload_requested = False
+		self.report_requested = False
+
+	def bind(self):
+		sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		sock.bind((self.host, self.port))
+		sock.listen(1024)
+		return sock
+
+	def spawn(self, slot):
+		pid = os.fork()
+
+		if pid == 0:
+			code = 1
+			try:
+				Worker(self.app, self.sock, slot, self.counts, self.started, self.threads, self.max_requests).run()
+				code = 0
+			except Exception:
+				logger.exception("worker %s crashed", os.getpid())
+			finally:
+				os._exit(code)
+
+		self.workers[pid] = slot
+		return pid
+
+	def reap(self):
+		while True:
+			try:
+				pid, status = os.waitpid(-1, os.WNOHANG)
+			except ChildProcessError:
+				return
+
+			if pid == 0:
+				return
+
+			slot = self.workers.pop(pid, None)
+			if slot is None or self.stopping:
+				continue
+
+			if self.started[slot] == pid:
+				self.failures[slot] = 0
+				self.spawn(slot)
+			else:
+				# it is likely to fail again, don't fork it in a tight loop
+				delay = min(self.max_respawn_backoff, self.respawn_backoff * 2 ** self.failures[slot])
+				self.failures[slot] += 1
+				logger.warning("worker %s (slot %s) exited before accepting, respawning in %.1fs", pid, slot, delay)
+				self.respawn_at[slot] = time.time() + delay
+
+	def spawn_due(self):
+		now = time.time()
+		for slot, at in list(self.respawn_at.items()):
+			if at <= now:
+				del self.respawn_at[slot]
+				self.spawn(slot)
+
+	def reload(self):
+		self.stale = list(self.workers)
+		self.reloading = True
+
+	def roll(self):
+		"""stops the next stale worker once the replacement of the previous one accepts"""
+		if self.replacing is not None:
+			slot, old_pid = self.replacing
+			if not any(worker_slot == slot and pid != old_pid and self.started[slot] == pid
+					   for pid, worker_slot in self.workers.items()):
+				return
+			self.replacing = None
+
+		while self.stale:
+			pid = self.stale.pop(0)
+			if pid not in self.workers:
+				continue
+			logger.info("replacing worker %s (slot %s)", pid, self.workers[pid])
+			self.replacing = (self.workers[pid], pid)
+			try:
+				os.kill(pid, signal.SIGTERM)
+			except ProcessLookupError:
+				pass
+			return
+
+		if self.reloading:
+			self.reloading = False
+			logger.info("workers reloaded")
+
+	def kill_workers(self, sig):
+		for pid in list(self.workers):
+			try:
+				os.kill(pid, sig)
+			except ProcessLookupError:
+				self.workers.pop(pid, None)
+
+	def request_counts(self):
+		"""
+		:return: {pid: requests handled by the worker}
+		"""
+		return {pid: self.counts[slot] for pid, slot in self.workers.items()}
+
+	def report(self):
+		for pid, count in sorted(self.request_counts().items(), key=lambda item: self.workers[item[0]]):
+			logger.info("worker %s (slot %s): %s requests", pid, self.workers[pid], count)
+
+	def handle_signal(self, signum, frame):
+		if signum == signal.SIGHUP:
+			self.reload_requested = True
+		elif signum == signal.SIGUSR1:
+			self.report_requested = True
+		else:
+			self.stopping = True
+
+	def run(self):
+		if self.sock is None:
+			self.sock = self.bind()
+
+		warm_app(self.app)
+		prepare_for_fork(self.app)
+
+		for sig in (signal.SIGHUP, signal.SIGUSR1, signal.SIGTERM, signal.SIGINT):
+			signal.signal(sig, self.handle_signal)
+
+		host, port = self.sock.getsockname()[:2]
+		logger.info("listening on http://%s:%s with %s workers x %s threads",
+					host, port, self.num_workers, self.threads)
+
+		for slot in range(self.num_workers):
+			self.spawn(slot)
+
+		while not self.stopping:
+			time.sleep(0.1)
+			self.reap()
+			self.spawn_due()
+
+			if self.reload_requested:
+				self.reload_requested = False
+				logger.info("reloading workers")
+				self.reload()
+			# workers finish their current requests, reap() replaces them
+			self.roll()
+
+			if self.report_requested:
+				self.report_requested = False
+				self.report()
+
+		self.report()
+		self.kill_workers(signal.SIGTERM)
+		deadline = time.time() + self.graceful_timeout
+
+		while self.workers and time.time() < deadline:
+			time.sleep(0.1)
+			self.reap()
+
+		self.kill_workers(signal.SIGKILL)
+		self.reap()
+		self.sock.close()
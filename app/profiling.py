@@ -0,0 +1,218 @@
+"""
+on-demand profiling of live workers
+
+An admin arms a profiling session for one endpoint. The next N requests to
+that endpoint, or the requests arriving within T seconds, are profiled with
+cProfile or a sampling profiler. The session then writes its results to
+PROFILE_DIR and disarms itself. While no session is armed, a request costs
+one attribute check.
+"""
+import cProfile
+import collections
+import os
+import pstats
+import sys
+import threading
+import time
+
+from flask import current_app, g, request
+
+
+class SamplingProfiler(object):
+	"""samples the stacks of the threads handling profiled requests"""
+
+	def __init__(self, interval):
+		self.interval = interval
+		self.threads = set()
+		self.stacks = collections.Counter()
+		self.running = True
+		self.thread = threading.Thread(target=self.run, name='profiler-sampler', daemon=True)
+		self.thread.start()
+
+	def run(self):
+		while self.running:
+			frames = sys._current_frames()
+			for thread_id in list(self.threads):
+				frame = frames.get(thread_id)
+				if frame is not None:
+					self.stacks[self.collapse(frame)] += 1
+			time.sleep(self.interval)
+
+	@staticmethod
+	def collapse(frame):
+		stack = []
+		while frame is not None:
+			code = frame.f_code
+			stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+			frame = frame.f_back
+		return ';'.join(reversed(stack))
+
+	def stop(self):
+		self.running = False
+		self.thread.join()
+
+
+class ProfileSession(object):
+	"""an armed profiling session"""
+
+	def __init__(self, endpoint, mode, requests, seconds, directory, interval):
+		self.endpoint = endpoint
+		self.mode = mode
+		self.remaining = requests
+		self.deadline = time.time() + seconds
+		self.directory = directory
+		self.profiled = 0
+		self.stats = None
+		# cProfile profiles one thread at a time
+		self.busy = threading.Lock()
+		self.sampler = SamplingProfiler(interval) if mode == 'sampling' else None
+
+	def describe(self):
+		return {
+			'endpoint': self.endpoint,
+			'mode': self.mode,
+			'remaining_requests': self.remaining,
+			'seconds_left': max(0, round(self.deadline - time.time(), 1)),
+			'profiled_requests': self.profiled
+		}
+
+	def begin(self):
+		if self.mode == 'sampling':
+			self.sampler.threads.add(threading.get_ident())
+			return True
+
+		if not self.busy.acquire(blocking=False):
+			return False
+
+		profile = cProfile.Profile()
+		try:
+			profile.enable()
+		except ValueError:
+			# another profiler is active in this interpreter
+			self.busy.release()
+			return False
+
+		g.profile = profile
+		return True
+
+	def end(self):
+		if self.mode == 'sampling':
+			self.sampler.threads.discard(threading.get_ident())
+		else:
+			profile = g.pop('profile')
+			profile.disable()
+			if self.stats is None:
+				self.stats = pstats.Stats(profile)
+			else:
+				self.stats.add(profile)
+			self.busy.release()
+
+		self.profiled += 1
+		if self.remaining is not None:
+			self.remaining -= 1
+
+	@property
+	def done(self):
+		return (self.remaining is not None and self.remaining <= 0) or time.time() >= self.deadline
+
+	def write(self):
+		"""
+		:return: path of the written profile, None if nothing was profiled
+		"""
+		os.makedirs(self.directory, exist_ok=True)
+		name = f"{self.endpoint.replace('.', '-')}-{os.getpid()}-{int(time.time())}"
+
+		if self.mode == 'sampling':
+			self.sampler.stop()
+			if not self.sampler.stacks:
+				return None
+			path = os.path.join(self.directory, name + '.collapsed')
+			with open(path, 'w') as output:
+				for stack, count in self.sampler.stacks.most_common():
+					output.write(f'{stack} {count}\n')
+			return path
+
+		if self.stats is None:
+			return None
+		path = os.path.join(self.directory, name + '.pstats')
+		self.stats.dump_stats(path)
+		return path
+
+
+class Profiler(object):
+	"""arms profiling sessions and hooks them into request handling"""
+
+	MODES = ('cprofile', 'sampling')
+
+	def __init__(self, app=None):
+		self.session = None
+		self.last_result = None
+		self.lock = threading.Lock()
+
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		app.extensions['profiler'] = self
+		app.before_request(self.before_request)
+		app.teardown_request(self.teardown_request)
+
+	def start(self, endpoint, mode='cprofile', requests=None, seconds=None):
+		"""
+		arms a session, it ends after `requests` profiled requests or `seconds`
+		:return: the session, or None if another one is armed
+		"""
+		config = current_app.config
+		seconds = min(seconds or config.get('PROFILE_MAX_SECONDS', 300), config.get('PROFILE_MAX_SECONDS', 300))
+
+		with self.lock:
+			if self.session is not None:
+				return None
+
+			session = ProfileSession(
+				endpoint, mode, requests, seconds, config.get('PROFILE_DIR'),
+				config.get('PROFILE_SAMPLE_INTERVAL', 0.005))
+			self.session = session
+
+		# ends the session on time even when no more requests arrive
+		timer = threading.Timer(seconds, self.finish, args=(session,))
+		timer.daemon = True
+		timer.start()
+		return session
+
+	def finish(self, session):
+		with self.lock:
+			if self.session is not session:
+				return
+			self.session = None
+
+		# wait for requests still being profiled
+		with session.busy:
+			path = session.write()
+
+		self.last_result = dict(session.describe(), output=path)
+
+	def before_request(self):
+		session = self.session
+		if session is None or request.endpoint != session.endpoint:
+			return
+
+		# finish may have closed the session since it was read, begin only while it is still armed
+		with self.lock:
+			if self.session is not session:
+				return
+			if not session.done:
+				if session.begin():
+					g.profile_session = session
+				return
+
+		self.finish(session)
+
+	def teardown_request(self, exc):
+		session = g.pop('profile_session', None)
+		if session is None:
+			return
+
+		session.end()
+		if session.done:
+			self.finish(session)
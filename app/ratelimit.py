@@ -0,0 +1,203 @@
+"""
+admission control: per-route token bucket rate limits and a concurrency cap
+
+Buckets are kept as GCRA "theoretical arrival times", so a bucket is a single
+float per key whether it lives in process memory or in Redis.
+"""
+import itertools
+import math
+import threading
+import time
+
+from flask import current_app, g, jsonify, request
+
+from app.backends import redis_from_url
+
+
+class MemoryBackend(object):
+	"""in-process token buckets, sharded over a fixed set of locks"""
+
+	def __init__(self, stripes=64, sweep_every=10000):
+		self._tats = {}
+		self._locks = [threading.Lock() for _ in range(stripes)]
+		self._sweep_every = sweep_every
+		# next() on a count is atomic, the calls of every stripe are counted without a lock
+		self._calls = itertools.count(1)
+
+	def acquire(self, key, rate, per, burst, now=None):
+		"""
+		takes one token from the bucket identified by key
+		:param rate: tokens refilled every `per` seconds
+		:param burst: bucket size
+		:return: (allowed, retry_after)
+		"""
+		now = time.time() if now is None else now
+		interval = per / rate
+
+		with self._locks[hash(key) % len(self._locks)]:
+			tat = max(self._tats.get(key, now), now)
+			allow_at = tat + interval - burst * interval
+
+			if now < allow_at:
+				return False, allow_at - now
+
+			self._tats[key] = tat + interval
+
+		if next(self._calls) % self._sweep_every == 0:
+			self.sweep(now)
+
+		return True, 0
+
+	def sweep(self, now=None):
+		"""drops buckets that have refilled completely"""
+		now = time.time() if now is None else now
+
+		for key, tat in list(self._tats.items()):
+			if tat <= now:
+				with self._locks[hash(key) % len(self._locks)]:
+					if self._tats.get(key, now) <= now:
+						self._tats.pop(key, None)
+
+	def __len__(self):
+		return len(self._tats)
+
+
+GCRA_SCRIPT = """
+local now = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local tat = tonumber(redis.call('GET', KEYS[1]) or ARGV[1])
+if tat < now then tat = now end
+local allow_at = tat + interval - burst * interval
+if now < allow_at then
+	return {0, string.format('%.17g', allow_at - now)}
+end
+local new_tat = tat + interval
+-- tostring keeps 14 digits, a tenth of a millisecond of an epoch time
+redis.call('SET', KEYS[1], string.format('%.17g', new_tat), 'PX', math.ceil((new_tat - now) * 1000))
+return {1, '0'}
+"""
+
+
+class RedisBackend(object):
+	"""token buckets shared between workers through a Redis protocol server"""
+
+	def __init__(self, client, prefix='rl:'):
+		self.client = client
+		self.prefix = prefix
+
+	def acquire(self, key, rate, per, burst, now=None):
+		"""
+		takes one token from the shared bucket identified by key
+		:return: (allowed, retry_after)
+		"""
+		now = time.time() if now is None else now
+		allowed, retry_after = self.client.eval(
+			GCRA_SCRIPT, 1, self.prefix + key, repr(now), repr(per / rate), burst)
+
+		return bool(int(allowed)), float(retry_after)
+
+
+def too_many_requests(retry_after):
+	response = jsonify({'error': 'too many requests'})
+	response.status_code = 429
+	response.headers['Retry-After'] = str(max(1, int(math.ceil(retry_after))))
+	return response
+
+
+def service_unavailable(retry_after):
+	response = jsonify({'error': 'service unavailable'})
+	response.status_code = 503
+	response.headers['Retry-After'] = str(retry_after)
+	return response
+
+
+class RateLimiter(object):
+	"""
+	rejects requests over their route's rate with 429 and requests over the
+	worker's concurrency cap with 503, before any view code runs
+	"""
+
+	def __init__(self, app=None):
+		self._backend = None
+		self._slots = None
+		self._lock = threading.Lock()
+
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		app.extensions['ratelimit'] = self
+		app.before_request(self.before_request)
+		app.teardown_request(self.teardown_request)
+
+	@property
+	def backend(self):
+		if self._backend is None:
+			with self._lock:
+				if self._backend is None:
+					url = current_app.config.get('RATELIMIT_STORAGE_URL')
+					self._backend = RedisBackend(redis_from_url(url)) if url else MemoryBackend()
+		return self._backend
+
+	@property
+	def slots(self):
+		if self._slots is None:
+			with self._lock:
+				if self._slots is None:
+					size = current_app.config.get('MAX_CONCURRENT_REQUESTS') or 0
+					self._slots = threading.BoundedSemaphore(size) if size > 0 else False
+		return self._slots
+
+	def identity(self, scope):
+		"""
+		:param scope: 'client', 'user' or 'route'
+		:return: string identifying who the bucket belongs to
+		"""
+		if scope == 'route':
+			return '*'
+
+		if scope == 'user':
+			auth_header = request.headers.get('Authorization', '')
+
+			if auth_header.startswith('Bearer '):
+				from app.models import APIUser
+				user_id = APIUser.decode_token(auth_header[7:])
+
+				if isinstance(user_id, int):
+					return f'user:{user_id}'
+
+		return f'client:{request.remote_addr}'
+
+	def before_request(self):
+		config = current_app.config
+
+		if not config.get('RATELIMIT_ENABLED'):
+			return None
+
+		if request.endpoint in config.get('RATELIMIT_EXEMPT', ()):
+			return None
+
+		slots = self.slots
+		if slots:
+			if not slots.acquire(blocking=False):
+				return service_unavailable(config.get('CONCURRENCY_RETRY_AFTER', 1))
+			g.ratelimit_slot = True
+
+		limit = config.get('RATELIMIT_ROUTES', {}).get(request.endpoint)
+		if limit is None:
+			return None
+
+		scope = limit.get('scope', 'client')
+		key = f"{request.endpoint}:{scope}:{self.identity(scope)}"
+		allowed, retry_after = self.backend.acquire(
+			key, limit['rate'], limit.get('per', 60), limit.get('burst', limit['rate']))
+
+		if not allowed:
+			return too_many_requests(retry_after)
+
+		return None
+
+	def teardown_request(self, exc):
+		if g.pop('ratelimit_slot', False):
+			self.slots.release()
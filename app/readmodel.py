@@ -0,0 +1,281 @@
+"""
+in-process read model of the live books, for GET /api/v2/books and
+GET /api/v2/books/<id> without a round trip to Postgres
+
+The catalogue keeps one column per field instead of one object per book:
+ids, ISBN-13 keys and timestamps (microseconds since the epoch) in
+array('q'), titles in a list of interned strings. Ids are kept sorted, so a
+book is found by bisecting `ids` and no per-book index is needed.
+
+A thread polls bookslist for rows whose date_modified is at or after the last
+one seen, minus READ_MODEL_OVERLAP_SECONDS: date_modified is the start time
+of the writing transaction, and one that started earlier may commit after
+the poll. Applying a row twice is harmless. Deleting a book is an UPDATE of
+deleted_at, which bumps date_modified, so deletes arrive the same way; the
+rows `manage.py archive` removes were deleted long before. A full reload every
+READ_MODEL_RELOAD_SECONDS bounds the drift anyway.
+
+Enable with READ_MODEL_ENABLED; the catalogue is loaded as a warm-up step.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from app import db
+from app.isbn import from_key
+from app.tenants import current_tenant
+
+logger = logging.getLogger('hello_books.read_model')
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+# stands in for NULL in the integer columns
+MISSING = -1 << 63
+
+# what the views read off a Booklist, without the ORM
+Book = namedtuple('Book', ['id', 'title', 'isbn', 'date_created', 'date_modified'])
+
+
+def to_micros(value):
+	return MISSING if value is None else (value - EPOCH) // MICROSECOND
+
+
+def from_micros(value):
+	return None if value == MISSING else EPOCH + timedelta(microseconds=value)
+
+
+class Catalogue(object):
+	"""the live books in columns, ordered by id"""
+
+	def __init__(self):
+		self.ids = array('q')
+		self.isbn_keys = array('q')
+		self.titles = []
+		self.created = array('q')
+		self.modified = array('q')
+		# id -> isbn of the old books whose isbn has no key
+		self.odd_isbns = {}
+		self.lock = threading.Lock()
+
+	def __len__(self):
+		return len(self.ids)
+
+	def _position(self, book_id):
+		"""
+		:return: the index of `book_id`, or where it would go, and whether it is there
+		"""
+		position = bisect_left(self.ids, book_id)
+		return position, position < len(self.ids) and self.ids[position] == book_id
+
+	def _book(self, position):
+		book_id = self.ids[position]
+		key = self.isbn_keys[position]
+		return Book(
+			book_id,
+			self.titles[position],
+			self.odd_isbns[book_id] if key == MISSING else from_key(key),
+			from_micros(self.created[position]),
+			from_micros(self.modified[position]))
+
+	def get(self, book_id):
+		"""
+		:return: Book, or None if there is no live book with that id
+		"""
+		with self.lock:
+			position, found = self._position(book_id)
+			return self._book(position) if found else None
+
+	def all(self):
+		with self.lock:
+			return [self._book(position) for position in range(len(self.ids))]
+
+	def apply(self, rows):
+		"""
+		inserts, updates or removes books
+		:param rows: (id, title, isbn, isbn_key, date_created, date_modified, deleted_at)
+		"""
+		with self.lock:
+			for book_id, title, isbn, isbn_key, date_created, date_modified, deleted_at in rows:
+				position, found = self._position(book_id)
+
+				if deleted_at is not None:
+					if found:
+						for column in (self.ids, self.isbn_keys, self.titles, self.created, self.modified):
+							del column[position]
+						self.odd_isbns.pop(book_id, None)
+					continue
+
+				values = (
+					(self.ids, book_id),
+					(self.isbn_keys, MISSING if isbn_key is None else isbn_key),
+					(self.titles, sys.intern(title)),
+					(self.created, to_micros(date_created)),
+					(self.modified, to_micros(date_modified)))
+
+				for column, value in values:
+					if found:
+						column[position] = value
+					elif position == len(self.ids):
+						# new books have the highest ids
+						column.append(value)
+					else:
+						column.insert(position, value)
+
+				if isbn_key is None:
+					self.odd_isbns[book_id] = isbn
+				else:
+					self.odd_isbns.pop(book_id, None)
+
+	def memory(self):
+		"""
+		:return: bytes held by the columns, and per book
+		"""
+		with self.lock:
+			arrays = sum(column.buffer_info()[1] * column.itemsize
+						 for column in (self.ids, self.isbn_keys, self.created, self.modified))
+			# equal titles are one interned string
+			titles = sys.getsizeof(self.titles) + sum(
+				sys.getsizeof(title) for title in {id(title): title for title in self.titles}.values())
+			odd = sys.getsizeof(self.odd_isbns) + sum(sys.getsizeof(isbn) for isbn in self.odd_isbns.values())
+			total = arrays + titles + odd
+
+			return {
+				'books': len(self.ids),
+				'bytes': total,
+				'bytes_per_book': round(total / len(self.ids), 1) if self.ids else None,
+				'columns': {'arrays': arrays, 'titles': titles, 'odd_isbns': odd}
+			}
+
+
+class ReadModel(object):
+	"""keeps this process' Catalogue in step with bookslist"""
+
+	def __init__(self, app=None):
+		self.app = None
+		self.catalogue = None
+		# date_modified of the newest row seen
+		self.since = None
+		self.loaded_at = None
+		self.pid = None
+		self.stopping = threading.Event()
+		self.lock = threading.Lock()
+		# held from the check to the poller's start, so one caller loads and polls
+		self.start_lock = threading.Lock()
+
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		self.app = app
+		app.extensions['read_model'] = self
+
+	@property
+	def serving(self):
+		"""
+		whether reads are answered from the catalogue, which doesn't survive a
+		fork and only holds the default database's books
+		"""
+		return self.app.config.get('READ_MODEL_ENABLED', False) \
+			and self.catalogue is not None and self.pid == os.getpid() and current_tenant() is None
+
+	def query(self, *conditions):
+		from app.models import Booklist
+
+		table = Booklist.__table__
+		columns = [table.c.id, table.c.title, table.c.isbn, table.c.isbn_key,
+				   table.c.date_created, table.c.date_modified, table.c.deleted_at]
+		return select(columns).where(db.and_(*conditions)) if conditions else select(columns)
+
+	def load(self):
+		"""snapshots the live books into a new catalogue, in an app context"""
+		from app.models import Booklist
+
+		catalogue = Catalogue()
+		since = None
+		batch_size = self.app.config.get('READ_MODEL_BATCH_SIZE', 10000)
+
+		with db.engine.connect() as connection:
+			# server side cursor, the snapshot is never all in memory as rows
+			result = connection.execution_options(stream_results=True).execute(
+				self.query(Booklist.deleted_at.is_(None)).order_by(Booklist.id))
+			while True:
+				rows = result.fetchmany(batch_size)
+				if not rows:
+					break
+				catalogue.apply(rows)
+				# rows are in id order, not date_modified order
+				newest = max((row[5] for row in rows if row[5] is not None), default=since)
+				since = max(since, newest) if since else newest
+
+		with self.lock:
+			self.catalogue = catalogue
+			self.since = since
+			self.loaded_at = time.monotonic()
+			self.pid = os.getpid()
+
+		logger.info("read model loaded %s books", len(catalogue))
+		return catalogue
+
+	def refresh(self):
+		"""
+		applies the books changed since the last poll, in an app context
+		:return: number of rows applied
+		"""
+		from app.models import Booklist
+
+		reload_after = self.app.config.get('READ_MODEL_RELOAD_SECONDS', 3600)
+		if self.catalogue is None or self.pid != os.getpid() \
+				or (reload_after and time.monotonic() - self.loaded_at > reload_after):
+			return len(self.load())
+
+		overlap = timedelta(seconds=self.app.config.get('READ_MODEL_OVERLAP_SECONDS', 5))
+		statement = self.query(Booklist.date_modified >= self.since - overlap) if self.since \
+			else self.query()
+
+		with db.engine.connect() as connection:
+			rows = connection.execute(statement.order_by(Booklist.date_modified, Booklist.id)).fetchall()
+
+		self.catalogue.apply(rows)
+		if rows:
+			# rows are in date_modified order
+			self.since = max(self.since, rows[-1][5]) if self.since else rows[-1][5]
+		return len(rows)
+
+	def poll(self):
+		interval = self.app.config.get('READ_MODEL_POLL_SECONDS', 1.0)
+		with self.app.app_context():
+			while not self.stopping.wait(interval):
+				try:
+					self.refresh()
+				except Exception:
+					# keep serving the last catalogue until the database is back
+					logger.exception("read model refresh failed")
+
+	def start(self):
+		"""loads the catalogue and starts polling, once per process"""
+		with self.start_lock:
+			if self.pid == os.getpid():
+				return
+			self.load()
+			self.stopping = threading.Event()
+			threading.Thread(target=self.poll, name='read-model', daemon=True).start()
+
+	def stop(self):
+		self.stopping.set()
+
+	def describe(self):
+		return dict(self.catalogue.memory() if self.catalogue else {}, serving=self.serving)
+
+
+def load_read_model(app):
+	"""warm-up step: loads the catalogue before the worker reports ready"""
+	if app.config.get('READ_MODEL_ENABLED', False):
+		app.extensions['read_model'].start()
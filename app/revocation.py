@@ -0,0 +1,211 @@
+"""
+revoked token ids (jti), kept until the tokens they belong to expire
+
+Revocations are checked against an in-process MemoryRevocationSet, so a check
+costs a dict lookup and no round trip. Every worker process must see every
+revocation, so they are also written to a shared store, and each process
+reads the ones revoked since its last read at most every
+REVOCATION_SYNC_SECONDS. A token revoked by another worker is refused by this
+one within that time, and at once by the worker that revoked it.
+
+By default the shared store is the revoked_tokens table of the default
+database. REVOCATION_STORAGE_URL = 'redis://host:port/db' uses Redis instead,
+and 'memory://' no shared store at all, which only suits a single worker.
+"""
+import calendar
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy.dialects.postgresql import insert
+
+from app.backends import redis_from_url
+
+logger = logging.getLogger('hello_books.revocation')
+
+
+class MemoryRevocationSet(object):
+	"""
+	in-process revocation set; ids are stored as 16 raw bytes mapped to the
+	integer expiry of their token and dropped once that expiry has passed
+	"""
+
+	def __init__(self, purge_every=1024):
+		self._expiries = {}
+		self._lock = threading.Lock()
+		self._purge_every = purge_every
+		self._added = 0
+
+	def add(self, jti, exp):
+		with self._lock:
+			self._expiries[uuid.UUID(jti).bytes] = int(exp)
+
+			# counts adds, ids added again leave the size as it is
+			self._added += 1
+			if self._added % self._purge_every == 0:
+				self.purge()
+
+	def __contains__(self, jti):
+		exp = self._expiries.get(uuid.UUID(jti).bytes)
+		return exp is not None and exp > time.time()
+
+	def __len__(self):
+		return len(self._expiries)
+
+	def purge(self, now=None):
+		"""drops ids whose tokens have expired anyway"""
+		now = time.time() if now is None else now
+		for key, exp in list(self._expiries.items()):
+			if exp <= now:
+				self._expiries.pop(key, None)
+
+
+class DatabaseRevocationStore(object):
+	"""
+	revoked ids in the revoked_tokens table; rows of expired tokens are
+	deleted every `purge_every` revocations
+	"""
+
+	def __init__(self, overlap=5, purge_every=1024):
+		# revoked_at is the start of the revoking transaction, which may commit after a later one
+		self.overlap = timedelta(seconds=overlap)
+		self._added = 0
+		self._purge_every = purge_every
+
+	def add(self, jti, exp):
+		from app import db
+		from app.models import RevokedToken
+
+		table = RevokedToken.__table__
+		db.session.execute(insert(table).values(jti=jti, expires_at=datetime.utcfromtimestamp(exp))
+						   .on_conflict_do_nothing())
+
+		self._added += 1
+		if self._added % self._purge_every == 0:
+			db.session.execute(table.delete().where(table.c.expires_at <= datetime.utcnow()))
+		db.session.commit()
+
+	def revoked_since(self, since):
+		"""
+		:param since: watermark returned by the previous call, None for every revocation
+		:return: [(jti, exp)] of the tokens revoked since, and the new watermark
+		"""
+		from app import db
+		from app.models import RevokedToken
+
+		query = db.session.query(RevokedToken.jti, RevokedToken.expires_at, RevokedToken.revoked_at) \
+			.filter(RevokedToken.expires_at > datetime.utcnow())
+		if since is not None:
+			query = query.filter(RevokedToken.revoked_at >= since - self.overlap)
+		rows = query.all()
+
+		newest = max((row[2] for row in rows), default=since)
+		return ([(jti, calendar.timegm(expires_at.utctimetuple())) for jti, expires_at, _ in rows],
+				max(since, newest) if since else newest)
+
+
+class RedisRevocationStore(object):
+	"""
+	revoked ids in a Redis sorted set, scored by the server time they were
+	revoked at; entries older than the longest lived token are trimmed
+	"""
+
+	def __init__(self, client, key='revoked_tokens', overlap=5, keep_seconds=14 * 86400):
+		self.client = client
+		self.key = key
+		self.overlap = overlap
+		self.keep_seconds = keep_seconds
+
+	def add(self, jti, exp):
+		seconds, micros = self.client.time()
+		now = seconds + micros / 1e6
+		pipeline = self.client.pipeline()
+		pipeline.zadd(self.key, {f'{jti}:{int(exp)}': now})
+		pipeline.zremrangebyscore(self.key, '-inf', now - self.keep_seconds)
+		pipeline.execute()
+
+	def revoked_since(self, since):
+		"""see DatabaseRevocationStore.revoked_since"""
+		entries = self.client.zrangebyscore(
+			self.key, '-inf' if since is None else since - self.overlap, '+inf', withscores=True)
+
+		now = time.time()
+		revoked = []
+		for member, score in entries:
+			jti, exp = member.decode().split(':')
+			if int(exp) > now:
+				revoked.append((jti, int(exp)))
+
+		newest = max((score for _, score in entries), default=since)
+		return revoked, max(since, newest) if since else newest
+
+
+class SyncedRevocationSet(object):
+	"""
+	revocation set checked in process and shared through `store`, whose new
+	revocations are read at most every `sync_every` seconds
+	"""
+
+	def __init__(self, store, sync_every=1.0):
+		self.store = store
+		self.sync_every = sync_every
+		self.local = MemoryRevocationSet()
+		self.since = None
+		self.synced_at = None
+		self.lock = threading.Lock()
+
+	def add(self, jti, exp):
+		self.store.add(jti, exp)
+		self.local.add(jti, exp)
+
+	def sync(self):
+		revoked, self.since = self.store.revoked_since(self.since)
+		for jti, exp in revoked:
+			self.local.add(jti, exp)
+
+	def due(self):
+		return self.synced_at is None or time.monotonic() - self.synced_at >= self.sync_every
+
+	def __contains__(self, jti):
+		if self.due():
+			with self.lock:
+				# another thread may have synced while this one waited
+				if self.due():
+					self.synced_at = time.monotonic()
+					try:
+						self.sync()
+					except Exception:
+						# keep checking against the last copy until the store is back
+						logger.exception("revocation sync failed")
+
+		return jti in self.local
+
+
+def revoked_tokens():
+	"""
+	:return: the revocation set of the current app, created on first use
+	"""
+	extensions = current_app.extensions
+	store = extensions.get('revoked_tokens')
+
+	if store is None:
+		config = current_app.config
+		url = config.get('REVOCATION_STORAGE_URL')
+		overlap = config.get('REVOCATION_SYNC_OVERLAP_SECONDS', 5)
+
+		if url == 'memory://':
+			store = MemoryRevocationSet()
+		else:
+			if not url:
+				shared = DatabaseRevocationStore(overlap)
+			else:
+				shared = RedisRevocationStore(
+					redis_from_url(url), overlap=overlap,
+					keep_seconds=config.get('REFRESH_TOKEN_DAYS', 14) * 86400)
+			store = SyncedRevocationSet(shared, config.get('REVOCATION_SYNC_SECONDS', 1.0))
+		store = extensions.setdefault('revoked_tokens', store)
+
+	return store
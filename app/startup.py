@@ -0,0 +1,67 @@
+"""
+helpers for starting workers from a fully warmed, preloaded app
+
+The parent process builds and warms the app once, calls prepare_for_fork()
+and then forks; every child inherits the warmed app without re-importing it.
+"""
+import os
+
+from sqlalchemy import event, exc
+from sqlalchemy.orm import configure_mappers
+
+from app import db
+
+
+def _record_pid(dbapi_connection, connection_record):
+	connection_record.info['pid'] = os.getpid()
+
+
+def _check_pid(dbapi_connection, connection_record, connection_proxy):
+	pid = connection_record.info.get('pid')
+
+	if pid != os.getpid():
+		# drop the inherited socket without closing it, it is still the parent's
+		connection_record.connection = connection_proxy.connection = None
+		raise exc.DisconnectionError(f"connection was opened by pid {pid}, not {os.getpid()}")
+
+
+def make_fork_safe(engine):
+	"""
+	makes pooled connections invalidate themselves when checked out in a
+	process other than the one that opened them, so a forked worker never
+	shares a socket with its parent
+	"""
+	if not event.contains(engine, 'checkout', _check_pid):
+		event.listen(engine, 'connect', _record_pid)
+		event.listen(engine, 'checkout', _check_pid)
+
+
+def warm_app(app):
+	"""
+	does the one-off work otherwise left to the first request: imports the
+	modules routes load lazily, configures the mappers and creates the engine
+	"""
+	from cerberus import Validator  # noqa: F401
+
+	with app.app_context():
+		configure_mappers()
+		make_fork_safe(db.engine)
+		app.url_map.update()
+
+	return app
+
+
+def prepare_for_fork(app):
+	"""closes the parent's pooled connections so children start with empty pools"""
+	with app.app_context():
+		db.engine.dispose()
+
+
+def after_fork(app):
+	"""
+	resets the engine in a newly forked worker. Inherited connections are
+	discarded on checkout rather than closed, closing them would also end
+	the parent's session on the same socket.
+	"""
+	with app.app_context():
+		make_fork_safe(db.engine)
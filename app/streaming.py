@@ -0,0 +1,172 @@
+"""
+incremental parsing of large JSON request bodies
+
+Bulk endpoints read their items off request.stream instead of calling
+request.get_json(), which holds the whole body and every parsed object in
+memory at once. Here only a chunk of the body and the item being parsed are,
+however large the upload.
+
+Bodies are either NDJSON (application/x-ndjson, one JSON value per line), a
+JSON array, or an object whose only key holds the array, e.g. {"books": [...]}.
+"""
+import codecs
+import json
+import re
+from itertools import islice
+
+CHUNK_SIZE = 64 * 1024
+# largest item, or NDJSON line, in bytes
+MAX_ITEM_SIZE = 1 << 20
+
+NDJSON_TYPES = ('application/x-ndjson', 'application/jsonlines', 'application/json-seq')
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+# characters that could carry on a number or literal parsed at the end of the text
+SCALAR_TAIL = re.compile(r'[-+.eE0-9a-z]*')
+decoder = json.JSONDecoder()
+
+
+class StreamError(ValueError):
+	pass
+
+
+class TextBuffer(object):
+	"""the unparsed part of a UTF-8 byte stream, read a chunk at a time"""
+
+	def __init__(self, stream, chunk_size=CHUNK_SIZE, max_item_size=MAX_ITEM_SIZE):
+		self.stream = stream
+		self.chunk_size = chunk_size
+		self.max_item_size = max_item_size
+		self.text = ''
+		self.pos = 0
+		# characters dropped from the front of text, for error positions
+		self.consumed = 0
+		self.eof = False
+		self.utf8 = codecs.getincrementaldecoder('utf-8')()
+
+	def fill(self):
+		chunk = self.stream.read(self.chunk_size)
+		try:
+			decoded = self.utf8.decode(chunk, final=not chunk)
+		except UnicodeDecodeError:
+			raise StreamError(f'invalid UTF-8 after character {self.position}')
+
+		self.eof = not chunk
+		self.consumed += self.pos
+		self.text = self.text[self.pos:] + decoded
+		self.pos = 0
+
+	@property
+	def position(self):
+		return self.consumed + self.pos
+
+	def peek(self):
+		"""
+		:return: the next character that isn't whitespace, '' at the end
+		"""
+		while True:
+			self.pos = WHITESPACE.match(self.text, self.pos).end()
+			if self.pos < len(self.text) or self.eof:
+				return self.text[self.pos:self.pos + 1]
+			self.fill()
+
+	def expect(self, char):
+		if self.peek() != char:
+			raise StreamError(f'expected {char} at character {self.position}')
+		self.pos += 1
+
+	def value(self):
+		"""
+		:return: the next JSON value, read across as many chunks as it spans
+		"""
+		self.peek()
+		while True:
+			try:
+				value, end = decoder.raw_decode(self.text, self.pos)
+			except ValueError as e:
+				if self.eof:
+					raise StreamError(f'invalid JSON at character {self.position}: {e.msg}')
+				if len(self.text) - self.pos > self.max_item_size:
+					raise StreamError(f'item at character {self.position} is larger than {self.max_item_size} bytes')
+				self.fill()
+				continue
+
+			# a number or literal at the end of the text may go on in the next chunk
+			if (not self.eof and not isinstance(value, (dict, list, str))
+					and SCALAR_TAIL.match(self.text, end).end() == len(self.text)):
+				self.fill()
+				continue
+
+			self.pos = end
+			return value
+
+
+def iter_json_array(stream, key=None, **options):
+	"""
+	yields the items of a JSON array, or of the array under `key` of an object
+	:raises StreamError: on a body of another shape, as soon as it is read
+	"""
+	buffer = TextBuffer(stream, **options)
+	wrapped = key is not None and buffer.peek() == '{'
+
+	if wrapped:
+		buffer.pos += 1
+		if buffer.peek() != '"' or buffer.value() != key:
+			raise StreamError(f'expected an object with only "{key}"')
+		buffer.expect(':')
+
+	buffer.expect('[')
+	if buffer.peek() == ']':
+		buffer.pos += 1
+	else:
+		while True:
+			yield buffer.value()
+			separator = buffer.peek()
+			buffer.pos += 1
+			if separator == ']':
+				break
+			if separator != ',':
+				raise StreamError(f'expected , or ] at character {buffer.position - 1}')
+
+	if wrapped:
+		buffer.expect('}')
+
+	if buffer.peek():
+		raise StreamError(f'unexpected data at character {buffer.position}')
+
+
+def iter_ndjson(stream, max_item_size=MAX_ITEM_SIZE, **options):
+	"""
+	yields the value on each line that isn't blank
+	"""
+	for number, line in enumerate(iter(lambda: stream.readline(max_item_size + 1), b''), 1):
+		if len(line) > max_item_size:
+			raise StreamError(f'line {number} is longer than {max_item_size} bytes')
+
+		line = line.strip()
+		if not line:
+			continue
+
+		try:
+			yield json.loads(line.decode('utf-8'))
+		except ValueError as e:
+			raise StreamError(f'line {number}: {e}')
+
+
+def iter_items(stream, mimetype, key=None, **options):
+	"""
+	yields the items of an NDJSON or JSON body, by its mimetype
+	"""
+	if mimetype in NDJSON_TYPES:
+		return iter_ndjson(stream, **options)
+	return iter_json_array(stream, key=key, **options)
+
+
+def batches(items, size):
+	"""yields lists of up to `size` items"""
+	items = iter(items)
+	while True:
+		batch = list(islice(items, size))
+		if not batch:
+			return
+		yield batch
@@ -0,0 +1,380 @@
+"""
+routing of each library's (tenant's) requests to its own schema or database
+
+The tenant is named by the host name: with TENANT_HOST_SUFFIX =
+'.books.example.com', requests to central.books.example.com belong to
+`central`. User ids are only meaningful in the library that issued them, so
+tokens issued on a tenant's host carry its `tenant` claim and are refused
+(403) on any other host, the default one included; tokens without the claim
+are only accepted on the default host.
+
+Sessions route their queries to the tenant's engine (TenantSession.get_bind).
+Each tenant gets an engine of its own, created on first use, with a small
+bounded pool (TENANT_POOL_SIZE + TENANT_MAX_OVERFLOW), so a busy tenant waits
+on its own connections, then gets 503s, instead of starving the others. At
+most TENANT_MAX_ENGINES engines are kept; the least recently used idle one is
+disposed to make room, which bounds the connections a worker can hold.
+Requests, jobs and group commits lease their tenant's engine while they run,
+see TenantRouter.engine(lease=True), and leased engines are never evicted: an
+engine disposed between being handed out and checking out a connection would
+quietly open a pool of its own, outside the bound.
+
+With TENANT_SCHEMA = 'tenant_{tenant}' tenants share the database of
+TENANT_DATABASE_URL (or SQLALCHEMY_DATABASE_URI) and are kept apart by
+search_path; with TENANT_SCHEMA = None, TENANT_DATABASE_URL names a database
+per tenant, e.g. 'postgresql://localhost/books_{tenant}'. Requests without
+a tenant use the default database. Archival runs in the database of the
+library that queued it; the read model only serves the default database.
+
+Tables marked info={'shared': True}, the job queue and the audit trail, only
+exist in the default database and hold every tenant's rows in a `tenant`
+column. The job worker and the group commit flusher run each write in the
+tenant it was queued for.
+
+create_tenant makes a library's tables as of the latest migration and stamps
+its own alembic_version (in its schema) at head. Each library is then
+migrated apart from the default database, after it:
+
+    python manage.py db upgrade
+    python manage.py db upgrade -x tenant=central
+
+Migrations of shared tables do nothing for a tenant, see migrating_tenant.
+"""
+import logging
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+
+import jwt
+from flask import current_app, g, has_app_context, jsonify, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, orm
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import OperationalError, TimeoutError
+from sqlalchemy.pool import NullPool
+
+logger = logging.getLogger('hello_books.tenants')
+
+# tenant names end up in schema and database names
+TENANT_NAME = re.compile(r'^[a-z][a-z0-9_]{0,39}$')
+
+MIGRATIONS_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+
+class UnknownTenant(LookupError):
+	pass
+
+
+def current_tenant():
+	"""
+	:return: the tenant of the current request, or None
+	"""
+	return g.get('tenant') if has_app_context() else None
+
+
+class TenantSession(SignallingSession):
+	"""session whose queries go to the current tenant's engine"""
+
+	def get_bind(self, mapper=None, clause=None):
+		tenant = current_tenant()
+
+		if tenant is not None and not is_shared(mapper.local_table if mapper is not None else clause):
+			return self.app.extensions['tenants'].engine(tenant)
+
+		return super().get_bind(mapper, clause)
+
+
+def is_shared(clause):
+	"""
+	:return: whether the table, or the table an INSERT, UPDATE or DELETE
+	writes, is kept in the default database for all tenants
+	"""
+	table = getattr(clause, 'table', clause)
+	return bool(getattr(table, 'info', {}).get('shared'))
+
+
+def tenant_tables(metadata):
+	"""
+	:return: the tables each tenant has a copy of
+	"""
+	return [table for table in metadata.sorted_tables if not table.info.get('shared')]
+
+
+def migrating_tenant():
+	"""
+	:return: the tenant alembic is migrating, given as `-x tenant=name`,
+	None for the default database
+	"""
+	from alembic import context
+
+	return context.get_x_argument(as_dictionary=True).get('tenant')
+
+
+class TenantSQLAlchemy(SQLAlchemy):
+	"""SQLAlchemy whose sessions are TenantSessions"""
+
+	def create_session(self, options):
+		return orm.sessionmaker(class_=TenantSession, db=self, **options)
+
+
+def token_claims(token):
+	"""
+	:return: the claims of a validly signed token, or None. Expiry and
+	revocation are checked where the token is used
+	"""
+	try:
+		return jwt.decode(token, str(current_app.config.get('SECRET')), algorithms=['HS256'],
+						  options={'verify_exp': False})
+	except jwt.InvalidTokenError:
+		return None
+
+
+def host_tenant(host, suffix):
+	"""
+	:return: the tenant named by the host's first label, or None
+	"""
+	host = host.split(':', 1)[0].lower()
+
+	if suffix and host.endswith(suffix) and host != suffix.lstrip('.'):
+		return host[:-len(suffix)]
+
+	return None
+
+
+class TenantRouter(object):
+	"""resolves the tenant of requests and keeps an engine per tenant"""
+
+	def __init__(self, app=None):
+		self.app = None
+		self.engines = OrderedDict()
+		# tenant: number of requests, jobs and flushes holding its engine
+		self.leases = Counter()
+		self.lock = threading.Lock()
+		self.created = 0
+		self.evicted = 0
+
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		self.app = app
+		app.extensions['tenants'] = self
+		app.before_request(self.before_request)
+		app.teardown_request(self.teardown_request)
+		app.register_error_handler(UnknownTenant, self.unknown_tenant)
+		app.register_error_handler(TimeoutError, self.pool_exhausted)
+
+	def url(self, tenant):
+		config = self.app.config
+		template = config.get('TENANT_DATABASE_URL') or config['SQLALCHEMY_DATABASE_URI']
+		return template.format(tenant=tenant)
+
+	def schema(self, tenant):
+		template = self.app.config.get('TENANT_SCHEMA')
+		return template.format(tenant=tenant) if template else None
+
+	def create_engine(self, tenant):
+		config = self.app.config
+		schema = self.schema(tenant)
+		engine = create_engine(
+			self.url(tenant),
+			pool_size=config.get('TENANT_POOL_SIZE', 2),
+			max_overflow=config.get('TENANT_MAX_OVERFLOW', 2),
+			pool_timeout=config.get('TENANT_POOL_TIMEOUT', 5),
+			connect_args={'options': f'-c search_path={schema}'} if schema else {})
+
+		# an unknown tenant is refused once here, not by every query
+		try:
+			with engine.connect() as connection:
+				if schema and not connection.execute(
+						'SELECT 1 FROM information_schema.schemata WHERE schema_name = %s', schema).scalar():
+					raise UnknownTenant(tenant)
+		except OperationalError as e:
+			engine.dispose()
+			if self.database_missing(tenant, e):
+				raise UnknownTenant(tenant)
+			raise
+		except UnknownTenant:
+			engine.dispose()
+			raise
+
+		return engine
+
+	def database_missing(self, tenant, error):
+		"""
+		:return: whether connecting to the tenant failed because its database doesn't exist
+		"""
+		# invalid_catalog_name
+		if getattr(error.orig, 'pgcode', None) == '3D000':
+			return True
+		if self.schema(tenant):
+			return False
+
+		# psycopg2 has no sqlstate for connections that failed, ask the server's catalog
+		url = make_url(self.url(tenant))
+		database, url.database = url.database, make_url(self.app.config['SQLALCHEMY_DATABASE_URI']).database
+		catalog = create_engine(url, poolclass=NullPool)
+		try:
+			with catalog.connect() as connection:
+				return connection.execute('SELECT 1 FROM pg_database WHERE datname = %s', database).scalar() is None
+		except OperationalError:
+			return False
+		finally:
+			catalog.dispose()
+
+	def engine(self, tenant, lease=False):
+		"""
+		:param lease: keep the engine from eviction until release(tenant)
+		:return: the tenant's engine, created on first use
+		:raises UnknownTenant:
+		"""
+		with self.lock:
+			engine = self.engines.get(tenant)
+			if engine is not None:
+				self.engines.move_to_end(tenant)
+				if lease:
+					self.leases[tenant] += 1
+				return engine
+
+		if not TENANT_NAME.match(tenant):
+			raise UnknownTenant(tenant)
+
+		# connecting is slow, other tenants' requests don't wait for it
+		engine = self.create_engine(tenant)
+
+		with self.lock:
+			if tenant in self.engines:
+				# another thread created it meanwhile
+				created, engine = engine, self.engines[tenant]
+				self.engines.move_to_end(tenant)
+				evicted = [created]
+			else:
+				self.engines[tenant] = engine
+				self.created += 1
+				evicted = self.evict()
+			if lease:
+				self.leases[tenant] += 1
+
+		for idle in evicted:
+			idle.dispose()
+
+		return engine
+
+	def release(self, tenant):
+		"""ends a lease taken by engine(tenant, lease=True)"""
+		with self.lock:
+			self.leases[tenant] -= 1
+			if self.leases[tenant] > 0:
+				return
+			del self.leases[tenant]
+			# engines kept over TENANT_MAX_ENGINES while leased go now
+			evicted = self.evict()
+
+		for idle in evicted:
+			idle.dispose()
+
+	def evict(self):
+		"""
+		removes the least recently used idle engines over TENANT_MAX_ENGINES,
+		with the lock held
+		:return: the engines to dispose
+		"""
+		excess = len(self.engines) - self.app.config.get('TENANT_MAX_ENGINES', 50)
+		evicted = []
+
+		# the newest engine is about to be used
+		for tenant, engine in list(self.engines.items())[:-1]:
+			if excess <= 0:
+				break
+			# engines in use are left for a later eviction
+			if self.leases[tenant] or engine.pool.checkedout():
+				continue
+			del self.engines[tenant]
+			evicted.append(engine)
+			excess -= 1
+
+		self.evicted += len(evicted)
+		return evicted
+
+	def describe(self):
+		with self.lock:
+			return {
+				'engines': len(self.engines),
+				'created': self.created,
+				'evicted': self.evicted,
+				'leased': len(self.leases),
+				'connections': sum(engine.pool.checkedin() + engine.pool.checkedout()
+								   for engine in self.engines.values())
+			}
+
+	def dispose(self):
+		with self.lock:
+			engines = list(self.engines.values())
+			self.engines.clear()
+
+		for engine in engines:
+			engine.dispose()
+
+	def before_request(self):
+		config = current_app.config
+
+		if not config.get('TENANT_ROUTING_ENABLED') or request.blueprint == 'health':
+			return None
+
+		tenant = host_tenant(request.host, config.get('TENANT_HOST_SUFFIX'))
+		auth_header = request.headers.get('Authorization', '')
+		claims = token_claims(auth_header[7:]) if auth_header.startswith('Bearer ') else None
+
+		# user N of one library is someone else in another one
+		if claims is not None and claims.get('tenant') != tenant:
+			return jsonify({'error': "token was issued for another library"}), 403
+
+		if tenant is not None:
+			# unknown tenants are refused before any view runs
+			self.engine(tenant, lease=True)
+			g.tenant = g.tenant_lease = tenant
+
+		return None
+
+	def teardown_request(self, exc):
+		tenant = g.pop('tenant_lease', None)
+		if tenant is not None:
+			self.release(tenant)
+
+	def unknown_tenant(self, e):
+		return jsonify({'error': 'unknown library'}), 404
+
+	def pool_exhausted(self, e):
+		logger.warning("connection pool exhausted for tenant %s", current_tenant())
+		response = jsonify({'error': 'service unavailable'})
+		response.status_code = 503
+		response.headers['Retry-After'] = str(current_app.config.get('CONCURRENCY_RETRY_AFTER', 1))
+		return response
+
+
+def create_tenant(app, tenant):
+	"""
+	creates the tables of a new tenant in its schema, or its existing database,
+	and marks them as migrated to head
+	"""
+	from alembic.migration import MigrationContext
+	from alembic.script import ScriptDirectory
+	from app import db
+
+	if not TENANT_NAME.match(tenant):
+		raise ValueError(f'tenant names must match {TENANT_NAME.pattern}')
+
+	router = app.extensions['tenants']
+	schema = router.schema(tenant)
+	engine = create_engine(router.url(tenant), connect_args={'options': f'-c search_path={schema}'} if schema else {})
+	try:
+		if schema:
+			engine.execute(f'CREATE SCHEMA IF NOT EXISTS "{schema}"')
+		with engine.begin() as connection:
+			db.metadata.create_all(bind=connection, tables=tenant_tables(db.metadata))
+			# later migrations are run with `-x tenant=name`, from here on
+			context = MigrationContext.configure(connection, opts={'version_table_schema': schema})
+			context.stamp(ScriptDirectory(MIGRATIONS_DIRECTORY), 'head')
+	finally:
+		engine.dispose()
@@ -0,0 +1,200 @@
+"""
+request tracing: a request id on every response and, for sampled requests,
+one JSON log line with the time spent in each phase of the request
+
+Views mark phases with `span`:
+
+	with span('db'):
+		book = Booklist.query.get(id)
+
+Outside a sampled request `span` returns a shared no-op context manager,
+so unsampled requests only pay for a `g` lookup per phase.
+"""
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import uuid
+
+from flask import current_app, g, request
+
+logger = logging.getLogger('hello_books.trace')
+
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+
+class NoopSpan(object):
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		return False
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Span(object):
+	__slots__ = ('trace', 'name', 'start')
+
+	def __init__(self, trace, name):
+		self.trace = trace
+		self.name = name
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc):
+		self.trace.spans.append((self.name, self.start, time.perf_counter()))
+		return False
+
+
+class Trace(object):
+	"""the spans recorded for one sampled request"""
+
+	def __init__(self, request_id):
+		self.request_id = request_id
+		self.spans = []
+		self.start = time.perf_counter()
+		self.start_epoch = time.time()
+
+	def span(self, name):
+		return Span(self, name)
+
+	def phases(self):
+		"""
+		:return: {phase: milliseconds}, summed over spans of the same name
+		"""
+		totals = {}
+		for name, start, end in self.spans:
+			totals[name] = totals.get(name, 0.0) + (end - start) * 1000
+		return {name: round(ms, 3) for name, ms in totals.items()}
+
+	def epoch_nanos(self, counter):
+		return int((self.start_epoch + counter - self.start) * 1e9)
+
+
+def span(name):
+	"""times a phase of the current request if it is sampled"""
+	trace = g.get('trace')
+
+	if trace is None:
+		return NOOP_SPAN
+
+	return trace.span(name)
+
+
+class FileSpanExporter(object):
+	"""
+	appends traces to a file as OTLP/JSON lines, the format read and written
+	by the OpenTelemetry collector's file receiver and exporter
+	"""
+
+	def __init__(self, path, service_name='hello-books'):
+		self.path = path
+		self.service_name = service_name
+		self.lock = threading.Lock()
+
+	def otlp(self, trace, name, end, status, attributes):
+		trace_id = trace.request_id if re.match(r'^[0-9a-f]{32}$', trace.request_id) else uuid.uuid4().hex
+		root_id = os.urandom(8).hex()
+
+		def attribute(key, value):
+			kind = 'intValue' if isinstance(value, int) else 'stringValue'
+			return {'key': key, 'value': {kind: value}}
+
+		spans = [{
+			'traceId': trace_id,
+			'spanId': root_id,
+			'name': name,
+			'kind': 2,
+			'startTimeUnixNano': str(trace.epoch_nanos(trace.start)),
+			'endTimeUnixNano': str(trace.epoch_nanos(end)),
+			'attributes': [attribute(key, value) for key, value in attributes.items()],
+			'status': {'code': 2 if status >= 500 else 1}
+		}]
+		spans.extend({
+			'traceId': trace_id,
+			'spanId': os.urandom(8).hex(),
+			'parentSpanId': root_id,
+			'name': span_name,
+			'kind': 1,
+			'startTimeUnixNano': str(trace.epoch_nanos(start)),
+			'endTimeUnixNano': str(trace.epoch_nanos(span_end)),
+		} for span_name, start, span_end in trace.spans)
+
+		return {'resourceSpans': [{
+			'resource': {'attributes': [attribute('service.name', self.service_name)]},
+			'scopeSpans': [{'scope': {'name': 'hello_books.tracing'}, 'spans': spans}]
+		}]}
+
+	def export(self, trace, name, end, status, attributes):
+		line = json.dumps(self.otlp(trace, name, end, status, attributes), separators=(',', ':'))
+
+		with self.lock:
+			with open(self.path, 'a') as export_file:
+				export_file.write(line + '\n')
+
+
+class Tracer(object):
+	"""assigns request ids, samples requests and reports their phases"""
+
+	def __init__(self, app=None):
+		self.exporter = None
+
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		app.extensions['tracer'] = self
+		app.before_request(self.before_request)
+		app.after_request(self.after_request)
+
+	def before_request(self):
+		request_id = request.headers.get('X-Request-ID', '')
+
+		if not REQUEST_ID_PATTERN.match(request_id):
+			request_id = uuid.uuid4().hex
+
+		g.request_id = request_id
+
+		if random.random() < current_app.config.get('TRACE_SAMPLE_RATE', 0):
+			g.trace = Trace(request_id)
+
+	def after_request(self, response):
+		request_id = g.get('request_id')
+		if request_id is None:
+			return response
+
+		response.headers['X-Request-ID'] = request_id
+		trace = g.pop('trace', None)
+
+		if trace is not None:
+			end = time.perf_counter()
+			logger.info(json.dumps({
+				'request_id': request_id,
+				'method': request.method,
+				'path': request.path,
+				'endpoint': request.endpoint,
+				'status': response.status_code,
+				'duration_ms': round((end - trace.start) * 1000, 3),
+				'phases': trace.phases()
+			}, separators=(',', ':')))
+
+			path = current_app.config.get('TRACE_EXPORT_FILE')
+			if path:
+				if self.exporter is None or self.exporter.path != path:
+					self.exporter = FileSpanExporter(path)
+				self.exporter.export(trace, f'{request.method} {request.url_rule or request.path}', end,
+									 response.status_code, {
+										 'http.method': request.method,
+										 'http.target': request.path,
+										 'http.status_code': response.status_code,
+										 'request.id': request_id
+									 })
+
+		return response
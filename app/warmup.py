@@ -0,0 +1,115 @@
+"""
+per-process warm-up, run before a worker reports ready on /readyz
+
+Steps are registered on the app's WarmUp and run in order in a background
+thread, once in every worker process: pooled connections and caches don't
+survive a fork, so warming the parent is not enough.
+
+	warmup = app.extensions['warmup']
+	warmup.register('connection_pool', prime_pool)
+"""
+import logging
+import os
+import threading
+import time
+
+from app import db
+
+logger = logging.getLogger('hello_books.warmup')
+
+
+class WarmUp(object):
+	"""registry of warm-up steps and their results in this process"""
+
+	def __init__(self, app=None):
+		self.app = None
+		self.steps = []
+		self.results = {}
+		self.pid = None
+		self.done = threading.Event()
+		self.lock = threading.Lock()
+
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		self.app = app
+		app.extensions['warmup'] = self
+
+	def register(self, name, function):
+		"""
+		:param function: called with the app, inside an app context
+		"""
+		self.steps.append((name, function))
+		return function
+
+	def start(self):
+		"""starts the steps in a thread, once per process"""
+		with self.lock:
+			if self.pid == os.getpid():
+				return
+			self.pid = os.getpid()
+			self.done = threading.Event()
+
+			if not self.app.config.get('WARMUP_ENABLED', True):
+				self.results = {}
+				self.done.set()
+				return
+
+			self.results = {name: {'status': 'pending'} for name, _ in self.steps}
+			threading.Thread(target=self.run, name='warm-up', daemon=True).start()
+
+	def run(self):
+		with self.app.app_context():
+			for name, function in self.steps:
+				start = time.perf_counter()
+				try:
+					function(self.app)
+					result = {'status': 'ok'}
+				except Exception as e:
+					# a failed step leaves the worker cold, not unusable
+					logger.exception("warm-up step %s failed", name)
+					result = {'status': 'failed', 'error': str(e)}
+				finally:
+					db.session.remove()
+
+				result['ms'] = round((time.perf_counter() - start) * 1000, 1)
+				self.results[name] = result
+
+		self.done.set()
+
+	@property
+	def finished(self):
+		return self.pid == os.getpid() and self.done.is_set()
+
+	def describe(self):
+		return {'finished': self.finished, 'steps': dict(self.results)}
+
+
+def prime_pool(app):
+	"""opens pooled connections up front, so early requests don't wait on connecting"""
+	connections = []
+	try:
+		for _ in range(app.config.get('WARMUP_POOL_CONNECTIONS', 5)):
+			connection = db.engine.connect()
+			connections.append(connection)
+			connection.execute('SELECT 1')
+	finally:
+		for connection in connections:
+			connection.close()
+
+
+def load_hot_books(app):
+	"""
+	reads the most recently modified books the way GET /api/v2/books/<id>
+	does, which compiles its query and brings the rows and index pages into
+	Postgres' buffer cache
+	"""
+	from app.models import Booklist
+
+	hot = Booklist.live().with_entities(Booklist.id) \
+		.order_by(Booklist.date_modified.desc()) \
+		.limit(app.config.get('WARMUP_HOT_BOOKS', 100))
+
+	for (book_id,) in hot.all():
+		Booklist.live().filter(Booklist.id == book_id).first()
@@ -0,0 +1,92 @@
+"""
+cost of auditing a login: AuditLog.record on its own, against writing the
+event with an INSERT of its own, and logins/sec with auditing on and off
+
+Usage: APP_SETTINGS=testing python -m benchmarks.audit [events] [seconds]
+"""
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+from app import create_app, db
+from app.models import APIUser, AuditEvent
+
+USER = {'username': 'audit_bench', 'email': 'audit_bench@bench.local', 'password': ',5Bench_password'}
+
+
+def per_event(app, events):
+	"""
+	:return: microseconds per event, buffered and inserted one by one
+	"""
+	audit = app.extensions['audit']
+	audit.capacity = events
+
+	with app.test_request_context():
+		start = time.perf_counter()
+		for number in range(events):
+			audit.record('login', number, 'audit_bench')
+		buffered = time.perf_counter() - start
+
+		start = time.perf_counter()
+		written = audit.flush()
+		flushed = time.perf_counter() - start
+
+		sample = min(events, 1000)
+		start = time.perf_counter()
+		for number in range(sample):
+			db.session.add(AuditEvent(kind='login', user_id=number, username='audit_bench',
+									  created_at=datetime.utcnow()))
+			db.session.commit()
+		inserted = time.perf_counter() - start
+
+	print(f"{'':>22} {'µs/event':>9}")
+	print(f"{'record (request path)':>22} {buffered / events * 1e6:>9.2f}")
+	print(f"{'batched write':>22} {flushed / written * 1e6:>9.2f}")
+	print(f"{'INSERT per event':>22} {inserted / sample * 1e6:>9.2f}")
+
+
+def logins(app, seconds):
+	client = app.test_client()
+	body = json.dumps(USER)
+	served = 0
+	deadline = time.perf_counter() + seconds
+	while time.perf_counter() < deadline:
+		client.post('/api/v2/auth/login', data=body, content_type='application/json')
+		served += 1
+	return served / seconds
+
+
+def main(events=200000, seconds=5):
+	app = create_app(os.getenv('APP_SETTINGS', 'testing'))
+	app.config['RATELIMIT_ENABLED'] = False
+	app.config['TRACE_SAMPLE_RATE'] = 0
+	# the writer thread would compete with the timings of per_event
+	app.config['AUDIT_FLUSH_THREAD'] = False
+
+	with app.app_context():
+		db.create_all()
+	app.test_client().post('/api/v2/auth/register', data=json.dumps(USER), content_type='application/json')
+
+	try:
+		per_event(app, events)
+		app.config['AUDIT_FLUSH_THREAD'] = True
+		app.extensions['audit'].pid = None
+
+		print(f"\n{'':>22} {'logins/s':>9}")
+		for enabled in (False, True):
+			app.config['AUDIT_ENABLED'] = enabled
+			print(f"{'audited' if enabled else 'not audited':>22} {logins(app, seconds):>9.0f}")
+		print(app.extensions['audit'].describe())
+	finally:
+		app.extensions['audit'].close()
+		with app.app_context():
+			AuditEvent.query.filter(AuditEvent.username == 'audit_bench').delete(synchronize_session=False)
+			APIUser.query.filter(APIUser.username == 'audit_bench').delete(synchronize_session=False)
+			db.session.commit()
+
+
+if __name__ == '__main__':
+	args = [int(arg) for arg in sys.argv[1:3]]
+	main(*args)
@@ -0,0 +1,84 @@
+"""
+commits/sec and latency of concurrent POST /api/v2/books, committed per
+request and with group commit
+
+Usage: APP_SETTINGS=testing python -m benchmarks.group_commit [threads] [seconds]
+"""
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+
+from app import create_app, db
+from app.isbn import check_digit_13
+
+counter = itertools.count()
+
+
+def xact_commits(app):
+	with app.app_context():
+		return db.session.execute(
+			'SELECT xact_commit FROM pg_stat_database WHERE datname = current_database()').scalar()
+
+
+def load(app, threads, seconds):
+	latencies = []
+	deadline = time.time() + seconds
+
+	def client():
+		test_client = app.test_client()
+		mine = []
+		while time.time() < deadline:
+			body = f'979{next(counter):09d}'
+			isbn = body + check_digit_13(body)
+			start = time.perf_counter()
+			test_client.post('/api/v2/books', data=json.dumps({'title': 'bench', 'isbn': isbn}),
+							 content_type='application/json')
+			mine.append(time.perf_counter() - start)
+		latencies.extend(mine)
+
+	workers = [threading.Thread(target=client) for _ in range(threads)]
+	for worker in workers:
+		worker.start()
+	for worker in workers:
+		worker.join()
+	return sorted(latencies)
+
+
+def run(app, grouped, threads, seconds):
+	app.config['GROUP_COMMIT_ENABLED'] = grouped
+	# statistics are flushed to pg_stat_database asynchronously
+	time.sleep(1)
+	commits = xact_commits(app)
+	latencies = load(app, threads, seconds)
+	time.sleep(1)
+	commits = xact_commits(app) - commits
+
+	p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+	print(f"{'group commit' if grouped else 'per request':>13} {len(latencies) / seconds:>9.0f} "
+		  f"{commits / seconds:>10.0f} {p99:>9.1f}")
+
+
+def main(threads=32, seconds=5):
+	app = create_app(os.getenv('APP_SETTINGS', 'testing'))
+	app.config['RATELIMIT_ENABLED'] = False
+	app.config['TRACE_SAMPLE_RATE'] = 0
+	with app.app_context():
+		db.create_all()
+
+	try:
+		print(f"{'':>13} {'writes/s':>9} {'commits/s':>10} {'p99 ms':>9}")
+		run(app, False, threads, seconds)
+		run(app, True, threads, seconds)
+	finally:
+		app.extensions['group_commit'].stop()
+		with app.app_context():
+			db.session.execute("DELETE FROM bookslist WHERE title = 'bench'")
+			db.session.commit()
+
+
+if __name__ == '__main__':
+	args = [int(arg) for arg in sys.argv[1:3]]
+	main(*args)
@@ -0,0 +1,81 @@
+"""
+validations/sec of app.isbn, one at a time and vectorized with NumPy
+
+The isbns are a mix of plain ISBN-13s, hyphenated ISBN-10s and isbns with a
+wrong check digit, generated as a NumPy bytes array.
+Usage: python -m benchmarks.isbn_validation [count]
+"""
+import sys
+import time
+
+import numpy as np
+
+from app.isbn import canonical, validate_many, InvalidISBN, WEIGHTS_13
+
+# canonical() is timed on this many of the isbns, the rest would take minutes
+PER_ITEM_COUNT = 200000
+
+
+def generate(count, seed=0):
+	"""
+	:return: bytes array of `count` isbns, 13 characters each
+	"""
+	rng = np.random.default_rng(seed)
+	digits = rng.integers(0, 10, size=(count, 13), dtype=np.int64)
+	kind = rng.integers(0, 5, size=count)
+
+	# ISBN-13: 978 or 979, 9 digits and the check digit
+	digits[:, :3] = [9, 7, 8]
+	digits[kind == 0, 2] = 9
+	digits[:, 12] = (10 - (digits[:, :12] @ np.array(WEIGHTS_13[:12])) % 10) % 10
+
+	chars = (digits + ord('0')).astype(np.uint8)
+
+	# ISBN-10 written as 0-306-40615-2
+	isbn_10 = (kind == 1) | (kind == 2)
+	check = (11 - (digits[:, 3:12] @ np.arange(10, 1, -1)) % 11) % 11
+	ten = np.empty((count, 13), dtype=np.uint8)
+	ten[:, [1, 5, 11]] = ord('-')
+	ten[:, [0, 2, 3, 4, 6, 7, 8, 9, 10]] = chars[:, 3:12]
+	ten[:, 12] = np.where(check == 10, ord('X'), check + ord('0'))
+	chars[isbn_10] = ten[isbn_10]
+
+	# a wrong check digit in every fifth isbn
+	wrong = kind == 3
+	last = chars[wrong, 12]
+	chars[wrong, 12] = np.where(last == ord('X'), ord('0'), np.where(last == ord('9'), ord('0'), last + 1))
+
+	return chars.view('S13').ravel()
+
+
+def main(count=10000000):
+	start = time.perf_counter()
+	isbns = generate(count)
+	print(f'generated {count} isbns in {time.perf_counter() - start:.1f}s')
+
+	start = time.perf_counter()
+	keys, valid = validate_many(isbns)
+	vectorized = time.perf_counter() - start
+
+	sample = [isbn.decode() for isbn in isbns[:PER_ITEM_COUNT].tolist()]
+	start = time.perf_counter()
+	accepted = 0
+	for isbn in sample:
+		try:
+			canonical(isbn)
+			accepted += 1
+		except InvalidISBN:
+			pass
+	per_item = time.perf_counter() - start
+
+	if accepted != int(valid[:len(sample)].sum()):
+		raise AssertionError('validate_many and canonical disagree')
+
+	print(f"{'mode':>12} {'isbns':>10} {'seconds':>8} {'isbns/s':>12}")
+	print(f"{'canonical':>12} {len(sample):>10} {per_item:>8.2f} {len(sample) / per_item:>12,.0f}")
+	print(f"{'vectorized':>12} {count:>10} {vectorized:>8.2f} {count / vectorized:>12,.0f}")
+	print(f'{valid.mean():.1%} valid')
+
+
+if __name__ == '__main__':
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000000)
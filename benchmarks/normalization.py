@@ -0,0 +1,60 @@
+"""
+calls/sec of format_inputs against the version it replaced
+
+"repeated" formats the same 500 titles over and over, like live traffic;
+"distinct" formats titles that are each seen once; "bulk" formats an import
+of titles with duplicates through format_many.
+Usage: python -m benchmarks.normalization [count]
+"""
+import random
+import re
+import sys
+import time
+
+from app.normalization import format_inputs, format_many, normalize
+
+
+def legacy_format_inputs(word):
+	"""format_inputs before app/normalization.py"""
+	json_input = word.lower().strip()
+	split_input = re.sub(' +', " ", json_input)
+	return "".join(split_input)
+
+
+def titles(count, distinct, seed=0):
+	rng = random.Random(seed)
+	words = ['the', 'Book', 'of', 'Hello', 'Books', 'a', 'Tale', 'RIVER', 'night', 'Garden']
+	pool = [
+		'  '.join(rng.choice(words) for _ in range(rng.randint(2, 6))) + f' {n}'
+		for n in range(distinct)
+	]
+	return [pool[rng.randrange(distinct)] for _ in range(count)]
+
+
+def rate(function, words):
+	start = time.perf_counter()
+	for word in words:
+		function(word)
+	return len(words) / (time.perf_counter() - start)
+
+
+def main(count=500000):
+	repeated = titles(count, 500)
+	distinct = titles(count, count, seed=1)
+	bulk = titles(count, count // 10, seed=2)
+
+	start = time.perf_counter()
+	format_many(bulk)
+	bulk_rate = count / (time.perf_counter() - start)
+
+	print(f"{'workload':>10} {'legacy/s':>12} {'uncached/s':>12} {'new/s':>12}")
+	print(f"{'repeated':>10} {rate(legacy_format_inputs, repeated):>12,.0f} "
+		  f"{rate(normalize, repeated):>12,.0f} {rate(format_inputs, repeated):>12,.0f}")
+	print(f"{'distinct':>10} {rate(legacy_format_inputs, distinct):>12,.0f} "
+		  f"{rate(normalize, distinct):>12,.0f} {rate(format_inputs, distinct):>12,.0f}")
+	print(f"{'bulk':>10} {rate(legacy_format_inputs, bulk):>12,.0f} "
+		  f"{rate(normalize, bulk):>12,.0f} {bulk_rate:>12,.0f}")
+
+
+if __name__ == '__main__':
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 500000)
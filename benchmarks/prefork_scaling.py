@@ -0,0 +1,118 @@
+"""
+throughput of GET /api/v2/books/<id> served by serve.py as workers are added
+
+Usage: APP_SETTINGS=testing python -m benchmarks.prefork_scaling [seconds]
+"""
+import http.client
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from benchmarks.startup import ROOT
+
+
+def free_port():
+	sock = socket.socket()
+	sock.bind(('127.0.0.1', 0))
+	port = sock.getsockname()[1]
+	sock.close()
+	return port
+
+
+def create_book(config_name):
+	from app import create_app, db
+	from app.models import Booklist
+
+	app = create_app(config_name)
+	with app.app_context():
+		db.create_all()
+		book = Booklist(title='scaling benchmark', isbn='0306406152')
+		book.save()
+		book_id = book.id
+		db.session.remove()
+	return app, book_id
+
+
+def delete_book(app, book_id):
+	from app import db
+	from app.models import Booklist
+
+	with app.app_context():
+		Booklist.query.filter(Booklist.id == book_id).delete()
+		db.session.commit()
+		db.session.remove()
+
+
+def client(port, path, seconds, results):
+	done = 0
+	deadline = time.time() + seconds
+	while time.time() < deadline:
+		conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+		conn.request('GET', path)
+		response = conn.getresponse()
+		response.read()
+		conn.close()
+		if response.status == 200:
+			done += 1
+	results.put(done)
+
+
+def wait_until_serving(port, timeout=15):
+	deadline = time.time() + timeout
+	while time.time() < deadline:
+		try:
+			socket.create_connection(('127.0.0.1', port), timeout=1).close()
+			return
+		except OSError:
+			time.sleep(0.1)
+	raise RuntimeError('server did not start')
+
+
+def run(workers, path, seconds, config_name):
+	port = free_port()
+	server = subprocess.Popen(
+		[sys.executable, 'serve.py', '--bind', f'127.0.0.1:{port}', '--workers', str(workers)],
+		cwd=ROOT, env=dict(os.environ, APP_SETTINGS=config_name),
+		stderr=subprocess.DEVNULL)
+	try:
+		wait_until_serving(port)
+		results = multiprocessing.Queue()
+		clients = [
+			multiprocessing.Process(target=client, args=(port, path, seconds, results))
+			for _ in range(workers * 2)
+		]
+		for proc in clients:
+			proc.start()
+		total = sum(results.get() for _ in clients)
+		for proc in clients:
+			proc.join()
+		return total / seconds
+	finally:
+		server.terminate()
+		server.wait()
+
+
+def main(seconds=5):
+	config_name = os.getenv('APP_SETTINGS', 'testing')
+	app, book_id = create_book(config_name)
+	path = f'/api/v2/books/{book_id}'
+	cores = os.cpu_count() or 1
+	counts = sorted(set([1, 2, 4, 8, 16, cores]) & set(range(1, cores + 1)))
+
+	try:
+		baseline = None
+		print(f"{'workers':>8} {'req/s':>10} {'speedup':>8} {'efficiency':>10}")
+		for workers in counts:
+			rate = run(workers, path, seconds, config_name)
+			baseline = baseline or rate
+			speedup = rate / baseline
+			print(f"{workers:>8} {rate:>10.0f} {speedup:>8.2f} {speedup / workers:>10.0%}")
+	finally:
+		delete_book(app, book_id)
+
+
+if __name__ == '__main__':
+	main(float(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,113 @@
+"""
+memory per book of the read model against ORM Booklist instances, and
+requests/sec of GET /api/v2/books/<id> and GET /api/v2/books served from
+Postgres and from the read model
+
+Usage: APP_SETTINGS=testing python -m benchmarks.read_model [books] [seconds]
+"""
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+from app import create_app, db
+from app.models import Booklist
+from app.readmodel import Catalogue
+
+TITLE = 'bench read model'
+
+
+def populate(count):
+	# ISBN-13s 979000000000x, the check digit computed in SQL
+	db.session.execute("""
+		INSERT INTO bookslist (title, isbn, isbn_key, date_created, date_modified)
+		SELECT :title || ' ' || (n % 1000), isbn, isbn::bigint, now(), now()
+		FROM (
+			SELECT n, body || ((10 - (
+				SELECT sum(substr(body, i, 1)::int * (CASE WHEN i % 2 = 0 THEN 3 ELSE 1 END))
+				FROM generate_series(1, 12) i) % 10) % 10) AS isbn
+			FROM (SELECT n, '979' || lpad(n::text, 9, '0') AS body FROM generate_series(1, :count) n) bodies
+		) books
+	""", {'title': TITLE, 'count': count})
+	db.session.commit()
+
+
+def measure(load):
+	"""
+	:return: what load() returned and the bytes it still holds
+	"""
+	gc.collect()
+	tracemalloc.start()
+	before = tracemalloc.get_traced_memory()[0]
+	loaded = load()
+	gc.collect()
+	held = tracemalloc.get_traced_memory()[0] - before
+	tracemalloc.stop()
+	return loaded, held
+
+
+def load_orm():
+	books = Booklist.get_all()
+	# the session's identity map keeps them alive as well
+	return books
+
+
+def throughput(app, urls, seconds):
+	client = app.test_client()
+	served = 0
+	deadline = time.perf_counter() + seconds
+	while time.perf_counter() < deadline:
+		client.get(random.choice(urls))
+		served += 1
+	return served / seconds
+
+
+def main(count=100000, seconds=5):
+	app = create_app(os.getenv('APP_SETTINGS', 'testing'))
+	app.config['RATELIMIT_ENABLED'] = False
+	app.config['TRACE_SAMPLE_RATE'] = 0
+	read_model = app.extensions['read_model']
+
+	with app.app_context():
+		db.create_all()
+		populate(count)
+
+	try:
+		with app.app_context():
+			books, orm_bytes = measure(load_orm)
+			ids = [book.id for book in books]
+			del books
+			db.session.remove()
+
+			catalogue, columnar_bytes = measure(read_model.load)
+			memory = catalogue.memory()
+
+		print(f'{len(catalogue)} books')
+		print(f"{'':>14} {'MB':>8} {'bytes/book':>11}")
+		print(f"{'ORM':>14} {orm_bytes / 2 ** 20:>8.1f} {orm_bytes / len(ids):>11.0f}")
+		print(f"{'read model':>14} {columnar_bytes / 2 ** 20:>8.1f} {columnar_bytes / len(ids):>11.0f}")
+		print(f"read model columns: {memory['columns']}")
+
+		single = [f'/api/v2/books/{book_id}' for book_id in random.sample(ids, min(len(ids), 10000))]
+		print(f"\n{'':>14} {'GET /<id>/s':>12}")
+		for enabled in (False, True):
+			app.config['READ_MODEL_ENABLED'] = enabled
+			print(f"{'read model' if enabled else 'postgres':>14} {throughput(app, single, seconds):>12.0f}")
+
+		print(f"\n{'':>14} {'GET all, s':>12}")
+		for enabled in (False, True):
+			app.config['READ_MODEL_ENABLED'] = enabled
+			start = time.perf_counter()
+			app.test_client().get('/api/v2/books')
+			print(f"{'read model' if enabled else 'postgres':>14} {time.perf_counter() - start:>12.2f}")
+	finally:
+		with app.app_context():
+			db.session.execute('DELETE FROM bookslist WHERE title LIKE :title', {'title': f'{TITLE}%'})
+			db.session.commit()
+
+
+if __name__ == '__main__':
+	args = [int(arg) for arg in sys.argv[1:3]]
+	main(*args)
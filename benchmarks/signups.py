@@ -0,0 +1,60 @@
+"""
+sign-ups per second: one POST /api/v2/auth/register per user against
+provision_users, which hashes a batch in parallel and inserts it at once
+
+Usage: APP_SETTINGS=testing python -m benchmarks.signups [users]
+"""
+import json
+import os
+import sys
+import time
+
+from app import create_app, db
+
+
+def users(prefix, count):
+	return [{
+		'username': f'{prefix}{i}',
+		'email': f'{prefix}{i}@bench.local',
+		'password': ',5Bench_password'
+	} for i in range(count)]
+
+
+def cleanup(app, prefix):
+	from app.models import APIUser
+
+	with app.app_context():
+		APIUser.query.filter(APIUser.username.like(f'{prefix}%')).delete(synchronize_session=False)
+		db.session.commit()
+		db.session.remove()
+
+
+def main(count=200):
+	from app.auth.views import provision_users
+
+	app = create_app(os.getenv('APP_SETTINGS', 'testing'))
+	with app.app_context():
+		db.create_all()
+	client = app.test_client()
+
+	try:
+		start = time.perf_counter()
+		for user in users('benchsingle', count):
+			client.post('/api/v2/auth/register', data=json.dumps(user), content_type='application/json')
+		single = count / (time.perf_counter() - start)
+
+		start = time.perf_counter()
+		with app.app_context():
+			provision_users(users('benchbatch', count))
+			db.session.remove()
+		batch = count / (time.perf_counter() - start)
+	finally:
+		cleanup(app, 'benchsingle')
+		cleanup(app, 'benchbatch')
+
+	print(f"register endpoint: {single:8.1f} sign-ups/s")
+	print(f"provision_users:   {batch:8.1f} sign-ups/s ({os.cpu_count()} cores)")
+
+
+if __name__ == '__main__':
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
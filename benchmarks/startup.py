@@ -0,0 +1,81 @@
+"""
+cold start benchmark: import time, create_app time and time to first response
+
+Each measurement runs in a fresh interpreter. Exits with status 1 when a
+phase is over its budget or a deferred module was imported.
+Usage: python -m benchmarks.startup [runs]
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# seconds, tests/test_startup.py fails past SLACK times these
+BUDGET = {
+	'import': 1.5,
+	'create_app': 0.5,
+	'first_response': 0.5,
+}
+
+# what the test allows over the budget, for loaded CI machines
+SLACK = 3
+
+# modules only manage.py or the first request need
+DEFERRED_MODULES = ('flask_script', 'flask_migrate', 'alembic', 'cerberus', 'numpy')
+
+
+def measure_once():
+	"""runs in the child interpreter"""
+	start = time.perf_counter()
+	from app import create_app
+	imported = time.perf_counter()
+	app = create_app('testing')
+	created = time.perf_counter()
+	loaded = [name for name in DEFERRED_MODULES if name in sys.modules]
+	# an unknown url answers from the 404 handler, without a database
+	app.test_client().get('/api/v2/cold-start')
+	responded = time.perf_counter()
+
+	return {
+		'import': imported - start,
+		'create_app': created - imported,
+		'first_response': responded - created,
+		'loaded_deferred_modules': loaded,
+	}
+
+
+def measure(runs=5):
+	"""
+	:return: the fastest of `runs` cold starts, each in a new interpreter
+	"""
+	results = []
+	for _ in range(runs):
+		output = subprocess.check_output(
+			[sys.executable, '-m', 'benchmarks.startup', '--child'], cwd=ROOT)
+		results.append(json.loads(output.decode()))
+
+	best = {key: min(r[key] for r in results) for key in BUDGET}
+	best['loaded_deferred_modules'] = sorted(
+		set(name for r in results for name in r['loaded_deferred_modules']))
+	return best
+
+
+def over_budget(result, slack=1):
+	"""
+	:return: the phases of `result` that took longer than `slack` times their budget
+	"""
+	return [phase for phase, budget in BUDGET.items() if result[phase] > budget * slack]
+
+
+if __name__ == '__main__':
+	if '--child' in sys.argv:
+		print(json.dumps(measure_once()))
+	else:
+		result = measure(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
+		for key in BUDGET:
+			print(f"{key:>15}: {result[key] * 1000:8.1f} ms (budget {BUDGET[key] * 1000:.0f} ms)")
+		print(f"deferred modules loaded: {result['loaded_deferred_modules'] or 'none'}")
+		sys.exit(1 if over_budget(result) or result['loaded_deferred_modules'] else 0)
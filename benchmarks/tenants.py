@@ -0,0 +1,155 @@
+"""
+GET /api/v2/books/<id> across 1,000 libraries in schemas of their own, with
+requests spread over them by a Zipf distribution like real traffic: a few
+large libraries and a long tail. Then again while the largest library has all
+of its connections taken, to show the others are still served.
+
+Reports requests/sec, latency, engines created and evicted, and the most
+connections the worker held at once, for a few engine caps: every engine
+created for a library past the cap costs a new connection.
+Usage: APP_SETTINGS=testing python -m benchmarks.tenants [tenants] [threads] [seconds]
+"""
+import logging
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from app import create_app, db
+
+SCHEMA = 'bench_{tenant}'
+# (TENANT_MAX_ENGINES, TENANT_POOL_SIZE, TENANT_MAX_OVERFLOW), 60 connections each,
+# within the default max_connections of 100
+LIMITS = ((30, 1, 1), (60, 1, 0))
+
+
+def tenant_name(index):
+	return f't{index:04d}'
+
+
+def create_schemas(count):
+	# schemas are created in chunks, each holds a few locks per table and index
+	for start in range(0, count, 100):
+		statements = []
+		for index in range(start, min(count, start + 100)):
+			schema = SCHEMA.format(tenant=tenant_name(index))
+			statements.append(f"""
+				CREATE SCHEMA {schema};
+				CREATE TABLE {schema}.bookslist (LIKE public.bookslist INCLUDING ALL);
+				INSERT INTO {schema}.bookslist (id, title, isbn, isbn_key, date_created, date_modified)
+				VALUES (1, 'book of {schema}', '9780306406157', 9780306406157, now(), now());
+			""")
+		db.session.execute(''.join(statements))
+		db.session.commit()
+
+
+def drop_schemas(count):
+	for start in range(0, count, 100):
+		db.session.execute(''.join(
+			f'DROP SCHEMA IF EXISTS {SCHEMA.format(tenant=tenant_name(index))} CASCADE;'
+			for index in range(start, min(count, start + 100))))
+		db.session.commit()
+
+
+def load(app, tenants, threads, seconds, seed=0):
+	"""
+	:return: {tenant index: [(status, seconds)]}
+	"""
+	results = {}
+	deadline = time.time() + seconds
+
+	def client(worker):
+		rng = np.random.default_rng(seed + worker)
+		test_client = app.test_client()
+		mine = []
+		while time.time() < deadline:
+			# zipf ranks start at 1, the long tail past the last library is folded back
+			index = (int(rng.zipf(1.2)) - 1) % tenants
+			start = time.perf_counter()
+			res = test_client.get('/api/v2/books/1', base_url=f'http://{tenant_name(index)}.books.bench')
+			mine.append((index, res.status_code, time.perf_counter() - start))
+		for index, status, elapsed in mine:
+			results.setdefault(index, []).append((status, elapsed))
+
+	workers = [threading.Thread(target=client, args=(worker,)) for worker in range(threads)]
+	for worker in workers:
+		worker.start()
+	for worker in workers:
+		worker.join()
+	return results
+
+
+def report(label, results, seconds, exclude=()):
+	latencies = sorted(elapsed for index, served in results.items() if index not in exclude
+					   for status, elapsed in served if status == 200)
+	p50 = latencies[len(latencies) // 2] * 1000
+	p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+	print(f'{label:>24} {len(latencies) / seconds:>7.0f} {p50:>7.1f} {p99:>7.1f} {len(results):>8}')
+
+
+def main(tenants=1000, threads=16, seconds=10):
+	app = create_app(os.getenv('APP_SETTINGS', 'testing'))
+	app.config.update(
+		RATELIMIT_ENABLED=False,
+		TRACE_SAMPLE_RATE=0,
+		TENANT_ROUTING_ENABLED=True,
+		TENANT_HOST_SUFFIX='.books.bench',
+		TENANT_SCHEMA=SCHEMA,
+		TENANT_POOL_TIMEOUT=0.5)
+	router = app.extensions['tenants']
+	# every request to the saturated library would log it
+	logging.getLogger('hello_books.tenants').setLevel(logging.ERROR)
+
+	with app.app_context():
+		db.create_all()
+		start = time.perf_counter()
+		create_schemas(tenants)
+		print(f'created {tenants} library schemas in {time.perf_counter() - start:.1f}s')
+
+	peak = [0]
+	sampling = threading.Event()
+
+	def sample():
+		while not sampling.wait(0.05):
+			peak[0] = max(peak[0], router.describe()['connections'])
+
+	sampler = threading.Thread(target=sample)
+	sampler.start()
+	try:
+		for engines, pool_size, overflow in LIMITS:
+			app.config.update(TENANT_MAX_ENGINES=engines, TENANT_POOL_SIZE=pool_size, TENANT_MAX_OVERFLOW=overflow)
+			router.dispose()
+			router.created = router.evicted = 0
+			peak[0] = 0
+			print(f'\n{engines} engines of {pool_size} + {overflow} connections')
+			print(f"{'':>24} {'req/s':>7} {'p50 ms':>7} {'p99 ms':>7} {'tenants':>8}")
+			report('spread', load(app, tenants, threads, seconds), seconds)
+
+			# the largest library has every connection of its pool taken
+			busy = router.engine(tenant_name(0))
+			held = [busy.connect() for _ in range(pool_size + overflow)]
+			try:
+				results = load(app, tenants, threads, seconds, seed=100)
+			finally:
+				for connection in held:
+					connection.close()
+			report('others, t0000 saturated', results, seconds, exclude=(0,))
+
+			statuses = [status for status, _ in results.get(0, [])]
+			stats = router.describe()
+			print(f't0000 answered {statuses.count(503)} of {len(statuses)} requests with 503')
+			print(f"engines created {stats['created']}, evicted {stats['evicted']}, "
+				  f"at most {peak[0]} connections held")
+	finally:
+		sampling.set()
+		sampler.join()
+		router.dispose()
+		with app.app_context():
+			drop_schemas(tenants)
+
+
+if __name__ == '__main__':
+	args = [int(arg) for arg in sys.argv[1:4]]
+	main(*args)
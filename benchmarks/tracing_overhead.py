@@ -0,0 +1,46 @@
+"""
+tracing overhead: request throughput with tracing at several sample rates
+
+Usage: APP_SETTINGS=testing python -m benchmarks.tracing_overhead [requests]
+"""
+import os
+import sys
+import time
+
+from app import create_app, db
+
+
+def throughput(app, requests, rounds=3):
+	"""
+	:return: best req/s of `rounds` runs
+	"""
+	client = app.test_client()
+	best = 0
+	for _ in range(rounds):
+		start = time.perf_counter()
+		for _ in range(requests):
+			client.get('/api/v2/books/1')
+		best = max(best, requests / (time.perf_counter() - start))
+	return best
+
+
+def main(requests=5000):
+	app = create_app(os.getenv('APP_SETTINGS', 'testing'))
+	app.config['RATELIMIT_ENABLED'] = False
+	with app.app_context():
+		db.create_all()
+
+	throughput(app, 200)
+	app.config['TRACE_SAMPLE_RATE'] = 0
+	baseline = throughput(app, requests)
+	print(f"{'sample rate':>12} {'req/s':>10} {'overhead':>9}")
+	print(f"{0:>12} {baseline:>10.0f} {'-':>9}")
+
+	for rate in (0.01, 0.1, 1.0):
+		app.config['TRACE_SAMPLE_RATE'] = rate
+		result = throughput(app, requests)
+		print(f"{rate:>12} {result:>10.0f} {1 - result / baseline:>9.2%}")
+
+
+if __name__ == '__main__':
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
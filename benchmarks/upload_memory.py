@@ -0,0 +1,163 @@
+"""
+peak memory of a worker taking a bulk import: POST /api/v2/books/import with
+a body generated as it is sent, parsed as it arrives and queued as jobs,
+against reading the whole body with request.get_json() as the endpoint did
+before, which only parses it (a lower bound of what the old view held).
+
+Each upload runs in a fresh interpreter, its peak RSS is ru_maxrss.
+Usage: APP_SETTINGS=testing python -m benchmarks.upload_memory [largest MB]
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MB = 1024 * 1024
+
+USER = {'username': 'upload_bench', 'email': 'upload_bench@bench.local', 'password': ',5Bench_password',
+		'is_admin': True}
+# every line is as long, so the body's size is known before it is generated
+LINE = '{"title": "upload bench book %010d", "isbn": "9780306406157"}'
+# (start, separator, end) of the body in each format
+FORMATS = {
+	'ndjson': (b'', b'\n', b'\n'),
+	'array': (b'[', b',', b']'),
+	'wrapped': (b'{"books": [', b',', b']}'),
+}
+
+
+class GeneratedBody(object):
+	"""a file-like body of about `size` bytes of books, made as it is read"""
+
+	def __init__(self, size, fmt):
+		self.start, self.separator, self.end = FORMATS[fmt]
+		line_size = len(LINE % 0) + len(self.separator)
+		self.books = (size - len(self.start) - len(self.end) + len(self.separator)) // line_size
+		self.size = len(self.start) + self.books * line_size - len(self.separator) + len(self.end)
+		self.next = 0
+		self.pending = self.start
+		self.position = 0
+
+	def fill(self, size):
+		lines = [self.pending]
+		length = len(self.pending)
+		while length < size and self.next < self.books:
+			self.next += 1
+			line = (LINE % self.next).encode() + (self.end if self.next == self.books else self.separator)
+			lines.append(line)
+			length += len(line)
+		self.pending = b''.join(lines)
+
+	def read(self, size=-1):
+		size = self.size if size is None or size < 0 else size
+		self.fill(size)
+		data, self.pending = self.pending[:size], self.pending[size:]
+		self.position += len(data)
+		return data
+
+	def readline(self, size=-1):
+		self.fill(1)
+		end = self.pending.find(b'\n') + 1 or len(self.pending)
+		return self.read(end if size is None or size < 0 else min(size, end))
+
+	# the test client seeks to the end and back to measure the body
+	def tell(self):
+		return self.position
+
+	def seek(self, offset, whence=0):
+		self.position = offset + (self.size if whence == 2 else 0)
+
+
+def peak_rss():
+	# kilobytes on Linux
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def upload_once(mode, size):
+	"""runs in the child interpreter"""
+	from app import create_app, db
+	from app.auth.views import provision_users
+	from app.models import APIUser, Job
+
+	app = create_app(os.getenv('APP_SETTINGS', 'testing'))
+	app.debug = False
+	app.config.update(
+		TRACE_SAMPLE_RATE=0,
+		BOOK_IMPORT_LIMIT=size,
+		ROUTE_BODY_LIMITS={'api_import_books': size + 1, 'buffered': size + 1},
+		# when testing, Flask-SQLAlchemy keeps every statement and its parameters until the request ends
+		SQLALCHEMY_RECORD_QUERIES=False)
+
+	@app.route('/bench/buffered', methods=['POST'])
+	def buffered():
+		from flask import jsonify, request
+		return jsonify({'books': len(request.get_json()['books'])}), 202
+
+	client = app.test_client()
+	with app.app_context():
+		db.create_all()
+		provision_users([USER])
+	login = {key: USER[key] for key in ('username', 'email', 'password')}
+	res = client.post('/api/v2/auth/login', data=json.dumps(login), content_type='application/json')
+	headers = {'Authorization': f"Bearer {json.loads(res.data.decode())['access_token']}"}
+
+	if mode == 'get_json':
+		url, body, content_type = '/bench/buffered', GeneratedBody(size, 'wrapped'), 'application/json'
+	elif mode == 'ndjson':
+		url, body, content_type = '/api/v2/books/import', GeneratedBody(size, 'ndjson'), 'application/x-ndjson'
+	else:
+		url, body, content_type = '/api/v2/books/import', GeneratedBody(size, 'array'), 'application/json'
+
+	baseline = peak_rss()
+	start = time.perf_counter()
+	res = client.post(url, input_stream=body, content_type=content_type, headers=headers)
+	elapsed = time.perf_counter() - start
+	result = json.loads(res.data.decode())
+
+	with app.app_context():
+		if result.get('jobs'):
+			Job.query.filter(Job.id.in_(result['jobs'])).delete(synchronize_session=False)
+		APIUser.query.filter(APIUser.username == USER['username']).delete(synchronize_session=False)
+		db.session.commit()
+
+	return {
+		'status': res.status_code,
+		'size': body.size,
+		'books': result.get('books'),
+		'jobs': len(result.get('jobs', ())),
+		'seconds': elapsed,
+		'baseline': baseline,
+		'peak': peak_rss(),
+	}
+
+
+def upload(mode, size):
+	output = subprocess.check_output(
+		[sys.executable, '-m', 'benchmarks.upload_memory', '--child', mode, str(size)], cwd=ROOT)
+	return json.loads(output.decode())
+
+
+def main(largest=1024):
+	sizes = [size for size in (16, 64, 256, 1024) if size <= largest]
+	print(f"{'':>10} {'MB':>6} {'status':>6} {'books':>9} {'jobs':>6} {'MB/s':>6} "
+		  f"{'start MB':>9} {'peak MB':>8} {'growth MB':>10}")
+	for mode in ('get_json', 'array', 'ndjson'):
+		for size in sizes:
+			# get_json holds the body and every parsed book, 256 MB already takes gigabytes
+			if mode == 'get_json' and size > 64:
+				continue
+			result = upload(mode, size * MB)
+			print(f"{mode:>10} {result['size'] / MB:>6.0f} {result['status']:>6} {result['books'] or 0:>9} "
+				  f"{result['jobs']:>6} {result['size'] / MB / result['seconds']:>6.1f} "
+				  f"{result['baseline'] / MB:>9.1f} {result['peak'] / MB:>8.1f} "
+				  f"{(result['peak'] - result['baseline']) / MB:>10.1f}")
+
+
+if __name__ == '__main__':
+	if '--child' in sys.argv:
+		print(json.dumps(upload_once(sys.argv[2], int(sys.argv[3]))))
+	else:
+		main(*[int(arg) for arg in sys.argv[1:2]])
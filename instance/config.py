@@ -1,4 +1,14 @@
 import os
+import tempfile
+
+
+def test_database_url():
+	"""
+	:return: the test database, one per worker when pytest-xdist runs tests in parallel
+	"""
+	url = os.getenv('TEST_DATABASE_URL', 'postgresql://localhost/test_hello_books')
+	worker = os.getenv('PYTEST_XDIST_WORKER')
+	return f'{url}_{worker}' if worker else url
 
 
 class Config(object):
@@ -6,8 +16,125 @@ class Config(object):
 	DEBUG = False
 	CSRF_ENABLED = True
 	SECRET = os.getenv('SECRET')
+	ACCESS_TOKEN_MINUTES = 30
+	REFRESH_TOKEN_DAYS = 14
+	# revoked token ids are in the database unless this is redis://host:port/db,
+	# or memory:// for a single worker process, see app/revocation.py
+	REVOCATION_STORAGE_URL = os.getenv('REVOCATION_STORAGE_URL')
+	# how often each worker reads the ids other workers revoked
+	REVOCATION_SYNC_SECONDS = 1.0
+	REVOCATION_SYNC_OVERLAP_SECONDS = 5
+	PASSWORD_HASH_METHOD = 'pbkdf2:sha256'
+	# most users POST /api/v2/auth/users/batch creates in one request
+	PROVISION_BATCH_LIMIT = 1000
 	SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL')
 
+	# admission control, see app/ratelimit.py
+	RATELIMIT_ENABLED = True
+	# redis://host:port/db shares buckets between workers; unset keeps them in process
+	RATELIMIT_STORAGE_URL = os.getenv('RATELIMIT_STORAGE_URL')
+	# endpoint -> rate tokens every `per` seconds, up to `burst` at once.
+	# scope is 'client' (remote address), 'user' (token subject) or 'route'
+	RATELIMIT_ROUTES = {
+		'auth.login_view': {'rate': 10, 'per': 60, 'burst': 5, 'scope': 'client'},
+		'auth.register_view': {'rate': 5, 'per': 60, 'burst': 5, 'scope': 'client'},
+	}
+	# load balancer probes must answer even when the worker is saturated
+	RATELIMIT_EXEMPT = ('health.healthz_view', 'health.readyz_view')
+	# requests handled at once by a worker process before answering 503, 0 disables
+	MAX_CONCURRENT_REQUESTS = int(os.getenv('MAX_CONCURRENT_REQUESTS', 64))
+	CONCURRENCY_RETRY_AFTER = 1
+
+	# share of requests whose phase timings are logged, see app/tracing.py
+	TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 0.01))
+	# also append sampled traces to this file as OTLP/JSON lines
+	TRACE_EXPORT_FILE = os.getenv('TRACE_EXPORT_FILE')
+
+	# on-demand profiling, see app/profiling.py
+	PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'hello_books_profiles'))
+	PROFILE_MAX_SECONDS = 300
+	PROFILE_SAMPLE_INTERVAL = 0.005
+
+	# coalesce concurrent book writes into shared transactions, see app/batching.py
+	GROUP_COMMIT_ENABLED = os.getenv('GROUP_COMMIT_ENABLED') == '1'
+	GROUP_COMMIT_MAX_BATCH = 100
+	GROUP_COMMIT_MAX_WAIT_MS = 2
+	GROUP_COMMIT_TIMEOUT = 5.0
+
+	# archival of soft-deleted books, see app/archival.py
+	ARCHIVE_AFTER_DAYS = 30
+	ARCHIVE_BATCH_SIZE = 500
+	ARCHIVE_PAUSE_SECONDS = 0.1
+
+	# background jobs, see app/jobs and `manage.py worker`
+	JOB_CONCURRENCY = int(os.getenv('JOB_CONCURRENCY', 2))
+	JOB_POLL_INTERVAL = 1.0
+	# a job whose worker stopped extending its lease by then is run again elsewhere
+	JOB_LEASE_SECONDS = 300
+	# how often a worker extends the lease of the job it runs
+	JOB_HEARTBEAT_SECONDS = 60
+	JOB_MAX_ATTEMPTS = 3
+	# most books POST /api/v2/books/import queues in one request, a job per batch
+	BOOK_IMPORT_LIMIT = int(os.getenv('BOOK_IMPORT_LIMIT', 10000000))
+	BOOK_IMPORT_BATCH_SIZE = 1000
+
+	# request body sizes in bytes, see app/limits.py. Bulk endpoints that
+	# parse their body as it arrives, see app/streaming.py, may take more
+	MAX_CONTENT_LENGTH = 1024 * 1024
+	ROUTE_BODY_LIMITS = {
+		'auth.login_view': 16 * 1024,
+		'auth.register_view': 16 * 1024,
+		'auth.refresh_view': 16 * 1024,
+		'auth.batch_registration_view': 8 * 1024 * 1024,
+		'api_import_books': 1024 * 1024 * 1024,
+	}
+
+	# serve book reads from memory, see app/readmodel.py
+	READ_MODEL_ENABLED = os.getenv('READ_MODEL_ENABLED') == '1'
+	READ_MODEL_POLL_SECONDS = 1.0
+	# changes committed this late after they started are still picked up
+	READ_MODEL_OVERLAP_SECONDS = 5
+	READ_MODEL_RELOAD_SECONDS = 3600
+	READ_MODEL_BATCH_SIZE = 10000
+
+	# per-library schemas or databases, see app/tenants.py
+	TENANT_ROUTING_ENABLED = os.getenv('TENANT_ROUTING_ENABLED') == '1'
+	# central.books.example.com belongs to the `central` library
+	TENANT_HOST_SUFFIX = os.getenv('TENANT_HOST_SUFFIX')
+	# {tenant} is replaced by the library; unset uses SQLALCHEMY_DATABASE_URI
+	TENANT_DATABASE_URL = os.getenv('TENANT_DATABASE_URL')
+	# search_path of the library's connections, None for a database per library
+	TENANT_SCHEMA = 'tenant_{tenant}'
+	# a worker holds at most TENANT_MAX_ENGINES * (TENANT_POOL_SIZE + TENANT_MAX_OVERFLOW) connections
+	TENANT_MAX_ENGINES = 50
+	TENANT_POOL_SIZE = 2
+	TENANT_MAX_OVERFLOW = 2
+	# seconds a request waits for one of its library's connections before a 503
+	TENANT_POOL_TIMEOUT = 5
+
+	# login audit trail, see app/audit.py
+	AUDIT_ENABLED = True
+	# events kept in memory while the database is slow, the oldest are dropped past it
+	AUDIT_BUFFER_SIZE = 10000
+	AUDIT_FLUSH_BATCH = 500
+	AUDIT_FLUSH_INTERVAL = 1.0
+	AUDIT_FLUSH_THREAD = True
+	# rows per page of the admin listings
+	ADMIN_PAGE_SIZE = 100
+	ADMIN_MAX_PAGE_SIZE = 1000
+
+	# readiness and warm-up, see app/health and app/warmup.py
+	HEALTH_CHECK_MIGRATIONS = True
+	WARMUP_ENABLED = True
+	WARMUP_POOL_CONNECTIONS = 5
+	WARMUP_HOT_BOOKS = 100
+
+	# pre-forked server, see serve.py. 0 workers starts one per core
+	WORKERS = int(os.getenv('WEB_CONCURRENCY', 0))
+	THREADS = int(os.getenv('WEB_THREADS', 1))
+	MAX_REQUESTS = int(os.getenv('MAX_REQUESTS', 0))
+	GRACEFUL_TIMEOUT = 30
+
 
 class DevelopmentConfig(Config):
 	"""Configurations for Development."""
@@ -17,8 +144,15 @@ class DevelopmentConfig(Config):
 class TestingConfig(Config):
 	"""Configurations for Testing, with a separate test database."""
 	TESTING = True
-	SQLALCHEMY_DATABASE_URI = 'postgresql://localhost/test_hello_books'
+	SQLALCHEMY_DATABASE_URI = test_database_url()
 	DEBUG = True
+	RATELIMIT_ENABLED = False
+	# a single iteration keeps registering and logging in test users cheap
+	PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1'
+	# tests create their tables without alembic
+	HEALTH_CHECK_MIGRATIONS = False
+	# tests flush audit events themselves, a writer thread would share their connection
+	AUDIT_FLUSH_THREAD = False
 
 
 class StagingConfig(Config):
@@ -1,4 +1,6 @@
 import os
+import sys
+import json
 import unittest
 # class for handling a set of commands
 from flask_script import Manager
@@ -15,6 +17,11 @@ manager = Manager(app)
 # Example usage: python manage.py db init
 manager.add_command('db', MigrateCommand)
 
+# user commands, preceded by the word "users"
+# Example usage: python manage.py users export > users.ndjson
+users_manager = Manager(usage='Manage API users')
+manager.add_command('users', users_manager)
+
 
 # define our command for testing called "test"
 # Usage: python manage.py test
@@ -28,5 +35,124 @@ def test():
 	return 1
 
 
+# define our command for creating users in bulk
+# Usage: python manage.py provision -f users.json
+@manager.option('-f', '--file', dest='path', default='-', help='JSON list of users, - reads stdin')
+@manager.option('-w', '--workers', dest='workers', type=int, default=None, help='password hashing threads')
+def provision(path, workers):
+	"""Creates users from a JSON list, hashing passwords in parallel."""
+	from app.auth.views import provision_users
+
+	with (sys.stdin if path == '-' else open(path)) as source:
+		records = json.load(source)
+
+	result = provision_users(records, workers=workers)
+	print(json.dumps(result, indent=2))
+	return 1 if result['errors'] else 0
+
+
+# define our command for archiving deleted books
+# Usage: python manage.py archive --days 30
+@manager.option('-d', '--days', dest='days', type=int, default=None, help='archive books deleted this many days ago')
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=None, help='books moved per transaction')
+@manager.option('-p', '--pause', dest='pause', type=float, default=None, help='seconds to sleep between batches')
+def archive(days, batch_size, pause):
+	"""Moves soft-deleted books into bookslist_archive in small batches."""
+	from app.archival import archive_deleted_books
+
+	config = app.config
+	archived = archive_deleted_books(
+		older_than_days=config['ARCHIVE_AFTER_DAYS'] if days is None else days,
+		batch_size=batch_size or config['ARCHIVE_BATCH_SIZE'],
+		pause=config['ARCHIVE_PAUSE_SECONDS'] if pause is None else pause
+	)
+	print(f'archived {archived} books')
+
+
+# define our command for exporting users
+# Usage: python manage.py users export -f users.csv --format csv
+@users_manager.option('-f', '--file', dest='path', default='-', help='file to write, - writes stdout')
+@users_manager.option('--format', dest='fmt', default='ndjson', choices=('ndjson', 'csv'), help='ndjson or csv')
+@users_manager.option('-b', '--batch-size', dest='batch_size', type=int, default=1000, help='users read per query')
+def export(path, fmt, batch_size):
+	"""Streams every user, without password hashes."""
+	from app.exports import export_users
+
+	if path == '-':
+		# stdout stays open, only a file is closed afterwards
+		count = export_users(sys.stdout, fmt=fmt, batch_size=batch_size)
+	else:
+		with open(path, 'w', newline='') as out:
+			count = export_users(out, fmt=fmt, batch_size=batch_size)
+	print(f'exported {count} users', file=sys.stderr)
+	return 0
+
+
+# define our command for running background jobs
+# Usage: python manage.py worker --concurrency 4
+@manager.option('-c', '--concurrency', dest='concurrency', type=int, default=None, help='jobs run at once')
+@manager.option('--once', dest='once', action='store_true', default=False, help='run due jobs, then exit')
+def worker(concurrency, once):
+	"""Runs queued jobs until interrupted, see app/jobs."""
+	import signal
+	from app.jobs.queue import JobWorker, run_pending
+
+	if once:
+		print(f'ran {run_pending()} jobs')
+		return 0
+
+	job_worker = JobWorker(
+		app,
+		concurrency=concurrency or app.config['JOB_CONCURRENCY'],
+		poll_interval=app.config['JOB_POLL_INTERVAL'])
+	signal.signal(signal.SIGTERM, job_worker.stop)
+	signal.signal(signal.SIGINT, job_worker.stop)
+	job_worker.run()
+	return 0
+
+
+# define our command for adding a library
+# Usage: python manage.py create_tenant -n central
+@manager.option('-n', '--name', dest='name', help='library name, lowercase letters, digits and _')
+def create_tenant(name):
+	"""Creates the schema and tables of a library, see app/tenants.py."""
+	from app import tenants
+
+	tenants.create_tenant(app, name)
+	print(f'created library {name}')
+
+
+# define our command for profiling a running worker
+# Usage: python manage.py profile -e api_get_all_books -n 100 -t $ADMIN_TOKEN
+@manager.option('-u', '--url', dest='url', default='http://127.0.0.1:5000', help='worker base url')
+@manager.option('-t', '--token', dest='token', default=os.getenv('ADMIN_TOKEN'), help='admin access token')
+@manager.option('-e', '--endpoint', dest='endpoint', help='endpoint to profile, e.g. api_get_all_books')
+@manager.option('-n', '--requests', dest='requests', type=int, default=None, help='requests to profile')
+@manager.option('-s', '--seconds', dest='seconds', type=float, default=None, help='seconds to profile for')
+@manager.option('-m', '--mode', dest='mode', default='cprofile', help='cprofile or sampling')
+def profile(url, token, endpoint, requests, seconds, mode):
+	"""Arms profiling on the worker that answers, output goes to its PROFILE_DIR."""
+	from urllib.request import Request, urlopen
+	from urllib.error import HTTPError
+
+	body = {'endpoint': endpoint, 'mode': mode}
+	if requests:
+		body['requests'] = requests
+	if seconds:
+		body['seconds'] = seconds
+
+	req = Request(
+		url.rstrip('/') + '/api/v2/admin/profile',
+		data=json.dumps(body).encode(),
+		headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'})
+	try:
+		with urlopen(req) as res:
+			print(res.read().decode())
+	except HTTPError as e:
+		print(e.read().decode())
+		return 1
+	return 0
+
+
 if __name__ == '__main__':
 	manager.run()
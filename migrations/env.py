@@ -10,7 +10,8 @@ config = context.config
 
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
-fileConfig(config.config_file_name)
+# the app's own loggers are set up by now and must keep working
+fileConfig(config.config_file_name, disable_existing_loggers=False)
 logger = logging.getLogger('alembic.env')
 
 # add your model's MetaData object here
@@ -18,10 +19,20 @@ logger = logging.getLogger('alembic.env')
 # from myapp import mymodel
 # target_metadata = mymodel.Base.metadata
 from flask import current_app
+from app.tenants import migrating_tenant
 config.set_main_option('sqlalchemy.url',
                        current_app.config.get('SQLALCHEMY_DATABASE_URI'))
 target_metadata = current_app.extensions['migrate'].db.metadata
 
+# `-x tenant=name` migrates that library's schema or database, whose own
+# alembic_version is kept in its schema, see app/tenants.py
+tenant = migrating_tenant()
+tenant_schema = None
+if tenant:
+    router = current_app.extensions['tenants']
+    config.set_main_option('sqlalchemy.url', router.url(tenant))
+    tenant_schema = router.schema(tenant)
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -41,7 +52,7 @@ def run_migrations_offline():
 
     """
     url = config.get_main_option("sqlalchemy.url")
-    context.configure(url=url)
+    context.configure(url=url, version_table_schema=tenant_schema)
 
     with context.begin_transaction():
         context.run_migrations()
@@ -67,12 +78,14 @@ def run_migrations_online():
 
     engine = engine_from_config(config.get_section(config.config_ini_section),
                                 prefix='sqlalchemy.',
-                                poolclass=pool.NullPool)
+                                poolclass=pool.NullPool,
+                                connect_args={'options': f'-c search_path={tenant_schema}'} if tenant_schema else {})
 
     connection = engine.connect()
     context.configure(connection=connection,
                       target_metadata=target_metadata,
                       process_revision_directives=process_revision_directives,
+                      version_table_schema=tenant_schema,
                       **current_app.extensions['migrate'].configure_args)
 
     try:
@@ -0,0 +1,8 @@
+"""helpers shared by the migrations in versions/"""
+from alembic import op
+
+
+def end_transaction():
+    # CONCURRENTLY can't run inside a transaction block, so end the one
+    # alembic opened; the following statements then run in autocommit
+    op.execute('COMMIT')
@@ -0,0 +1,31 @@
+"""align column types with the models
+
+Revision ID: 3b7c1f9e2d4a
+Revises: dd015e048f68
+Create Date: 2026-10-19 09:12:44.318207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b7c1f9e2d4a'
+down_revision = 'dd015e048f68'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # widening a varchar only updates the catalog, the table is not rewritten
+    op.alter_column('users', 'password_hash',
+                    existing_type=sa.String(length=100),
+                    type_=sa.String(),
+                    existing_nullable=False)
+
+
+def downgrade():
+    op.alter_column('users', 'password_hash',
+                    existing_type=sa.String(),
+                    type_=sa.String(length=100),
+                    existing_nullable=False)
@@ -0,0 +1,39 @@
+"""revoked token ids
+
+Revision ID: 4a8d2f6c0e39
+Revises: 9c2e7b4d1a68
+Create Date: 2026-10-19 20:31:09.774162
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.tenants import migrating_tenant
+
+
+# revision identifiers, used by Alembic.
+revision = '4a8d2f6c0e39'
+down_revision = '9c2e7b4d1a68'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # shared by every tenant, only in the default database, see app/tenants.py
+    if migrating_tenant():
+        return
+    op.create_table('revoked_tokens',
+    sa.Column('jti', sa.String(length=32), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.Column('revoked_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('jti')
+    )
+    op.create_index(op.f('ix_revoked_tokens_revoked_at'), 'revoked_tokens', ['revoked_at'], unique=False)
+
+
+def downgrade():
+    # shared by every tenant, only in the default database, see app/tenants.py
+    if migrating_tenant():
+        return
+    op.drop_index(op.f('ix_revoked_tokens_revoked_at'), table_name='revoked_tokens')
+    op.drop_table('revoked_tokens')
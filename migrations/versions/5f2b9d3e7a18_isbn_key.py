@@ -0,0 +1,91 @@
+"""integer isbn key for books
+
+Revision ID: 5f2b9d3e7a18
+Revises: c41d7a9b2e65
+Create Date: 2026-10-19 14:20:37.118204
+
+Every book gets isbn_key, the integer value of its ISBN-13, and its isbn is
+rewritten as that ISBN-13. Existing rows are backfilled in small batches,
+each committed on its own, then the unique index over live books moves from
+isbn to isbn_key. Rows whose isbn doesn't validate keep it and get no key,
+as do live books whose key another live book already took. Downgrading fails
+if one of those shares its isbn with a live book.
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.isbn import canonical, InvalidISBN
+from migrations.helpers import end_transaction
+
+
+# revision identifiers, used by Alembic.
+revision = '5f2b9d3e7a18'
+down_revision = 'c41d7a9b2e65'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+
+def backfill(connection):
+    """
+    :return: number of rows left without a key
+    """
+    taken = set()
+    unkeyed = 0
+    last_id = 0
+
+    while True:
+        rows = connection.execute(sa.text(
+            "SELECT id, isbn, deleted_at IS NULL AS live FROM bookslist "
+            "WHERE id > :last_id ORDER BY id LIMIT :batch_size"),
+            last_id=last_id, batch_size=BATCH_SIZE).fetchall()
+        if not rows:
+            return unkeyed
+        last_id = rows[-1].id
+
+        updates = []
+        for row in rows:
+            try:
+                isbn = canonical(row.isbn)
+            except InvalidISBN:
+                unkeyed += 1
+                continue
+
+            if row.live:
+                if isbn in taken:
+                    unkeyed += 1
+                    continue
+                taken.add(isbn)
+            updates.append({'row_id': row.id, 'isbn': isbn, 'isbn_key': int(isbn)})
+
+        if updates:
+            connection.execute(sa.text(
+                "UPDATE bookslist SET isbn = :isbn, isbn_key = :isbn_key WHERE id = :row_id"), updates)
+
+
+def upgrade():
+    # a nullable column without default only updates the catalog
+    op.add_column('bookslist', sa.Column('isbn_key', sa.BigInteger(), nullable=True))
+
+    end_transaction()
+    unkeyed = backfill(op.get_bind())
+    if unkeyed:
+        logger.warning('%d books have no isbn_key, their isbn is invalid or a duplicate', unkeyed)
+
+    op.create_index('ix_bookslist_isbn_key_live', 'bookslist', ['isbn_key'], unique=True,
+                    postgresql_where=sa.text('deleted_at IS NULL'), postgresql_concurrently=True)
+    op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_bookslist_isbn_live')
+
+
+def downgrade():
+    # isbns stay in their ISBN-13 form
+    end_transaction()
+    op.create_index('ix_bookslist_isbn_live', 'bookslist', ['isbn'], unique=True,
+                    postgresql_where=sa.text('deleted_at IS NULL'), postgresql_concurrently=True)
+    op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_bookslist_isbn_key_live')
+    op.drop_column('bookslist', 'isbn_key')
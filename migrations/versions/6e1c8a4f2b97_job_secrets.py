@@ -0,0 +1,38 @@
+"""job payloads kept out of the jobs table
+
+Revision ID: 6e1c8a4f2b97
+Revises: 7b3e9d1f5c42
+Create Date: 2026-10-19 22:14:51.208337
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from app.tenants import migrating_tenant
+
+
+# revision identifiers, used by Alembic.
+revision = '6e1c8a4f2b97'
+down_revision = '7b3e9d1f5c42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # shared by every tenant, only in the default database, see app/tenants.py
+    if migrating_tenant():
+        return
+    op.create_table('job_secrets',
+    sa.Column('job_id', sa.Integer(), nullable=False),
+    sa.Column('data', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.ForeignKeyConstraint(['job_id'], ['jobs.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('job_id')
+    )
+
+
+def downgrade():
+    # shared by every tenant, only in the default database, see app/tenants.py
+    if migrating_tenant():
+        return
+    op.drop_table('job_secrets')
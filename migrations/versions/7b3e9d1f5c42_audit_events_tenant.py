@@ -0,0 +1,38 @@
+"""index audit events by tenant
+
+Revision ID: 7b3e9d1f5c42
+Revises: 4a8d2f6c0e39
+Create Date: 2026-10-19 20:52:36.410957
+
+The index is built with CREATE INDEX CONCURRENTLY so logins keep being
+audited. If the build is interrupted, drop the INVALID index it leaves
+behind before running the upgrade again.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.tenants import migrating_tenant
+from migrations.helpers import end_transaction
+
+
+# revision identifiers, used by Alembic.
+revision = '7b3e9d1f5c42'
+down_revision = '4a8d2f6c0e39'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # shared by every tenant, only in the default database, see app/tenants.py
+    if migrating_tenant():
+        return
+    end_transaction()
+    op.create_index('ix_audit_events_tenant_id', 'audit_events', ['tenant', 'id'],
+                    unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    if migrating_tenant():
+        return
+    end_transaction()
+    op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_audit_events_tenant_id')
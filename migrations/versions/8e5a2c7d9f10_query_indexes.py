@@ -0,0 +1,36 @@
+"""index for date_modified
+
+Revision ID: 8e5a2c7d9f10
+Revises: 3b7c1f9e2d4a
+Create Date: 2026-10-19 09:20:03.771582
+
+Loginview's lookup by username and email gets no index of its own: the
+unique index on username alone already finds at most one row, and a
+(username, email) index would only cost writes.
+
+The index is built with CREATE INDEX CONCURRENTLY so the table stays
+writable. If the build is interrupted, drop the INVALID index it leaves
+behind before running the upgrade again.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.helpers import end_transaction
+
+
+# revision identifiers, used by Alembic.
+revision = '8e5a2c7d9f10'
+down_revision = '3b7c1f9e2d4a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    end_transaction()
+    op.create_index(op.f('ix_bookslist_date_modified'), 'bookslist', ['date_modified'],
+                    unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    end_transaction()
+    op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_bookslist_date_modified')
@@ -0,0 +1,65 @@
+"""normalize stored usernames
+
+Revision ID: 9c2e7b4d1a68
+Revises: d3f1a6c8e527
+Create Date: 2026-10-19 20:05:41.118530
+
+Usernames were stored lower cased with runs of spaces collapsed; Loginview
+now looks them up NFKC normalized and case folded (app/normalization.py),
+so e.g. 'straße' or a full-width name could no longer log in. Each stored
+username is rewritten in its normalized form, in small batches. A row whose
+normalized name another user already has, or that is longer than the
+column, keeps its name; Loginview falls back to the old formatting for
+those. Downgrading leaves the names as they are.
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.normalization import normalize
+
+
+# revision identifiers, used by Alembic.
+revision = '9c2e7b4d1a68'
+down_revision = 'd3f1a6c8e527'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+USERNAME_LENGTH = 50
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+
+def upgrade():
+    connection = op.get_bind()
+    kept = 0
+    last_id = 0
+
+    while True:
+        rows = connection.execute(sa.text(
+            "SELECT id, username FROM users WHERE id > :last_id ORDER BY id LIMIT :batch_size"),
+            last_id=last_id, batch_size=BATCH_SIZE).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        for row in rows:
+            username = normalize(row.username)
+            if username == row.username:
+                continue
+            # a user already named so keeps the name, else the first one renamed gets it
+            renamed = len(username) <= USERNAME_LENGTH and connection.execute(sa.text(
+                "UPDATE users SET username = :username WHERE id = :row_id "
+                "AND NOT EXISTS (SELECT 1 FROM users WHERE username = :username)"),
+                username=username, row_id=row.id).rowcount
+            if not renamed:
+                kept += 1
+
+    if kept:
+        logger.warning('%d usernames kept their old form, their normalized one is taken or too long', kept)
+
+
+def downgrade():
+    pass
@@ -0,0 +1,56 @@
+"""background job queue
+
+Revision ID: a7c3e1f5b902
+Revises: 5f2b9d3e7a18
+Create Date: 2026-10-19 15:41:09.530214
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from app.tenants import migrating_tenant
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e1f5b902'
+down_revision = '5f2b9d3e7a18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # shared by every tenant, only in the default database, see app/tenants.py
+    if migrating_tenant():
+        return
+    op.create_table('jobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=50), nullable=False),
+    sa.Column('payload', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('max_attempts', sa.Integer(), nullable=False),
+    sa.Column('result', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('worker', sa.String(length=100), nullable=True),
+    sa.Column('run_at', sa.DateTime(), nullable=False),
+    sa.Column('locked_until', sa.DateTime(), nullable=True),
+    sa.Column('date_created', sa.DateTime(), nullable=True),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    # the table is new and empty, no need to build these concurrently
+    op.create_index('ix_jobs_queued', 'jobs', ['run_at'], unique=False,
+                    postgresql_where=sa.text("status = 'queued'"))
+    op.create_index('ix_jobs_running', 'jobs', ['locked_until'], unique=False,
+                    postgresql_where=sa.text("status = 'running'"))
+
+
+def downgrade():
+    # shared by every tenant, only in the default database, see app/tenants.py
+    if migrating_tenant():
+        return
+    op.drop_index('ix_jobs_running', table_name='jobs')
+    op.drop_index('ix_jobs_queued', table_name='jobs')
+    op.drop_table('jobs')
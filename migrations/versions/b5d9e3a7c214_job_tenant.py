@@ -0,0 +1,32 @@
+"""tenant of each job
+
+Revision ID: b5d9e3a7c214
+Revises: e2b8d4f6a031
+Create Date: 2026-10-19 18:41:07.205913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.tenants import migrating_tenant
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5d9e3a7c214'
+down_revision = 'e2b8d4f6a031'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # shared by every tenant, only in the default database, see app/tenants.py
+    if migrating_tenant():
+        return
+    op.add_column('jobs', sa.Column('tenant', sa.String(length=40), nullable=True))
+
+
+def downgrade():
+    # shared by every tenant, only in the default database, see app/tenants.py
+    if migrating_tenant():
+        return
+    op.drop_column('jobs', 'tenant')
@@ -0,0 +1,53 @@
+"""soft delete and archive table for books
+
+Revision ID: c41d7a9b2e65
+Revises: 8e5a2c7d9f10
+Create Date: 2026-10-19 11:02:51.604117
+
+The isbn unique constraint is replaced by a unique index over live books,
+built CONCURRENTLY before the constraint is dropped so isbns stay unique
+throughout. Downgrading fails if a deleted book shares its isbn with
+another book.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.helpers import end_transaction
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41d7a9b2e65'
+down_revision = '8e5a2c7d9f10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # a nullable column without default only updates the catalog
+    op.add_column('bookslist', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.create_table('bookslist_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('title', sa.String(length=150), nullable=False),
+    sa.Column('isbn', sa.String(length=20), nullable=False),
+    sa.Column('date_created', sa.DateTime(), nullable=True),
+    sa.Column('date_modified', sa.DateTime(), nullable=True),
+    sa.Column('deleted_at', sa.DateTime(), nullable=False),
+    sa.Column('archived_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    end_transaction()
+    op.create_index('ix_bookslist_isbn_live', 'bookslist', ['isbn'], unique=True,
+                    postgresql_where=sa.text('deleted_at IS NULL'), postgresql_concurrently=True)
+    op.drop_constraint('bookslist_isbn_key', 'bookslist', type_='unique')
+    op.create_index('ix_bookslist_deleted_at', 'bookslist', ['deleted_at'], unique=False,
+                    postgresql_where=sa.text('deleted_at IS NOT NULL'), postgresql_concurrently=True)
+
+
+def downgrade():
+    end_transaction()
+    op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_bookslist_deleted_at')
+    op.create_unique_constraint('bookslist_isbn_key', 'bookslist', ['isbn'])
+    op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_bookslist_isbn_live')
+    op.drop_table('bookslist_archive')
+    op.drop_column('bookslist', 'deleted_at')
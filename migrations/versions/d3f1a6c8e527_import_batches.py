@@ -0,0 +1,30 @@
+"""applied batches of bulk imports
+
+Revision ID: d3f1a6c8e527
+Revises: b5d9e3a7c214
+Create Date: 2026-10-19 19:12:53.640218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3f1a6c8e527'
+down_revision = 'b5d9e3a7c214'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('import_batches',
+    sa.Column('id', sa.String(length=32), nullable=False),
+    sa.Column('result', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('date_created', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('import_batches')
@@ -0,0 +1,43 @@
+"""login audit events
+
+Revision ID: e2b8d4f6a031
+Revises: a7c3e1f5b902
+Create Date: 2026-10-19 17:02:44.861370
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.tenants import migrating_tenant
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b8d4f6a031'
+down_revision = 'a7c3e1f5b902'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # shared by every tenant, only in the default database, see app/tenants.py
+    if migrating_tenant():
+        return
+    op.create_table('audit_events',
+    sa.Column('id', sa.BigInteger(), nullable=False),
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('username', sa.String(length=50), nullable=True),
+    sa.Column('remote_addr', sa.String(length=45), nullable=True),
+    sa.Column('tenant', sa.String(length=40), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_audit_events_user_id'), 'audit_events', ['user_id'], unique=False)
+
+
+def downgrade():
+    # shared by every tenant, only in the default database, see app/tenants.py
+    if migrating_tenant():
+        return
+    op.drop_index(op.f('ix_audit_events_user_id'), table_name='audit_events')
+    op.drop_table('audit_events')
@@ -1,9 +1,11 @@
 import os
 
 from app import create_app
+from app.startup import warm_app
 
 config_name = os.getenv('APP_SETTINGS')  # config_name = "development"
-app = create_app(config_name)
+# warmed here so pre-forking servers hand every worker a ready app
+app = warm_app(create_app(config_name))
 
 if __name__ == '__main__':
 	app.run()
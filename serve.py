@@ -0,0 +1,40 @@
+"""
+production entry point: serves the app from pre-forked workers
+
+Usage: python serve.py --bind 0.0.0.0:8000 --workers 4 --threads 8
+"""
+import argparse
+import logging
+import os
+
+from app import create_app
+from app.prefork import Arbiter
+
+
+def main(argv=None):
+	app = create_app(config_name=os.getenv('APP_SETTINGS'))
+	config = app.config
+
+	parser = argparse.ArgumentParser(description='serve hello books with pre-forked workers')
+	parser.add_argument('--bind', default='127.0.0.1:5000', help='host:port to listen on')
+	parser.add_argument('--workers', type=int, default=config.get('WORKERS'),
+						help='worker processes, defaults to one per core')
+	parser.add_argument('--threads', type=int, default=config.get('THREADS', 1),
+						help='requests handled at once by each worker')
+	parser.add_argument('--max-requests', type=int, default=config.get('MAX_REQUESTS', 0),
+						help='restart a worker after this many requests, 0 disables')
+	parser.add_argument('--graceful-timeout', type=int, default=config.get('GRACEFUL_TIMEOUT', 30),
+						help='seconds workers get to finish requests on shutdown')
+	args = parser.parse_args(argv)
+
+	logging.basicConfig(level=logging.INFO, format='[%(process)d] %(levelname)s %(message)s')
+	host, port = args.bind.rsplit(':', 1)
+
+	Arbiter(
+		app, host=host, port=int(port), workers=args.workers, threads=args.threads,
+		max_requests=args.max_requests, graceful_timeout=args.graceful_timeout
+	).run()
+
+
+if __name__ == '__main__':
+	main()
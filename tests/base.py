@@ -0,0 +1,155 @@
+"""
+shared setup for tests that use the database
+
+The schema is created once per test run. A transactional test runs on one
+connection inside a transaction that is rolled back afterwards, and every
+session the app opens during the test works in a SAVEPOINT of it, so views
+can commit and roll back as usual. Tests whose writes must be seen by other
+connections (threads, background workers, forked processes) set
+`transactional = False`; their tables are truncated instead.
+"""
+import os
+import unittest
+from flask import g
+from sqlalchemy import create_engine, event, orm
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import OperationalError
+from flask_sqlalchemy import SignallingSession
+from app import create_app, db
+
+schema_ready = False
+
+
+class SavepointSession(SignallingSession):
+	"""a session that works in a SAVEPOINT of the connection it is bound to"""
+
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.closing = False
+		event.listen(self, 'after_transaction_end', self.restart_savepoint)
+		self.begin_nested()
+
+	def restart_savepoint(self, session, transaction):
+		# commit and rollback end the savepoint, the next work needs a new one
+		if transaction.nested and not transaction._parent.nested and not self.closing:
+			self.expire_all()
+			self.begin_nested()
+
+	def close(self):
+		# like a session that owns its connection, drop what wasn't committed
+		self.closing = True
+		if self.transaction is not None and self.transaction.nested:
+			self.rollback()
+		super().close()
+
+
+def ensure_database(url):
+	"""creates the database, e.g. a parallel worker's own, if it is missing"""
+	url = make_url(url)
+	engine = create_engine(url)
+	try:
+		engine.connect().close()
+		return
+	except OperationalError as e:
+		if 'does not exist' not in str(e):
+			raise
+	finally:
+		engine.dispose()
+
+	database = url.database
+	url.database = 'postgres'
+	server = create_engine(url, isolation_level='AUTOCOMMIT')
+	try:
+		server.execute(f'CREATE DATABASE "{database}"')
+	finally:
+		server.dispose()
+
+
+def redis_client():
+	"""
+	:return: a client of the Redis server at TEST_REDIS_URL, whose database
+	it empties, or None when there is none to test against
+	"""
+	url = os.getenv('TEST_REDIS_URL')
+	if not url:
+		return None
+
+	from app.backends import redis_from_url
+
+	client = redis_from_url(url)
+	client.flushdb()
+	return client
+
+
+def prepare_schema(app):
+	global schema_ready
+
+	if schema_ready:
+		return
+
+	ensure_database(app.config['SQLALCHEMY_DATABASE_URI'])
+	with app.app_context():
+		db.drop_all()
+		db.create_all()
+		db.session.remove()
+	schema_ready = True
+
+
+class DatabaseTestCase(unittest.TestCase):
+	"""a test case with a fresh app and empty tables"""
+
+	transactional = True
+
+	def create_app(self):
+		return create_app(config_name="testing")
+
+	def setUp(self):
+		self.app = self.create_app()
+		self.client = self.app.test_client
+		prepare_schema(self.app)
+
+		if self.transactional:
+			self.begin()
+
+	def tearDown(self):
+		if self.transactional:
+			self.rollback()
+		else:
+			self.truncate()
+
+		with self.app.app_context():
+			db.engine.dispose()
+
+	def provision(self, *users, tenant=None):
+		"""
+		creates users the way `manage.py provision` does; the only way to
+		make admins, public registration can't
+		"""
+		from app.auth.views import provision_users
+
+		with self.app.app_context():
+			if tenant is not None:
+				g.tenant = tenant
+			return provision_users(list(users))
+
+	def begin(self):
+		with self.app.app_context():
+			self.connection = db.engine.connect()
+		self.transaction = self.connection.begin()
+		self.app_session = db.session
+
+		factory = orm.sessionmaker(class_=SavepointSession, db=db, bind=self.connection, binds={}, query_cls=db.Query)
+		db.session = orm.scoped_session(factory, scopefunc=self.app_session.registry.scopefunc)
+
+	def rollback(self):
+		db.session.remove()
+		db.session = self.app_session
+		self.transaction.rollback()
+		self.connection.close()
+
+	def truncate(self):
+		with self.app.app_context():
+			db.session.remove()
+			tables = ', '.join(table.name for table in db.metadata.sorted_tables)
+			with db.engine.begin() as connection:
+				connection.execute(f'TRUNCATE {tables} RESTART IDENTITY CASCADE')
@@ -0,0 +1,68 @@
+import unittest
+from unittest import mock
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from app import db
+from app.archival import archive_deleted_books
+from app.isbn import check_digit_13
+from app.models import Booklist, ArchivedBook
+from tests.base import DatabaseTestCase
+
+
+class ArchivalTestCase(DatabaseTestCase):
+	"""test soft-deleted books are archived in batches"""
+
+	# batches are moved on connections of their own
+	transactional = False
+
+	def setUp(self):
+		super().setUp()
+
+		with self.app.app_context():
+			for i in range(5):
+				Booklist(title=f'book {i}', isbn=f'97800000000{i}' + check_digit_13(f'97800000000{i}')).save()
+
+	def test_archives_old_deleted_books_only(self):
+		with self.app.app_context():
+			books = Booklist.query.order_by(Booklist.id).all()
+			ids = [book.id for book in books]
+			for book in books[:4]:
+				book.delete()
+			# two of the deleted books are past the archival age
+			db.session.execute(
+				"UPDATE bookslist SET deleted_at = deleted_at - interval '40 days' WHERE id IN :ids",
+				{'ids': tuple(ids[:2])})
+			db.session.commit()
+
+			archived = archive_deleted_books(older_than_days=30, batch_size=1, pause=0)
+
+			self.assertEqual(archived, 2)
+			self.assertEqual(sorted(book.id for book in ArchivedBook.query.all()), ids[:2])
+			self.assertEqual(Booklist.query.count(), 3)
+			self.assertEqual(len(Booklist.get_all()), 1)
+			db.session.remove()
+
+	def test_lock_timeout_is_retried(self):
+		with self.app.app_context():
+			Booklist.query.first().delete()
+			db.session.execute("UPDATE bookslist SET deleted_at = deleted_at - interval '40 days'")
+			db.session.commit()
+
+			with db.engine.connect() as blocker:
+				transaction = blocker.begin()
+				blocker.execute('LOCK TABLE bookslist_archive IN ACCESS EXCLUSIVE MODE')
+				self.assertEqual(archive_deleted_books(batch_size=1, pause=0, lock_timeout_ms=10, max_batches=2), 0)
+				transaction.rollback()
+
+			self.assertEqual(archive_deleted_books(batch_size=1, pause=0), 1)
+			db.session.remove()
+
+	def test_other_errors_are_raised(self):
+		failing = text("SET LOCAL statement_timeout = 1; SELECT pg_sleep(1)")
+		with self.app.app_context(), mock.patch('app.archival.MOVE_BATCH', failing):
+			with self.assertRaises(OperationalError):
+				archive_deleted_books(pause=0, max_batches=2)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,173 @@
+import unittest
+import csv
+import io
+import json
+import time
+from app.audit import AuditLog
+from app.exports import export_users
+from app.models import AuditEvent
+from tests.base import DatabaseTestCase
+
+
+class AuditTestCase(DatabaseTestCase):
+	"""test the login audit trail and the admin listings"""
+
+	def setUp(self):
+		super().setUp()
+		self.audit = self.app.extensions['audit']
+		self.user_data = {
+			'username': 'tester',
+			'email': 'tester@mail.com',
+			'password': ',5Test_password'
+		}
+		self.is_admin = True
+
+	def post(self, url, body, token=None):
+		headers = {'Authorization': f'Bearer {token}'} if token else {}
+		return self.client().post(url, data=json.dumps(body), headers=headers, content_type='application/json')
+
+	def get(self, url, token):
+		res = self.client().get(url, headers={'Authorization': f'Bearer {token}'})
+		return res.status_code, json.loads(res.data.decode())
+
+	def login(self, **changes):
+		self.provision(dict(self.user_data, is_admin=self.is_admin))
+		user = dict(self.user_data, **changes)
+		return json.loads(self.post('/api/v2/auth/login', user).data.decode()).get('access_token')
+
+	def flush(self):
+		with self.app.app_context():
+			return self.audit.flush()
+
+	def test_logins_are_buffered_then_written(self):
+		self.post('/api/v2/auth/register', dict(self.user_data, username='reader', email='reader@mail.com'))
+		self.login(password='wrong')
+		self.login(username='nobody')
+		token = self.login()
+		self.post('/api/v2/auth/logout', {}, token=token)
+
+		# nothing is written on the request path
+		with self.app.app_context():
+			self.assertEqual(AuditEvent.query.count(), 0)
+		self.assertEqual(self.audit.describe()['buffered'], 5)
+		self.assertEqual(self.flush(), 5)
+
+		with self.app.app_context():
+			events = [(event.kind, event.username) for event in AuditEvent.query.order_by(AuditEvent.id)]
+		self.assertEqual(events, [
+			('register', 'reader'),
+			('login_failed', 'tester'),
+			('login_failed', 'nobody'),
+			('login', 'tester'),
+			('logout', None),
+		])
+		self.assertEqual(self.audit.describe()['written'], 5)
+
+	def test_audit_endpoint_pages_newest_first(self):
+		token = self.login()
+		for _ in range(3):
+			self.login(password='wrong')
+		self.flush()
+
+		status, page = self.get('/api/v2/admin/audit?limit=2&kind=login_failed', token)
+		self.assertEqual(status, 200)
+		self.assertEqual([event['kind'] for event in page['events']], ['login_failed'] * 2)
+		self.assertEqual(page['buffer']['buffered'], 0)
+
+		status, rest = self.get(f"/api/v2/admin/audit?limit=2&kind=login_failed&before={page['next']}", token)
+		self.assertEqual(len(rest['events']), 1)
+		self.assertIsNone(rest['next'])
+		self.assertGreater(page['events'][1]['id'], rest['events'][0]['id'])
+
+	def test_full_buffer_drops_oldest(self):
+		audit = AuditLog(self.app)
+		audit.capacity = 3
+		with self.app.test_request_context():
+			for number in range(5):
+				audit.record('login', number)
+
+		self.assertEqual([event[1] for event in audit.buffer], [2, 3, 4])
+		self.assertEqual(audit.describe()['dropped'], 2)
+
+		# an unwritten batch goes back in front, as far as there is room
+		audit.put_back([(None, 0), (None, 1)])
+		self.assertEqual(audit.describe()['dropped'], 4)
+		self.assertEqual(len(audit.buffer), 3)
+
+	def test_failed_write_keeps_events(self):
+		self.login()
+		self.login()
+		self.app.config['AUDIT_FLUSH_BATCH'] = 1
+		self.audit.buffer.append(('login', 'not an id', None, None, None, time.time()))
+		with self.assertLogs('hello_books.audit', level='ERROR'):
+			self.assertEqual(self.flush(), 2)
+		self.assertEqual(self.audit.describe()['buffered'], 1)
+
+	def test_disabled(self):
+		self.app.config['AUDIT_ENABLED'] = False
+		self.login()
+		self.assertEqual(self.audit.describe()['recorded'], 0)
+
+	def test_users_endpoint_pages(self):
+		token = self.login()
+		for number in range(4):
+			self.post('/api/v2/auth/register', dict(self.user_data, username=f'reader{number}',
+													 email=f'reader{number}@mail.com'))
+
+		status, page = self.get('/api/v2/admin/users?limit=3', token)
+		self.assertEqual(status, 200)
+		self.assertEqual([user['username'] for user in page['users']], ['tester', 'reader0', 'reader1'])
+		self.assertNotIn('password_hash', page['users'][0])
+
+		status, rest = self.get(f"/api/v2/admin/users?limit=3&after={page['next']}", token)
+		self.assertEqual([user['username'] for user in rest['users']], ['reader2', 'reader3'])
+		self.assertIsNone(rest['next'])
+
+	def test_listings_require_admin(self):
+		self.is_admin = False
+		token = self.login()
+		self.assertEqual(self.get('/api/v2/admin/users', token)[0], 403)
+		self.assertEqual(self.get('/api/v2/admin/audit', token)[0], 403)
+
+	def test_export_users(self):
+		self.login()
+		self.post('/api/v2/auth/register', dict(self.user_data, username='reader', email='reader@mail.com'))
+
+		with self.app.app_context():
+			out = io.StringIO()
+			self.assertEqual(export_users(out, batch_size=1), 2)
+			users = [json.loads(line) for line in out.getvalue().splitlines()]
+
+			out = io.StringIO()
+			export_users(out, fmt='csv')
+			rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+
+		self.assertEqual([user['username'] for user in users], ['tester', 'reader'])
+		self.assertEqual(sorted(users[0]), ['date_created', 'email', 'id', 'is_admin', 'username'])
+		self.assertEqual([row['email'] for row in rows], ['tester@mail.com', 'reader@mail.com'])
+
+
+class AuditWriterTestCase(DatabaseTestCase):
+	"""test the background writer"""
+
+	# the writer thread uses a connection of its own
+	transactional = False
+
+	def test_writer_thread_flushes_full_batches(self):
+		self.app.config.update(AUDIT_FLUSH_THREAD=True, AUDIT_FLUSH_BATCH=2, AUDIT_FLUSH_INTERVAL=30)
+		audit = self.app.extensions['audit']
+		with self.app.test_request_context():
+			audit.record('login', 1, 'reader')
+			audit.record('login', 2, 'writer')
+
+		deadline = time.time() + 5
+		while audit.describe()['written'] < 2 and time.time() < deadline:
+			time.sleep(0.01)
+		audit.close()
+
+		with self.app.app_context():
+			self.assertEqual(sorted(event.user_id for event in AuditEvent.query), [1, 2])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -1,29 +1,29 @@
 import unittest
 import json
+import threading
+import time
+import uuid
+from unittest import mock
 from app import create_app, db
+from app.jobs.queue import run_pending
+from app.auth.views import hash_passwords
+from app.models import APIUser, Job, JobSecret
+from app.revocation import MemoryRevocationSet, RedisRevocationStore, revoked_tokens
+from tests.base import DatabaseTestCase, redis_client
 
 
-class AuthTestCase(unittest.TestCase):
+class AuthTestCase(DatabaseTestCase):
 	"""test api authentication"""
 
 	def setUp(self):
-		self.app = create_app(config_name="testing")
-		# initialize the test client
-		self.client = self.app.test_client
+		super().setUp()
 		# This is the user test json data with a predefined email and password
 		self.user_data = {
 			'username': 'tester',
 			'email': 'tester@mail.com',
-			'password': ',5Test_password',
-			'is_admin': True
+			'password': ',5Test_password'
 		}
 
-		with self.app.app_context():
-			# create all tables
-			db.session.close()
-			db.drop_all()
-			db.create_all()
-
 	def test_registration(self):
 		"""test api can register user"""
 		res = self.client().post(
@@ -48,12 +48,24 @@ class AuthTestCase(unittest.TestCase):
 			'/api/v2/auth/register',
 			data=json.dumps(self.user_data),
 			content_type='application/json')
-		self.assertEqual(second_res.status_code, 202)
+		self.assertEqual(second_res.status_code, 409)
 		# get the results returned in json format
 		result = json.loads(second_res.data.decode())
 		self.assertEqual(
 			result['message'], "user already exists. Please login")
 
+	def test_registration_cant_make_admins(self):
+		"""test api refuses is_admin on public registration"""
+		res = self.client().post(
+			'/api/v2/auth/register',
+			data=json.dumps(dict(self.user_data, is_admin=True)),
+			content_type='application/json')
+		self.assertEqual(res.status_code, 401)
+		self.assertIn('is_admin', json.loads(res.data.decode())['error'])
+
+		with self.app.app_context():
+			self.assertEqual(APIUser.query.count(), 0)
+
 	def test_auth_no_json_error(self):
 		"""test api throws error if JSON not detected"""
 		user = {}
@@ -99,6 +111,43 @@ class AuthTestCase(unittest.TestCase):
 		self.assertEqual(login_res.status_code, 200)
 		self.assertTrue(result['access_token'])
 
+	def test_login_username_is_normalized(self):
+		"""test api logs in a user whatever the case and spacing of the username"""
+		self.user_data['username'] = 'The  Tester'
+		res = self.client().post(
+			'/api/v2/auth/register',
+			data=json.dumps(self.user_data),
+			content_type='application/json')
+		self.assertEqual(res.status_code, 201)
+
+		login_res = self.client().post(
+			'/api/v2/auth/login',
+			data=json.dumps({
+				'username': 'THE\tTESTER',
+				'email': 'tester@mail.com',
+				'password': ',5Test_password'
+			}),
+			content_type='application/json')
+		self.assertEqual(login_res.status_code, 200)
+
+	def test_login_finds_username_in_old_format(self):
+		"""test a user stored before normalization, whose name the migration left, can log in"""
+		self.provision(self.user_data)
+		with self.app.app_context():
+			# what the old formatting stored; normalized, it is 'strasse'
+			APIUser.query.filter_by(username='tester').update({'username': 'straße'})
+			db.session.commit()
+
+		login_res = self.client().post(
+			'/api/v2/auth/login',
+			data=json.dumps({
+				'username': 'Straße',
+				'email': 'tester@mail.com',
+				'password': ',5Test_password'
+			}),
+			content_type='application/json')
+		self.assertEqual(login_res.status_code, 200)
+
 	def test_auth_user_not_registered_cant_log_in(self):
 		"""test api can't login in non registered user"""
 
@@ -164,4 +213,270 @@ class AuthTestCase(unittest.TestCase):
 
 		result = json.loads(login_res.data.decode())
 		self.assertIn('error', str(result))
-		self.assertEqual(login_res.status_code, 401)
\ No newline at end of file
+		self.assertEqual(login_res.status_code, 401)
+
+	def login(self, is_admin=True):
+		self.provision(dict(self.user_data, is_admin=is_admin))
+		login_res = self.client().post(
+			'/api/v2/auth/login',
+			data=json.dumps({
+				'username': 'tester',
+				'email': 'tester@mail.com',
+				'password': ',5Test_password'
+			}),
+			content_type='application/json')
+		return json.loads(login_res.data.decode())
+
+	def test_refresh_token_renews_access_token(self):
+		"""test api exchanges a refresh token for new tokens"""
+		tokens = self.login()
+		self.assertTrue(tokens['refresh_token'])
+
+		res = self.client().post(
+			'/api/v2/auth/refresh',
+			data=json.dumps({'refresh_token': tokens['refresh_token']}),
+			content_type='application/json')
+		result = json.loads(res.data.decode())
+		self.assertEqual(res.status_code, 200)
+		self.assertTrue(result['access_token'])
+		self.assertNotEqual(result['refresh_token'], tokens['refresh_token'])
+
+		# refresh tokens are rotated, so the old one can't be used again
+		res = self.client().post(
+			'/api/v2/auth/refresh',
+			data=json.dumps({'refresh_token': tokens['refresh_token']}),
+			content_type='application/json')
+		self.assertEqual(res.status_code, 401)
+
+	def test_access_token_cant_refresh(self):
+		"""test api rejects an access token sent as refresh token"""
+		tokens = self.login()
+		res = self.client().post(
+			'/api/v2/auth/refresh',
+			data=json.dumps({'refresh_token': tokens['access_token']}),
+			content_type='application/json')
+		self.assertEqual(res.status_code, 401)
+
+	def test_logout_revokes_tokens(self):
+		"""test api logout revokes the access and refresh tokens"""
+		tokens = self.login()
+		res = self.client().post(
+			'/api/v2/auth/logout',
+			data=json.dumps({'refresh_token': tokens['refresh_token']}),
+			headers={'Authorization': f"Bearer {tokens['access_token']}"},
+			content_type='application/json')
+		self.assertEqual(res.status_code, 200)
+
+		res = self.client().post(
+			'/api/v2/auth/logout',
+			headers={'Authorization': f"Bearer {tokens['access_token']}"})
+		self.assertEqual(res.status_code, 401)
+		self.assertIn('Revoked token', str(res.data))
+
+		res = self.client().post(
+			'/api/v2/auth/refresh',
+			data=json.dumps({'refresh_token': tokens['refresh_token']}),
+			content_type='application/json')
+		self.assertEqual(res.status_code, 401)
+
+		# another worker process, with an app of its own, knows of the revocation
+		other_worker = create_app(config_name='testing')
+		res = other_worker.test_client().post(
+			'/api/v2/auth/logout',
+			headers={'Authorization': f"Bearer {tokens['access_token']}"})
+		self.assertEqual(res.status_code, 401)
+		self.assertIn('Revoked token', str(res.data))
+
+	def test_revocation_is_checked_in_process(self):
+		"""test token checks don't read the shared store more than once per sync interval"""
+		tokens = self.login()
+		headers = {'Authorization': f"Bearer {tokens['access_token']}"}
+		self.client().get('/api/v2/books', headers=headers)
+
+		with self.app.app_context():
+			store = revoked_tokens()
+		with mock.patch.object(store.store, 'revoked_since', wraps=store.store.revoked_since) as revoked_since:
+			for _ in range(20):
+				self.client().post('/api/v2/auth/refresh', data=json.dumps({'refresh_token': tokens['refresh_token']}),
+								   content_type='application/json')
+				self.client().get('/api/v2/books', headers=headers)
+			self.assertLessEqual(revoked_since.call_count, 1)
+
+	def test_revocations_of_other_workers_are_synced(self):
+		"""test a worker sees another one's revocations once it syncs"""
+		tokens = self.login()
+		with self.app.app_context():
+			# this worker has read the shared store before the other one revokes
+			self.assertNotIn(uuid.uuid4().hex, revoked_tokens())
+		other_worker = create_app(config_name='testing')
+		headers = {'Authorization': f"Bearer {tokens['access_token']}"}
+		res = other_worker.test_client().post('/api/v2/auth/logout', headers=headers)
+		self.assertEqual(res.status_code, 200)
+
+		# until this worker reads the shared store again, it still accepts the token
+		res = self.client().post('/api/v2/auth/logout', headers=headers)
+		self.assertEqual(res.status_code, 200)
+
+		with self.app.app_context():
+			revoked_tokens().synced_at -= self.app.config['REVOCATION_SYNC_SECONDS']
+		res = self.client().post('/api/v2/auth/logout', headers=headers)
+		self.assertEqual(res.status_code, 401)
+
+	def test_redis_revocation_store(self):
+		"""test revocations are read back from Redis since the last watermark"""
+		client = redis_client()
+		if client is None:
+			self.skipTest('TEST_REDIS_URL is not set')
+
+		store = RedisRevocationStore(client, overlap=0)
+		first, second, expired = (uuid.uuid4().hex for _ in range(3))
+		exp = int(time.time()) + 60
+		store.add(first, exp)
+		store.add(expired, time.time() - 1)
+		revoked, since = store.revoked_since(None)
+		self.assertEqual(revoked, [(first, exp)])
+
+		store.add(second, exp)
+		revoked, since = store.revoked_since(since)
+		self.assertEqual(revoked, [(second, exp)])
+
+	def test_memory_revocations_are_purged(self):
+		"""test expired ids are purged every `purge_every` adds, even when ids are added again"""
+		revoked = MemoryRevocationSet(purge_every=3)
+		jti = uuid.uuid4().hex
+		for _ in range(3):
+			revoked.add(jti, time.time() - 1)
+		self.assertEqual(len(revoked), 0)
+
+		revoked.add(jti, time.time() + 60)
+		self.assertIn(jti, revoked)
+
+	def test_refresh_needs_existing_user(self):
+		"""test a refresh token of a deleted user is refused"""
+		tokens = self.login()
+		with self.app.app_context():
+			APIUser.query.filter_by(username='tester').delete()
+			db.session.commit()
+
+		res = self.client().post(
+			'/api/v2/auth/refresh',
+			data=json.dumps({'refresh_token': tokens['refresh_token']}),
+			content_type='application/json')
+		self.assertEqual(res.status_code, 401)
+
+	def test_batch_registration(self):
+		"""test admins can create users in bulk"""
+		tokens = self.login()
+		users = [{
+			'username': f'reader{i}',
+			'email': f'reader{i}@mail.com',
+			'password': ',5Test_password'
+		} for i in range(5)]
+		users.append({'username': 'tester', 'email': 'tester@mail.com', 'password': ',5Test_password'})
+		users.append({'username': 'x'})
+
+		res = self.client().post(
+			'/api/v2/auth/users/batch',
+			data=json.dumps({'users': users}),
+			headers={'Authorization': f"Bearer {tokens['access_token']}"},
+			content_type='application/json')
+		self.assertEqual(res.status_code, 202)
+		job_url = res.headers['Location']
+
+		with self.app.app_context():
+			# the users and their passwords are only in the job's secret, deleted once it ran
+			self.assertEqual(Job.query.one().payload, {'count': 7})
+			self.assertEqual(run_pending(), 1)
+			self.assertEqual(JobSecret.query.count(), 0)
+
+		res = self.client().get(job_url, headers={'Authorization': f"Bearer {tokens['access_token']}"})
+		job = json.loads(res.data.decode())['job']
+		result = job['result']
+		self.assertEqual(job['status'], 'done')
+		self.assertEqual(sorted(result['created']), [f'reader{i}' for i in range(5)])
+		self.assertEqual(result['skipped'], ['tester'])
+		self.assertEqual(result['errors'][0]['index'], 6)
+
+	def test_provision_skips_taken_usernames_and_emails(self):
+		"""test users whose username or email is taken, in the database or earlier in the batch, are skipped"""
+		self.provision({'username': 'tester', 'email': 'tester@mail.com', 'password': ',5Test_password'})
+
+		def user(username, email):
+			return {'username': username, 'email': email, 'password': ',5Test_password'}
+
+		result = self.provision(
+			user('reader', 'reader@mail.com'),
+			# the same username as the user before, with another email
+			user('reader', 'other@mail.com'),
+			# a new username with an email already taken
+			user('writer', 'tester@mail.com'),
+			user('editor', 'reader@mail.com'),
+			user('reader', 'reader@mail.com'),
+			user('other', 'other@mail.com'))
+		self.assertEqual(result['created'], ['reader', 'other'])
+		self.assertEqual(result['skipped'], ['reader', 'writer', 'editor', 'reader'])
+
+	def test_batch_registration_hashes_off_the_request(self):
+		"""test passwords are hashed by the job, not while the admin waits"""
+		tokens = self.login()
+		users = [{'username': f'reader{i}', 'email': f'reader{i}@mail.com', 'password': ',5Test_password'}
+				 for i in range(3)]
+
+		with mock.patch('app.auth.views.hash_passwords', wraps=hash_passwords) as hashing:
+			res = self.client().post(
+				'/api/v2/auth/users/batch',
+				data=json.dumps({'users': users}),
+				headers={'Authorization': f"Bearer {tokens['access_token']}"},
+				content_type='application/json')
+			self.assertEqual(res.status_code, 202)
+			hashing.assert_not_called()
+
+			with self.app.app_context():
+				self.assertEqual(run_pending(), 1)
+			self.assertEqual(hashing.call_count, 1)
+
+	def test_batch_registration_requires_admin(self):
+		"""test non admins can't create users in bulk"""
+		tokens = self.login(is_admin=False)
+		res = self.client().post(
+			'/api/v2/auth/users/batch',
+			data=json.dumps({'users': []}),
+			headers={'Authorization': f"Bearer {tokens['access_token']}"},
+			content_type='application/json')
+		self.assertEqual(res.status_code, 403)
+
+
+class ConcurrentAuthTestCase(DatabaseTestCase):
+	"""test api authentication under concurrent requests"""
+
+	# every request thread uses its own connection
+	transactional = False
+
+	def setUp(self):
+		super().setUp()
+		self.user_data = {
+			'username': 'tester',
+			'email': 'tester@mail.com',
+			'password': ',5Test_password'
+		}
+
+	def test_concurrent_registrations_create_one_user(self):
+		"""test api creates a user once when sign-ups race"""
+		statuses = []
+		barrier = threading.Barrier(8)
+
+		def register():
+			barrier.wait()
+			res = self.client().post(
+				'/api/v2/auth/register',
+				data=json.dumps(self.user_data),
+				content_type='application/json')
+			statuses.append(res.status_code)
+
+		threads = [threading.Thread(target=register) for _ in range(8)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+		self.assertEqual(sorted(statuses), [201] + [409] * 7)
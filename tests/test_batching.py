@@ -0,0 +1,128 @@
+import unittest
+import json
+import threading
+import time
+from unittest import mock
+from app.batching import DuplicateISBN, PendingWrite
+from app.isbn import check_digit_13
+from tests.base import DatabaseTestCase
+
+
+class GroupCommitTestCase(DatabaseTestCase):
+	"""test group commit of book writes"""
+
+	# the flusher thread writes on its own connection
+	transactional = False
+
+	def setUp(self):
+		super().setUp()
+		self.app.config['GROUP_COMMIT_ENABLED'] = True
+		self.committer = self.app.extensions['group_commit']
+		# wide enough for every write of a test to share a batch
+		self.committer.max_wait = 0.05
+
+	def tearDown(self):
+		self.committer.stop()
+		super().tearDown()
+
+	def run_concurrently(self, calls):
+		results = [None] * len(calls)
+		barrier = threading.Barrier(len(calls))
+
+		def run(index, call):
+			barrier.wait()
+			try:
+				results[index] = call()
+			except Exception as e:
+				results[index] = e
+
+		threads = [threading.Thread(target=run, args=item) for item in enumerate(calls)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		return results
+
+	def test_concurrent_creates_share_a_transaction(self):
+		"""test concurrent creates get their own ids and duplicate errors"""
+		isbns = [f'9780000000{i:02d}' + check_digit_13(f'9780000000{i:02d}') for i in range(10)]
+		isbns.append(isbns[0])
+		results = self.run_concurrently([
+			lambda isbn=isbn: self.committer.create(f'book {isbn}', isbn) for isbn in isbns
+		])
+
+		books = [result for result in results if isinstance(result, dict)]
+		duplicates = [result for result in results if isinstance(result, DuplicateISBN)]
+		self.assertEqual(len(books), 10)
+		self.assertEqual(len(duplicates), 1)
+		self.assertEqual(len(set(book['id'] for book in books)), 10)
+		for book in books:
+			self.assertEqual(book['title'], f"book {book['isbn']}")
+		self.assertLess(self.committer.batches, 11)
+
+	def test_updates_last_write_wins(self):
+		book = self.committer.create('original', '9780306406157')
+		self.assertEqual(self.committer.update(book['id'], 'renamed')['title'], 'renamed')
+		self.assertIsNone(self.committer.update(book['id'] + 1, 'missing'))
+
+	def test_timeout_is_503(self):
+		book = self.committer.create('original', '9780306406157')
+		self.committer.timeout = 0.05
+		commit = self.committer.commit
+
+		def slow_commit(engine, batch):
+			time.sleep(0.2)
+			commit(engine, batch)
+
+		self.committer.commit = slow_commit
+		res = self.client().post('/api/v2/books', data=json.dumps({'title': 'Slow', 'isbn': '0198526636'}),
+								 content_type='application/json')
+		self.assertEqual((res.status_code, res.headers['Retry-After']), (503, '1'))
+
+		res = self.client().put(f"/api/v2/books/{book['id']}", data=json.dumps({'title': 'slower'}),
+								content_type='application/json')
+		self.assertEqual((res.status_code, res.headers['Retry-After']), (503, '1'))
+
+	def test_dead_flusher_fails_its_writes_and_keeps_the_queue(self):
+		class Crash(BaseException):
+			pass
+
+		def crash(batch):
+			raise Crash()
+
+		self.committer.commit_batch = crash
+		# the thread's traceback is expected
+		with mock.patch.object(threading, 'excepthook', lambda args: None):
+			with self.assertRaises(Crash):
+				self.committer.create('crashed', '9780306406157')
+			self.committer.thread.join()
+
+		# queued while no thread runs, taken over by the next one
+		del self.committer.commit_batch
+		waiting = PendingWrite('create', {'title': 'waiting', 'isbn': '9780198526636', 'isbn_key': 9780198526636})
+		self.committer.queue.put(waiting)
+		self.assertEqual(self.committer.create('next', '9780306406157')['title'], 'next')
+		self.assertTrue(waiting.done.wait(1))
+		self.assertEqual(waiting.result['title'], 'waiting')
+
+	def test_routes_use_group_commit(self):
+		"""test the book routes answer the same with group commit enabled"""
+		res = self.client().post('/api/v2/books', data=json.dumps({'title': 'Grouped', 'isbn': '0306406152'}),
+								 content_type='application/json')
+		self.assertEqual(res.status_code, 201)
+		book = json.loads(res.data.decode())['book_created']
+		self.assertEqual(book['title'], 'grouped')
+
+		res = self.client().post('/api/v2/books', data=json.dumps({'title': 'Grouped', 'isbn': '0306406152'}),
+								 content_type='application/json')
+		self.assertIn('already exists', str(res.data))
+
+		res = self.client().put(f"/api/v2/books/{book['id']}", data=json.dumps({'title': 'regrouped'}),
+								content_type='application/json')
+		self.assertEqual(res.status_code, 201)
+		self.assertIn('regrouped', str(res.data))
+		self.assertIn('regrouped', str(self.client().get(f"/api/v2/books/{book['id']}").data))
+
+
+if __name__ == "__main__":
+	unittest.main()
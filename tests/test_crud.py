@@ -1,27 +1,15 @@
 import unittest
 import os
 import json
-from app import create_app, db
 from flask_testing import TestCase
+from tests.base import DatabaseTestCase
 
 
-class BooklistTestCase(unittest.TestCase):
+class BooklistTestCase(DatabaseTestCase):
 
 	def setUp(self):
-		self.app = create_app(config_name="testing")
-		self.client = self.app.test_client
-		self.bookslist = {"title": 'Hello Books', "isbn": "0036593325"}
-
-		with self.app.app_context():
-			# create all tables
-			db.create_all()
-
-	def tearDown(self):
-		"""teardown all initialized variables."""
-		with self.app.app_context():
-			# drop all tables
-			db.session.remove()
-			db.drop_all()
+		super().setUp()
+		self.bookslist = {"title": 'Hello Books', "isbn": "003659332X"}
 
 	def test_api_booklist_creation(self):
 		"""test api can POST a book"""
@@ -57,7 +45,7 @@ class BooklistTestCase(unittest.TestCase):
 		self.assertIn('error', str(res.data))
 
 	def test_create_book_isbn_error(self):
-		"""test API can't create book if ISBN length is not 10 digits"""
+		"""test API can't create book if ISBN is not 10 or 13 digits"""
 		book = {
 			'title': "bool",
 			"isbn": "56951478"
@@ -68,7 +56,7 @@ class BooklistTestCase(unittest.TestCase):
 			content_type='application/json'
 		)
 		self.assertEqual(res.status_code, 400)
-		self.assertIn('isbn length must be 10', str(res.data))
+		self.assertIn('isbn must have 10 or 13 digits', str(res.data))
 
 	def test_create_book_isbn_must_be_nubers(self):
 		"""test API can't create book if ISBN are only numbers"""
@@ -84,16 +72,37 @@ class BooklistTestCase(unittest.TestCase):
 		self.assertEqual(res.status_code, 400)
 		self.assertIn('isbn must only include numbers', str(res.data))
 
+	def test_create_book_isbn_check_digit_error(self):
+		"""test API can't create book if the ISBN check digit is wrong"""
+		res = self.client().post(
+			'/api/v2/books',
+			data=json.dumps({'title': "bool", "isbn": "0306406153"}),
+			content_type='application/json'
+		)
+		self.assertEqual(res.status_code, 400)
+		self.assertIn('isbn check digit is wrong', str(res.data))
+
+	def test_create_book_stores_isbn_13(self):
+		"""test API stores ISBN-10s and hyphenated ISBNs as plain ISBN-13"""
+		res = self.client().post(
+			'/api/v2/books',
+			data=json.dumps({'title': "bool", "isbn": "0-306-40615-2"}),
+			content_type='application/json'
+		)
+		self.assertEqual(res.status_code, 201)
+		self.assertEqual(json.loads(res.data.decode())['book_created']['isbn'], '9780306406157')
+
 	def test_create_book_isbn_exists(self):
 		"""test API can't create book if ISBN are only numbers"""
 		book = {
 			'title': "bool",
-			"isbn": "5698874586"
+			"isbn": "5698874581"
 		}
 
+		# the same book by its ISBN-13
 		book2 = {
 			'title': "bool",
-			"isbn": "5698874586"
+			"isbn": "978-5-698-87458-4"
 		}
 
 		res = self.client().post(
@@ -134,13 +143,14 @@ class BooklistTestCase(unittest.TestCase):
 
 	def test_api_no_json(self):
 		"""test api detects no JSON """
-		book = {'title': 'Armin vaan Buuren', 'isbn': '6255415789'}
+		book = {'title': 'Armin vaan Buuren', 'isbn': '6255415783'}
 		res = self.client().post('/api/v2/books', data=json.dumps(book), content_type='application/json')
 		self.assertEqual(res.status_code, 201)
 		self.assertIn('armin', str(res.data))
+		book_id = json.loads(res.data.decode())['book_created']['id']
 		book = {}
 		res = self.client().put(
-			'/api/v2/books/1',
+			f'/api/v2/books/{book_id}',
 			data=json.dumps(book),
 			content_type='application/json')
 		self.assertEqual(res.status_code, 400)
@@ -155,42 +165,60 @@ class BooklistTestCase(unittest.TestCase):
 
 	def test_api_book_can_be_edited(self):
 		"""test api PUT book updates book"""
-		book = {'title': 'Armin vaan Buuren', 'isbn': '6255415789'}
+		book = {'title': 'Armin vaan Buuren', 'isbn': '6255415783'}
 		res = self.client().post('/api/v2/books', data=json.dumps(book), content_type='application/json')
 		self.assertEqual(res.status_code, 201)
 		self.assertIn('armin', str(res.data))
+		book_id = json.loads(res.data.decode())['book_created']['id']
 		res = self.client().put(
-			'/api/v2/books/1',
+			f'/api/v2/books/{book_id}',
 			data=json.dumps({'title': "from the grave"}),
 			content_type='application/json')
-		result = self.client().get('/api/v2/books/1')
+		result = self.client().get(f'/api/v2/books/{book_id}')
 		self.assertIn('from the grave', str(result.data))
 
 	def test_api_update_book_validation_error(self):
 		"""test api throws a validation error for the schema"""
-		book = {'title': 'Armin vaan Buuren', 'isbn': '6255415789'}
+		book = {'title': 'Armin vaan Buuren', 'isbn': '6255415783'}
 		res = self.client().post('/api/v2/books', data=json.dumps(book), content_type='application/json')
 		self.assertEqual(res.status_code, 201)
 		self.assertIn('armin', str(res.data))
+		book_id = json.loads(res.data.decode())['book_created']['id']
 		res = self.client().put(
-			'/api/v2/books/1',
+			f'/api/v2/books/{book_id}',
 			data=json.dumps({'title': "from the grave", "ola": "kilo"}),
 			content_type='application/json')
 		self.assertIn('unknown field', str(res.data))
 
 	def test_api_book_delete(self):
 		"""test api DELETE removes book"""
-		book = {'title': 'Armin vaan Buuren', 'isbn': '6255415789'}
+		book = {'title': 'Armin vaan Buuren', 'isbn': '6255415783'}
 		res = self.client().post('/api/v2/books', data=json.dumps(book), content_type='application/json')
 		self.assertEqual(res.status_code, 201)
 		self.assertIn('armin', str(res.data))
-		rv = self.client().delete('/api/v2/books/1')
+		book_id = json.loads(res.data.decode())['book_created']['id']
+		rv = self.client().delete(f'/api/v2/books/{book_id}')
 		self.assertEqual(rv.status_code, 200)
 
 		# Test book search returns 404
-		result = self.client().get('/api/v2/books/1')
+		result = self.client().get(f'/api/v2/books/{book_id}')
 		self.assertEqual(result.status_code, 404)
 
+	def test_api_deleted_book_isbn_can_be_reused(self):
+		"""test api DELETE keeps the row but frees its ISBN"""
+		book = {'title': 'Armin vaan Buuren', 'isbn': '6255415783'}
+		res = self.client().post('/api/v2/books', data=json.dumps(book), content_type='application/json')
+		book_id = json.loads(res.data.decode())['book_created']['id']
+		self.client().delete(f'/api/v2/books/{book_id}')
+
+		self.assertNotIn('armin', str(self.client().get('/api/v2/books').data))
+		res = self.client().post('/api/v2/books', data=json.dumps(book), content_type='application/json')
+		self.assertEqual(res.status_code, 201)
+
+		with self.app.app_context():
+			from app.models import Booklist
+			self.assertIsNotNone(Booklist.query.get(book_id).deleted_at)
+
 	def test_delete_book_not_found(self):
 		"""test api returns no book found"""
 		rv = self.client().delete('/api/v2/books/1')
@@ -0,0 +1,115 @@
+import unittest
+import json
+import threading
+from app import create_app, db
+from app.health.views import migration_heads, migrations_directory
+from tests.base import DatabaseTestCase
+
+
+class HealthTestCase(DatabaseTestCase):
+	"""test the load balancer probes and warm-up"""
+
+	# warm-up runs in its own thread
+	transactional = False
+
+	def get(self, url):
+		res = self.client().get(url)
+		return res.status_code, json.loads(res.data.decode())
+
+	def wait_for_warmup(self):
+		warmup = self.app.extensions['warmup']
+		warmup.start()
+		self.assertTrue(warmup.done.wait(5))
+
+	def test_healthz(self):
+		self.assertEqual(self.get('/healthz'), (200, {'status': 'ok'}))
+
+	def test_healthz_without_database(self):
+		app = create_app(config_name="testing")
+		app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql://localhost:1/unreachable'
+		app.config['WARMUP_ENABLED'] = False
+		self.assertEqual(app.test_client().get('/healthz').status_code, 200)
+
+		res = app.test_client().get('/readyz')
+		result = json.loads(res.data.decode())
+		self.assertEqual(res.status_code, 503)
+		self.assertEqual(result['checks']['database']['status'], 'failed')
+
+	def test_readyz_waits_for_warmup(self):
+		self.client().post('/api/v2/books', data=json.dumps({'title': 'hot', 'isbn': '0306406152'}),
+						   content_type='application/json')
+		self.wait_for_warmup()
+
+		status, result = self.get('/readyz')
+		self.assertEqual(status, 200)
+		self.assertEqual(result['status'], 'ready')
+		self.assertEqual(result['checks']['database']['status'], 'ok')
+		self.assertEqual(result['checks']['warmup']['steps']['connection_pool']['status'], 'ok')
+		self.assertEqual(result['checks']['warmup']['steps']['hot_books']['status'], 'ok')
+
+	def test_readyz_pending_warmup(self):
+		warmup = self.app.extensions['warmup']
+		release = threading.Event()
+		warmup.register('slow', lambda app: release.wait(5))
+		try:
+			status, result = self.get('/readyz')
+			self.assertEqual(status, 503)
+			self.assertEqual(result['checks']['warmup']['status'], 'pending')
+		finally:
+			release.set()
+		self.assertTrue(warmup.done.wait(5))
+		self.assertEqual(self.get('/readyz')[0], 200)
+
+	def test_failed_warmup_step_is_reported(self):
+		def broken(app):
+			raise RuntimeError('cache unavailable')
+
+		self.app.extensions['warmup'].register('broken', broken)
+		with self.assertLogs('hello_books.warmup', level='ERROR'):
+			self.wait_for_warmup()
+
+		# a cold worker can still serve, it is reported ready
+		status, result = self.get('/readyz')
+		step = result['checks']['warmup']['steps']['broken']
+		self.assertEqual(status, 200)
+		self.assertEqual((step['status'], step['error']), ('failed', 'cache unavailable'))
+
+	def test_readyz_checks_migrations(self):
+		self.app.config['HEALTH_CHECK_MIGRATIONS'] = True
+		self.wait_for_warmup()
+
+		# the test tables are made without alembic
+		status, result = self.get('/readyz')
+		self.assertEqual(status, 503)
+		self.assertEqual(result['checks']['migrations']['status'], 'failed')
+
+		with self.app.app_context():
+			heads = migration_heads(migrations_directory(self.app))
+			with db.engine.begin() as connection:
+				connection.execute('CREATE TABLE alembic_version (version_num varchar(32) PRIMARY KEY)')
+				for head in heads:
+					connection.execute('INSERT INTO alembic_version VALUES (%s)', head)
+		try:
+			status, result = self.get('/readyz')
+			self.assertEqual(status, 200)
+			self.assertEqual(result['checks']['migrations']['current'], sorted(heads))
+		finally:
+			with self.app.app_context():
+				db.engine.execute('DROP TABLE alembic_version')
+
+	def test_probes_skip_concurrency_cap(self):
+		self.app.config['RATELIMIT_ENABLED'] = True
+		self.app.config['MAX_CONCURRENT_REQUESTS'] = 1
+		limiter = self.app.extensions['ratelimit']
+
+		with self.app.app_context():
+			self.assertTrue(limiter.slots.acquire(blocking=False))
+		try:
+			self.assertEqual(self.client().get('/api/v2/books').status_code, 503)
+			self.assertEqual(self.client().get('/healthz').status_code, 200)
+		finally:
+			limiter.slots.release()
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+from app.isbn import canonical, isbn_key, from_key, validate_many, check_digit_10, InvalidISBN
+
+
+class ISBNTestCase(unittest.TestCase):
+	"""test isbn canonicalization and check digits"""
+
+	valid = {
+		'0306406152': '9780306406157',
+		'0-306-40615-2': '9780306406157',
+		'9780306406157': '9780306406157',
+		'978-0-306-40615-7': '9780306406157',
+		'080442957X': '9780804429573',
+		'080442957x': '9780804429573',
+		'979-10-90636-07-1': '9791090636071',
+	}
+	invalid = {
+		'0306406153': 'isbn check digit is wrong',
+		'9780306406158': 'isbn check digit is wrong',
+		'56951478': 'isbn must have 10 or 13 digits',
+		'845623369r': 'isbn must only include numbers',
+		'97803064061X7': 'isbn must only include numbers',
+		'X306406152': 'isbn must only include numbers',
+		# EAN-13s with a valid check digit that aren't books
+		'0000000000000': 'isbn-13 must start with 978 or 979',
+		'5901234123457': 'isbn-13 must start with 978 or 979',
+		'9770306406158': 'isbn-13 must start with 978 or 979',
+		'': 'isbn must have 10 or 13 digits',
+	}
+
+	def test_canonical(self):
+		for isbn, expected in self.valid.items():
+			self.assertEqual(canonical(isbn), expected, isbn)
+			self.assertEqual(from_key(isbn_key(isbn)), expected, isbn)
+
+	def test_invalid(self):
+		for isbn, error in self.invalid.items():
+			with self.assertRaises(InvalidISBN, msg=isbn) as raised:
+				canonical(isbn)
+			self.assertEqual(str(raised.exception), error)
+
+	def test_check_digit_10(self):
+		self.assertEqual(check_digit_10('030640615'), '2')
+		self.assertEqual(check_digit_10('080442957'), 'X')
+
+	def test_validate_many_matches_canonical(self):
+		isbns = list(self.valid) + list(self.invalid) + [None, '978030640615٧', '0306406152-extra']
+		keys, valid = validate_many(isbns)
+
+		for isbn, key, ok in zip(isbns, keys.tolist(), valid.tolist()):
+			try:
+				expected = isbn_key(isbn)
+			except InvalidISBN:
+				expected = 0
+			self.assertEqual((key, ok), (expected, expected != 0), isbn)
+
+	def test_validate_many_empty(self):
+		keys, valid = validate_many([])
+		self.assertEqual((len(keys), len(valid)), (0, 0))
+
+
+if __name__ == "__main__":
+	unittest.main()
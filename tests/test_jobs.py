@@ -0,0 +1,284 @@
+import unittest
+import json
+import threading
+import time
+from app import db
+from app.jobs.queue import HANDLERS, enqueue, run_one, run_pending
+from app.models import Booklist, Job, JobSecret
+from tests.base import DatabaseTestCase
+
+
+class JobTestCase(DatabaseTestCase):
+	"""test the background job queue"""
+
+	def setUp(self):
+		super().setUp()
+		self.calls = []
+		self.failures = 0
+		HANDLERS['test_echo'] = self.echo
+		self.user_data = {
+			'username': 'tester',
+			'email': 'tester@mail.com',
+			'password': ',5Test_password',
+			'is_admin': True
+		}
+
+	def tearDown(self):
+		del HANDLERS['test_echo']
+		super().tearDown()
+
+	def echo(self, payload):
+		self.calls.append(payload)
+		if self.failures:
+			self.failures -= 1
+			raise RuntimeError('temporary failure')
+		return {'echo': payload}
+
+	def token(self):
+		self.provision(self.user_data)
+		user = dict(self.user_data)
+		del user['is_admin']
+		res = self.client().post('/api/v2/auth/login', data=json.dumps(user),
+								 content_type='application/json')
+		return json.loads(res.data.decode())['access_token']
+
+	def post(self, url, body, token):
+		return self.client().post(url, data=json.dumps(body), headers={'Authorization': f'Bearer {token}'},
+								  content_type='application/json')
+
+	def get_job(self, url, token):
+		res = self.client().get(url, headers={'Authorization': f'Bearer {token}'})
+		return res.status_code, json.loads(res.data.decode()).get('job')
+
+	def test_runs_queued_job(self):
+		with self.app.app_context():
+			job = enqueue('test_echo', {'n': 1})
+			self.assertEqual(job.status, 'queued')
+			self.assertTrue(run_one())
+			self.assertFalse(run_one())
+
+			job = Job.query.get(job.id)
+			self.assertEqual((job.status, job.attempts), ('done', 1))
+			self.assertEqual(job.result, {'echo': {'n': 1}})
+			self.assertIsNotNone(job.finished_at)
+		self.assertEqual(self.calls, [{'n': 1}])
+
+	def test_unknown_kind_is_refused(self):
+		with self.app.app_context():
+			with self.assertRaises(LookupError):
+				enqueue('no_such_kind', {})
+
+	def test_failed_job_is_retried_later(self):
+		self.failures = 1
+		with self.app.app_context():
+			job_id = enqueue('test_echo', {}).id
+			with self.assertLogs('hello_books.jobs', level='ERROR'):
+				self.assertTrue(run_one())
+
+			job = Job.query.get(job_id)
+			self.assertEqual((job.status, job.attempts), ('queued', 1))
+			self.assertEqual(job.error, 'RuntimeError: temporary failure')
+			# backing off, not due yet
+			self.assertEqual(run_pending(), 0)
+
+			db.session.execute("UPDATE jobs SET run_at = run_at - interval '1 hour'")
+			self.assertEqual(run_pending(), 1)
+			job = Job.query.get(job_id)
+			self.assertEqual((job.status, job.attempts, job.error), ('done', 2, None))
+
+	def test_job_fails_after_max_attempts(self):
+		self.failures = 3
+		with self.app.app_context():
+			job_id = enqueue('test_echo', {}).id
+			with self.assertLogs('hello_books.jobs', level='ERROR'):
+				for _ in range(3):
+					db.session.execute("UPDATE jobs SET run_at = run_at - interval '1 hour'")
+					self.assertTrue(run_one())
+
+			job = Job.query.get(job_id)
+			self.assertEqual((job.status, job.attempts), ('failed', 3))
+			self.assertFalse(run_one())
+
+	def test_expired_lease_is_taken_over(self):
+		with self.app.app_context():
+			job_id = enqueue('test_echo', {}).id
+			# a worker claimed the job and died
+			db.session.execute(
+				"UPDATE jobs SET status = 'running', attempts = 1, locked_until = now() - interval '1 second'")
+			self.assertEqual(run_pending(), 1)
+			self.assertEqual(Job.query.get(job_id).status, 'done')
+
+	def test_expired_last_attempt_is_failed(self):
+		with self.app.app_context():
+			job_id = enqueue('test_echo', {}).id
+			# a worker died on the job's last attempt
+			db.session.execute(
+				"UPDATE jobs SET status = 'running', attempts = 3, locked_until = now() - interval '1 second'")
+			self.assertEqual(run_pending(), 0)
+			job = Job.query.get(job_id)
+			self.assertEqual((job.status, job.attempts, job.error), ('failed', 3, 'lease ran out on the last attempt'))
+		self.assertEqual(self.calls, [])
+
+	def test_secret_is_kept_for_retries_then_deleted(self):
+		self.failures = 1
+		with self.app.app_context():
+			job_id = enqueue('test_echo', {'n': 1}, secret={'password': 'hunter2'}).id
+			self.assertEqual(Job.query.get(job_id).payload, {'n': 1})
+
+			with self.assertLogs('hello_books.jobs', level='ERROR'):
+				self.assertTrue(run_one())
+			self.assertEqual(JobSecret.query.get(job_id).data, {'password': 'hunter2'})
+
+			db.session.execute("UPDATE jobs SET run_at = run_at - interval '1 hour'")
+			self.assertTrue(run_one())
+			self.assertIsNone(JobSecret.query.get(job_id))
+		self.assertEqual(self.calls, [{'n': 1, 'password': 'hunter2'}] * 2)
+
+	def test_secret_of_expired_job_is_deleted(self):
+		with self.app.app_context():
+			job_id = enqueue('test_echo', {}, secret={'password': 'hunter2'}).id
+			db.session.execute(
+				"UPDATE jobs SET status = 'running', attempts = 3, locked_until = now() - interval '1 second'")
+			self.assertEqual(run_pending(), 0)
+			self.assertIsNone(JobSecret.query.get(job_id))
+
+	def test_job_status_endpoint(self):
+		token = self.token()
+		with self.app.app_context():
+			job_id = enqueue('test_echo', {}).id
+
+		status, job = self.get_job(f'/api/v2/jobs/{job_id}', token)
+		self.assertEqual((status, job['status']), (200, 'queued'))
+		self.assertEqual(self.get_job('/api/v2/jobs/0', token)[0], 404)
+		self.assertEqual(self.client().get(f'/api/v2/jobs/{job_id}').status_code, 401)
+
+	def test_import_books_job(self):
+		token = self.token()
+		books = [
+			{'title': '  Dune ', 'isbn': '978-0-306-40615-7'},
+			{'title': 'Dune again', 'isbn': '0306406152'},
+			{'title': 'bad check digit', 'isbn': '9780306406158'},
+			{'title': ''},
+		]
+		res = self.post('/api/v2/books/import', {'books': books}, token)
+		self.assertEqual(res.status_code, 202)
+		queued = json.loads(res.data.decode())
+		self.assertEqual((queued['books'], len(queued['jobs'])), (4, 1))
+
+		with self.app.app_context():
+			self.assertEqual(run_pending(), 1)
+
+		status, job = self.get_job(f"/api/v2/jobs/{queued['jobs'][0]}", token)
+		self.assertEqual(job['status'], 'done')
+		self.assertEqual(job['result']['created'], 1)
+		self.assertEqual(job['result']['skipped'], ['9780306406157'])
+		self.assertEqual([error['index'] for error in job['result']['errors']], [2, 3])
+
+		with self.app.app_context():
+			self.assertEqual([(book.title, book.isbn) for book in Booklist.get_all()], [('dune', '9780306406157')])
+
+	def test_retried_import_is_applied_once(self):
+		token = self.token()
+		books = [{'title': 'Dune', 'isbn': '9780306406157'}, {'title': 'Emma', 'isbn': '0198526636'}]
+		job_id = json.loads(self.post('/api/v2/books/import', {'books': books}, token).data.decode())['jobs'][0]
+
+		with self.app.app_context():
+			self.assertEqual(run_pending(), 1)
+			# the worker committed the books, then died before marking the job done
+			db.session.execute("UPDATE jobs SET status = 'queued', result = NULL")
+			self.assertEqual(run_pending(), 1)
+			job = Job.query.get(job_id)
+			self.assertEqual((job.attempts, job.result['created'], job.result['skipped']), (2, 2, []))
+			self.assertEqual(len(Booklist.get_all()), 2)
+
+	def test_import_books_limit(self):
+		token = self.token()
+		self.app.config['BOOK_IMPORT_LIMIT'] = 1
+		res = self.post('/api/v2/books/import', {'books': [{}, {}]}, token)
+		self.assertEqual(res.status_code, 400)
+		self.assertEqual(self.post('/api/v2/books/import', {}, token).status_code, 400)
+		self.assertEqual(self.post('/api/v2/books/import', [], token).status_code, 400)
+		with self.app.app_context():
+			self.assertEqual(Job.query.count(), 0)
+
+	def test_archive_endpoint_queues_job(self):
+		token = self.token()
+		self.assertEqual(self.post('/api/v2/admin/archive', {'batch_size': 0}, token).status_code, 400)
+
+		res = self.post('/api/v2/admin/archive', {'older_than_days': 7}, token)
+		status, job = self.get_job(res.headers['Location'], token)
+		self.assertEqual(res.status_code, 202)
+		self.assertEqual((job['kind'], job['status']), ('archive_books', 'queued'))
+
+		with self.app.app_context():
+			payload = Job.query.get(job['id']).payload
+		self.assertEqual(payload, {'older_than_days': 7, 'batch_size': 500, 'pause': 0.1})
+
+
+class ConcurrentJobTestCase(DatabaseTestCase):
+	"""test workers share the queue"""
+
+	# every worker thread claims jobs on its own connection
+	transactional = False
+
+	def setUp(self):
+		super().setUp()
+		self.calls = []
+		HANDLERS['test_echo'] = self.calls.append
+
+	def tearDown(self):
+		del HANDLERS['test_echo']
+		super().tearDown()
+
+	def test_each_job_runs_once(self):
+		with self.app.app_context():
+			for n in range(40):
+				enqueue('test_echo', {'n': n})
+
+		barrier = threading.Barrier(4)
+		ran = []
+
+		def work():
+			with self.app.app_context():
+				barrier.wait()
+				ran.append(run_pending())
+				db.session.remove()
+
+		threads = [threading.Thread(target=work) for _ in range(4)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+		self.assertEqual(sum(ran), 40)
+		self.assertEqual(sorted(call['n'] for call in self.calls), list(range(40)))
+		with self.app.app_context():
+			self.assertEqual(Job.query.filter_by(status='done').count(), 40)
+			db.session.remove()
+
+	def test_lease_is_extended_while_job_runs(self):
+		self.app.config.update(JOB_LEASE_SECONDS=1, JOB_HEARTBEAT_SECONDS=0.05)
+		leases = []
+
+		def slow(payload):
+			# past the lease the job was claimed with
+			for _ in range(3):
+				time.sleep(0.5)
+				with db.engine.connect() as connection:
+					leases.append(connection.execute(
+						"SELECT locked_until > now() + interval '0.8 second' FROM jobs").scalar())
+
+		HANDLERS['test_slow'] = slow
+		try:
+			with self.app.app_context():
+				enqueue('test_slow', {})
+				self.assertEqual(run_pending(), 1)
+				self.assertEqual(Job.query.one().status, 'done')
+				db.session.remove()
+		finally:
+			del HANDLERS['test_slow']
+		self.assertEqual(leases, [True, True, True])
+
+
+if __name__ == "__main__":
+	unittest.main()
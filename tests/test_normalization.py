@@ -0,0 +1,31 @@
+import unittest
+from app.normalization import format_inputs, format_many, normalize, CACHED_LENGTH
+
+
+class NormalizationTestCase(unittest.TestCase):
+	"""test titles and usernames are normalized consistently"""
+
+	def test_whitespace_collapsed(self):
+		self.assertEqual(format_inputs('  Hello   Books '), 'hello books')
+		self.assertEqual(format_inputs('Hello\tBooks\n'), 'hello books')
+		self.assertEqual(format_inputs('Hello\u00a0\u2003Books'), 'hello books')
+
+	def test_unicode_forms_compare_equal(self):
+		self.assertEqual(format_inputs('\uff28\uff45\uff4c\uff4c\uff4f'), 'hello')
+		self.assertEqual(format_inputs('\ufb01ne'), 'fine')
+		self.assertEqual(format_inputs('STRASSE'), format_inputs('stra\u00dfe'))
+		self.assertEqual(format_inputs('Cafe\u0301'), format_inputs('Caf\u00e9'))
+
+	def test_long_inputs_not_cached(self):
+		word = 'Word ' * CACHED_LENGTH
+		self.assertEqual(format_inputs(word), normalize(word))
+		self.assertEqual(format_inputs(word), ('word ' * CACHED_LENGTH).strip())
+
+	def test_format_many(self):
+		words = ['A  Title', 'a title', 'Other\tTitle', 'A  Title']
+		self.assertEqual(format_many(words), [format_inputs(word) for word in words])
+		self.assertEqual(format_many([]), [])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,143 @@
+import unittest
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+from unittest import mock
+from urllib.request import urlopen
+from urllib.error import HTTPError
+from app.prefork import Arbiter, Worker
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class PreforkTestCase(unittest.TestCase):
+	"""test the pre-forked server entry point"""
+
+	def setUp(self):
+		env = dict(os.environ, APP_SETTINGS='testing')
+		self.server = subprocess.Popen(
+			[sys.executable, 'serve.py', '--bind', '127.0.0.1:0', '--workers', '2',
+			 '--threads', '2', '--max-requests', '5', '--graceful-timeout', '5'],
+			cwd=ROOT, env=env, stderr=subprocess.PIPE)
+		self.log = []
+		self.reader = threading.Thread(target=self.read_log)
+		self.reader.start()
+		self.url = 'http://127.0.0.1:{}/api/v2/missing'.format(self.wait_for(r'listening on http://[\d.]+:(\d+)').group(1))
+
+	def tearDown(self):
+		if self.server.poll() is None:
+			self.server.kill()
+		self.server.wait()
+		self.reader.join()
+
+	def read_log(self):
+		for line in self.server.stderr:
+			self.log.append(line.decode())
+
+	def wait_for(self, pattern, timeout=10):
+		deadline = time.time() + timeout
+		while time.time() < deadline:
+			for line in list(self.log):
+				match = re.search(pattern, line)
+				if match:
+					return match
+			time.sleep(0.05)
+		self.fail(f"{pattern!r} not logged:\n{''.join(self.log)}")
+
+	def get(self):
+		try:
+			return urlopen(self.url, timeout=5).status
+		except HTTPError as e:
+			return e.code
+
+	def test_serves_recycles_and_reloads(self):
+		"""test workers answer requests across recycling and a reload"""
+		for _ in range(20):
+			self.assertEqual(self.get(), 404)
+		self.wait_for(r'recycling after 5 requests')
+
+		self.server.send_signal(signal.SIGHUP)
+		self.wait_for(r'reloading workers')
+		# the workers not yet replaced may still recycle, the new ones won't within 4 requests
+		self.wait_for(r'workers reloaded')
+		for _ in range(4):
+			self.assertEqual(self.get(), 404)
+
+		self.server.send_signal(signal.SIGTERM)
+		self.assertEqual(self.server.wait(timeout=10), 0)
+		self.wait_for(r'slot \d\): \d+ requests')
+
+
+def serve(worker):
+	"""stands in for Worker.run in the forked child: comes up, then waits to be stopped"""
+	worker.started[worker.slot] = os.getpid()
+	signal.signal(signal.SIGTERM, signal.SIG_DFL)
+	while True:
+		signal.pause()
+
+
+def crash(worker):
+	raise RuntimeError('broken release')
+
+
+class ArbiterTestCase(unittest.TestCase):
+	"""test how the master replaces its workers"""
+
+	def tearDown(self):
+		self.arbiter.stopping = True
+		self.arbiter.kill_workers(signal.SIGKILL)
+		while self.arbiter.workers:
+			self.arbiter.reap()
+			time.sleep(0.01)
+
+	def until(self, condition, timeout=5):
+		deadline = time.time() + timeout
+		while not condition():
+			if time.time() > deadline:
+				self.fail('timed out')
+			self.arbiter.reap()
+			self.arbiter.spawn_due()
+			time.sleep(0.01)
+
+	def serving(self):
+		replaced = self.arbiter.replacing[1] if self.arbiter.replacing else None
+		return [pid for pid, slot in self.arbiter.workers.items()
+				if self.arbiter.started[slot] == pid and pid != replaced]
+
+	def test_reload_replaces_one_worker_at_a_time(self):
+		self.arbiter = Arbiter(None, workers=3)
+		with mock.patch.object(Worker, 'run', serve):
+			for slot in range(3):
+				self.arbiter.spawn(slot)
+			self.until(lambda: len(self.serving()) == 3)
+			old = set(self.arbiter.workers)
+
+			self.arbiter.reload()
+			fewest = 3
+			while old & set(self.arbiter.workers) or len(self.serving()) < 3:
+				self.arbiter.roll()
+				fewest = min(fewest, len(self.serving()))
+				self.arbiter.reap()
+				time.sleep(0.01)
+
+		self.assertEqual(fewest, 2)
+		self.assertFalse(old & set(self.serving()))
+
+	def test_worker_failing_on_start_is_respawned_with_backoff(self):
+		self.arbiter = Arbiter(None, workers=1, respawn_backoff=0.2)
+		with mock.patch.object(Worker, 'run', crash), self.assertLogs('hello_books.prefork', level='WARNING'):
+			self.arbiter.spawn(0)
+			self.until(lambda: not self.arbiter.workers)
+			self.assertGreater(self.arbiter.respawn_at[0] - time.time(), 0.1)
+
+			# respawned once the backoff is over, and backed off twice as long after the next failure
+			self.until(lambda: self.arbiter.failures[0] == 2)
+			self.assertGreater(self.arbiter.respawn_at[0] - time.time(), 0.3)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+import json
+import os
+import pstats
+import shutil
+import tempfile
+import time
+from tests.base import DatabaseTestCase
+
+
+class ProfilingTestCase(DatabaseTestCase):
+	"""test on-demand profiling"""
+
+	def setUp(self):
+		super().setUp()
+		self.profile_dir = tempfile.mkdtemp()
+		self.app.config['PROFILE_DIR'] = self.profile_dir
+		self.user_data = {
+			'username': 'tester',
+			'email': 'tester@mail.com',
+			'password': ',5Test_password',
+			'is_admin': True
+		}
+
+	def tearDown(self):
+		shutil.rmtree(self.profile_dir)
+		super().tearDown()
+
+	def token(self):
+		self.provision(self.user_data)
+		del self.user_data['is_admin']
+		res = self.client().post('/api/v2/auth/login', data=json.dumps(self.user_data),
+								 content_type='application/json')
+		return json.loads(res.data.decode())['access_token']
+
+	def arm(self, token, **body):
+		return self.client().post(
+			'/api/v2/admin/profile',
+			data=json.dumps(body),
+			headers={'Authorization': f'Bearer {token}'},
+			content_type='application/json')
+
+	def test_profiles_next_requests_then_disarms(self):
+		"""test a session profiles N requests, writes pstats and disarms"""
+		token = self.token()
+		res = self.arm(token, endpoint='api_get_all_books', requests=2)
+		self.assertEqual(res.status_code, 202)
+		self.assertEqual(self.arm(token, endpoint='api_get_all_books').status_code, 409)
+
+		for _ in range(3):
+			self.client().get('/api/v2/books')
+
+		profiler = self.app.extensions['profiler']
+		self.assertIsNone(profiler.session)
+		self.assertEqual(profiler.last_result['profiled_requests'], 2)
+		stats = pstats.Stats(profiler.last_result['output'])
+		self.assertTrue(any(func[2] == 'api_get_all_books' for func in stats.stats))
+
+	def test_sampling_session_ends_on_time(self):
+		"""test a sampling session disarms itself after its seconds"""
+		token = self.token()
+		self.assertEqual(self.arm(token, endpoint='api_get_all_books', mode='sampling', seconds=0.2).status_code, 202)
+		time.sleep(0.5)
+		self.assertIsNone(self.app.extensions['profiler'].session)
+
+	def test_request_racing_finish_is_not_profiled(self):
+		"""test a request that read the session as it finished doesn't begin profiling into it"""
+		self.arm(self.token(), endpoint='api_get_all_books', requests=5)
+		profiler = self.app.extensions['profiler']
+		session = profiler.session
+		lock = profiler.lock
+
+		class FinishFirst(object):
+			# the session's timer takes the lock just before the request does
+			def __enter__(self):
+				profiler.lock = lock
+				profiler.finish(session)
+				return lock.__enter__()
+
+			def __exit__(self, *exc):
+				return lock.__exit__(*exc)
+
+		profiler.lock = FinishFirst()
+		self.client().get('/api/v2/books')
+		self.assertEqual(profiler.last_result['profiled_requests'], 0)
+		self.assertIsNone(profiler.last_result['output'])
+		self.assertFalse(session.busy.locked())
+
+	def test_profile_unknown_endpoint(self):
+		self.assertEqual(self.arm(self.token(), endpoint='nope').status_code, 400)
+
+	def test_profile_requires_admin(self):
+		self.user_data['is_admin'] = False
+		self.assertEqual(self.arm(self.token(), endpoint='api_get_all_books').status_code, 403)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,120 @@
+import unittest
+import json
+from sqlalchemy import event
+from app import db
+from tests.base import DatabaseTestCase
+
+
+class QueryPlanTestCase(DatabaseTestCase):
+	"""test the queries each route runs are answered from an index"""
+
+	# the plans are explained on other connections, which must see the rows
+	transactional = False
+
+	def setUp(self):
+		super().setUp()
+		self.user_data = {
+			'username': 'tester',
+			'email': 'tester@mail.com',
+			'password': ',5Test_password'
+		}
+
+		self.client().post('/api/v2/auth/register', data=json.dumps(self.user_data),
+						   content_type='application/json')
+		res = self.client().post('/api/v2/books', data=json.dumps({'title': 'plans', 'isbn': '0306406152'}),
+								 content_type='application/json')
+		self.book_id = json.loads(res.data.decode())['book_created']['id']
+
+		# enough rows that a full index scan costs more than a lookup
+		with self.app.app_context():
+			db.session.execute(
+				"INSERT INTO bookslist (title, isbn) "
+				"SELECT 'filler ' || n, lpad(n::text, 10, '0') FROM generate_series(1, 2000) AS n")
+			db.session.commit()
+			# with long emails, the email index is a level deeper than the username one,
+			# so the planner has a reason to pick the username index
+			db.session.execute(
+				"INSERT INTO users (username, email, password_hash) "
+				"SELECT 'filler' || n, rpad('filler' || n, 80, '.x') || '@mail.example.com', '' "
+				"FROM generate_series(1, 20000) AS n")
+			db.session.commit()
+			db.session.execute('ANALYZE bookslist')
+			db.session.execute('ANALYZE users')
+			db.session.commit()
+
+	def route_selects(self, method, url, data=None):
+		"""
+		:return: the SELECT statements and parameters a request executes
+		"""
+		selects = []
+
+		def record(conn, cursor, statement, parameters, context, executemany):
+			if statement.lstrip().upper().startswith('SELECT'):
+				selects.append((statement, parameters))
+
+		with self.app.app_context():
+			engine = db.engine
+		event.listen(engine, 'before_cursor_execute', record)
+		try:
+			self.client().open(url, method=method, data=json.dumps(data) if data else None,
+							   content_type='application/json')
+		finally:
+			event.remove(engine, 'before_cursor_execute', record)
+
+		return selects
+
+	def plans(self, selects):
+		with self.app.app_context():
+			connection = db.engine.raw_connection()
+		try:
+			cursor = connection.cursor()
+			# the test tables are tiny, stop the planner preferring a scan
+			cursor.execute('SET enable_seqscan = off')
+			for statement, parameters in selects:
+				cursor.execute('EXPLAIN ' + statement, parameters)
+				yield '\n'.join(row[0] for row in cursor.fetchall())
+		finally:
+			connection.rollback()
+			connection.close()
+
+	def assert_uses_index(self, method, url, expected, data=None):
+		"""
+		:param expected: plan fragments, one of which must appear in every plan
+		"""
+		selects = self.route_selects(method, url, data)
+		self.assertTrue(selects, f'{method} {url} ran no query')
+
+		for plan in self.plans(selects):
+			self.assertNotIn('Seq Scan', plan)
+			self.assertTrue(any(fragment in plan for fragment in expected), plan)
+
+	def test_book_by_id_routes(self):
+		url = f'/api/v2/books/{self.book_id}'
+		# the id must be the index condition, whichever index the planner picks
+		self.assert_uses_index('GET', url, ['Index Cond: (id ='])
+		self.assert_uses_index('PUT', url, ['Index Cond: (id ='], {'title': 'new title'})
+		self.assert_uses_index('DELETE', url, ['Index Cond: (id ='])
+
+	def test_login_route(self):
+		self.assert_uses_index('POST', '/api/v2/auth/login', ['Index Scan using ix_users_username on users'], self.user_data)
+
+	def test_register_route(self):
+		"""test registration relies on the unique indexes instead of a lookup"""
+		self.assertEqual(self.route_selects('POST', '/api/v2/auth/register', self.user_data), [])
+
+	def test_date_modified_index(self):
+		"""test change polling by date_modified uses its index"""
+		with self.app.app_context():
+			from app.models import Booklist
+			query = Booklist.query.filter(Booklist.date_modified > db.func.now())
+			statement = str(query.statement.compile(db.engine))
+			params = query.statement.compile(db.engine).params
+
+		for plan in self.plans([(statement, params)]):
+			self.assertIn('ix_bookslist_date_modified', plan)
+
+	# GET /api/v2/books reads every row and is expected to scan
+
+
+if __name__ == "__main__":
+	unittest.main()
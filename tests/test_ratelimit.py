@@ -0,0 +1,114 @@
+import unittest
+import json
+import time
+from app.ratelimit import MemoryBackend, RedisBackend
+from tests.base import DatabaseTestCase, redis_client
+
+
+class TokenBucketTestCase(unittest.TestCase):
+	"""test token bucket backends"""
+
+	def check_backend(self, backend):
+		for _ in range(3):
+			self.assertEqual(backend.acquire('k', rate=1, per=10, burst=3, now=100.0), (True, 0))
+
+		allowed, retry_after = backend.acquire('k', rate=1, per=10, burst=3, now=100.0)
+		self.assertFalse(allowed)
+		self.assertAlmostEqual(retry_after, 10.0)
+
+		# one token refills after `per / rate` seconds
+		self.assertTrue(backend.acquire('k', rate=1, per=10, burst=3, now=110.0)[0])
+		self.assertFalse(backend.acquire('k', rate=1, per=10, burst=3, now=110.0)[0])
+
+		# buckets are independent
+		self.assertTrue(backend.acquire('other', rate=1, per=10, burst=3, now=110.0)[0])
+
+	def test_memory_backend(self):
+		self.check_backend(MemoryBackend())
+
+	def redis(self):
+		client = redis_client()
+		if client is None:
+			self.skipTest('TEST_REDIS_URL is not set')
+		return client
+
+	def test_redis_backend(self):
+		"""test the GCRA script on a Redis server"""
+		self.check_backend(RedisBackend(self.redis()))
+
+	def test_redis_bucket_expires_once_full(self):
+		client = self.redis()
+		backend = RedisBackend(client)
+		now = time.time()
+		for _ in range(2):
+			backend.acquire('k', rate=1, per=10, burst=3, now=now)
+
+		# two tokens are taken, the bucket is full again 20s later and the key goes with it
+		self.assertTrue(19000 < client.pttl('rl:k') <= 20000)
+
+		# a current time keeps its sub-millisecond part through the script
+		self.assertTrue(backend.acquire('fast', rate=1000, per=1, burst=1, now=now)[0])
+		allowed, retry_after = backend.acquire('fast', rate=1000, per=1, burst=1, now=now + 0.0005)
+		self.assertFalse(allowed)
+		self.assertAlmostEqual(retry_after, 0.0005, delta=1e-6)
+
+	def test_memory_backend_sweeps_full_buckets(self):
+		backend = MemoryBackend()
+		backend.acquire('k', rate=1, per=10, burst=3, now=100.0)
+		self.assertEqual(len(backend), 1)
+		backend.sweep(now=200.0)
+		self.assertEqual(len(backend), 0)
+
+
+class RateLimitTestCase(DatabaseTestCase):
+	"""test api admission control"""
+
+	def setUp(self):
+		super().setUp()
+		self.app.config['RATELIMIT_ENABLED'] = True
+		self.app.config['RATELIMIT_ROUTES'] = {
+			'auth.login_view': {'rate': 1, 'per': 60, 'burst': 2, 'scope': 'client'}
+		}
+		self.user_data = {
+			'username': 'tester',
+			'email': 'tester@mail.com',
+			'password': ',5Test_password'
+		}
+
+	def login(self):
+		return self.client().post(
+			'/api/v2/auth/login',
+			data=json.dumps(self.user_data),
+			content_type='application/json')
+
+	def test_login_rate_limited(self):
+		"""test api returns 429 with Retry-After once the bucket is empty"""
+		self.assertEqual(self.login().status_code, 401)
+		self.assertEqual(self.login().status_code, 401)
+		res = self.login()
+		self.assertEqual(res.status_code, 429)
+		self.assertEqual(res.headers['Retry-After'], '60')
+
+	def test_unlimited_route_not_limited(self):
+		"""test routes without a configured limit are not limited"""
+		for _ in range(5):
+			self.assertEqual(self.client().get('/api/v2/books').status_code, 200)
+
+	def test_concurrency_cap(self):
+		"""test api returns 503 when every request slot is taken"""
+		self.app.config['MAX_CONCURRENT_REQUESTS'] = 1
+		limiter = self.app.extensions['ratelimit']
+
+		with self.app.app_context():
+			self.assertTrue(limiter.slots.acquire(blocking=False))
+
+		res = self.client().get('/api/v2/books')
+		self.assertEqual(res.status_code, 503)
+		self.assertEqual(res.headers['Retry-After'], '1')
+
+		limiter.slots.release()
+		self.assertEqual(self.client().get('/api/v2/books').status_code, 200)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,180 @@
+import unittest
+import json
+import threading
+import time
+from datetime import datetime
+from unittest import mock
+from app import db
+from app.isbn import check_digit_13
+from app.readmodel import Catalogue, to_micros, from_micros, MISSING
+from tests.base import DatabaseTestCase
+
+CREATED = datetime(2024, 5, 1, 12, 30, 15, 123456)
+
+
+def isbn(n):
+	body = f'978{n:09d}'
+	return body + check_digit_13(body)
+
+
+def row(book_id, title='title', deleted_at=None, isbn_key=None):
+	number = isbn(book_id)
+	return (book_id, title, number, int(number) if isbn_key is None else isbn_key, CREATED, CREATED, deleted_at)
+
+
+class CatalogueTestCase(unittest.TestCase):
+	"""test the columnar catalogue"""
+
+	def test_timestamps_round_trip(self):
+		self.assertEqual(from_micros(to_micros(CREATED)), CREATED)
+		self.assertIsNone(from_micros(to_micros(None)))
+
+	def test_keeps_books_ordered_by_id(self):
+		catalogue = Catalogue()
+		catalogue.apply([row(5), row(2), row(9), row(7)])
+
+		self.assertEqual(list(catalogue.ids), [2, 5, 7, 9])
+		self.assertEqual([book.id for book in catalogue.all()], [2, 5, 7, 9])
+		book = catalogue.get(7)
+		self.assertEqual((book.isbn, book.date_created), (isbn(7), CREATED))
+		self.assertIsNone(catalogue.get(6))
+
+	def test_updates_and_deletes(self):
+		catalogue = Catalogue()
+		catalogue.apply([row(1), row(2), row(3)])
+		catalogue.apply([row(2, title='renamed'), row(1, deleted_at=CREATED), row(4, deleted_at=CREATED)])
+
+		self.assertEqual([(book.id, book.title) for book in catalogue.all()], [(2, 'renamed'), (3, 'title')])
+		self.assertEqual(len(catalogue.titles), len(catalogue.isbn_keys))
+
+	def test_isbns_without_key(self):
+		catalogue = Catalogue()
+		catalogue.apply([(1, 'old', '12-34', None, None, None, None)])
+		book = catalogue.get(1)
+		self.assertEqual(catalogue.isbn_keys[0], MISSING)
+		self.assertEqual((book.isbn, book.date_created), ('12-34', None))
+
+		catalogue.apply([row(1)])
+		self.assertEqual(catalogue.get(1).isbn, isbn(1))
+		self.assertEqual(catalogue.odd_isbns, {})
+
+	def test_titles_are_interned(self):
+		catalogue = Catalogue()
+		catalogue.apply([row(1, title=''.join(['du', 'ne'])), row(2, title=''.join(['d', 'une']))])
+		self.assertIs(catalogue.titles[0], catalogue.titles[1])
+
+		memory = catalogue.memory()
+		self.assertEqual(memory['books'], 2)
+		self.assertEqual(memory['bytes'], sum(memory['columns'].values()))
+
+
+class ReadModelTestCase(DatabaseTestCase):
+	"""test books are served from the read model"""
+
+	# the read model reads on connections of its own
+	transactional = False
+
+	def setUp(self):
+		super().setUp()
+		self.app.config['READ_MODEL_ENABLED'] = True
+		self.read_model = self.app.extensions['read_model']
+		self.ids = [self.create(f'book {n}', isbn(n)) for n in range(3)]
+
+	def create(self, title, number):
+		res = self.client().post('/api/v2/books', data=json.dumps({'title': title, 'isbn': number}),
+								 content_type='application/json')
+		return json.loads(res.data.decode())['book_created']['id']
+
+	def get(self, url):
+		res = self.client().get(url)
+		return res.status_code, json.loads(res.data.decode())
+
+	def execute(self, statement, **params):
+		with self.app.app_context():
+			with db.engine.begin() as connection:
+				connection.execute(db.text(statement), **params)
+
+	def test_serves_reads_from_memory(self):
+		before = self.get('/api/v2/books')
+		with self.app.app_context():
+			self.read_model.load()
+		self.assertTrue(self.read_model.serving)
+		self.assertEqual(self.get('/api/v2/books'), before)
+		self.assertEqual(self.get(f'/api/v2/books/{self.ids[0]}')[1]['title'], 'book 0')
+
+		# changes behind its back are only seen once polled
+		self.execute("UPDATE bookslist SET title = 'changed', date_modified = current_timestamp WHERE id = :id",
+					 id=self.ids[0])
+		self.assertEqual(self.get(f'/api/v2/books/{self.ids[0]}')[1]['title'], 'book 0')
+		with self.app.app_context():
+			# the overlap window applies recent rows again, which is harmless
+			self.assertGreaterEqual(self.read_model.refresh(), 1)
+		self.assertEqual(self.get(f'/api/v2/books/{self.ids[0]}')[1]['title'], 'changed')
+
+	def test_polls_creates_and_deletes(self):
+		with self.app.app_context():
+			self.read_model.load()
+		new_id = self.create('new book', isbn(10))
+		self.client().delete(f'/api/v2/books/{self.ids[1]}')
+
+		with self.app.app_context():
+			self.read_model.refresh()
+		self.assertEqual(self.get(f'/api/v2/books/{new_id}')[1]['title'], 'new book')
+		self.assertEqual(self.get(f'/api/v2/books/{self.ids[1]}')[0], 404)
+		self.assertEqual(len(self.get('/api/v2/books')[1]['books']), 3)
+
+	def test_late_commits_within_overlap_are_seen(self):
+		with self.app.app_context():
+			self.read_model.load()
+		# a transaction that started before the last poll commits after it
+		self.execute("UPDATE bookslist SET title = 'late', date_modified = date_modified - interval '2 seconds' "
+					 "WHERE id = :id", id=self.ids[2])
+
+		with self.app.app_context():
+			self.read_model.refresh()
+		self.assertEqual(self.get(f'/api/v2/books/{self.ids[2]}')[1]['title'], 'late')
+
+	def test_loads_as_warmup_step(self):
+		warmup = self.app.extensions['warmup']
+		warmup.start()
+		self.assertTrue(warmup.done.wait(5))
+		self.read_model.stop()
+
+		self.assertEqual(warmup.results['read_model']['status'], 'ok')
+		self.assertTrue(self.read_model.serving)
+		self.assertEqual(len(self.read_model.catalogue), 3)
+
+	def test_started_once_by_concurrent_callers(self):
+		loads = []
+		load = self.read_model.load
+
+		def slow_load():
+			loads.append(None)
+			time.sleep(0.2)
+			return load()
+
+		def start():
+			with self.app.app_context():
+				self.read_model.start()
+
+		with mock.patch.object(self.read_model, 'load', slow_load):
+			threads = [threading.Thread(target=start) for _ in range(3)]
+			for thread in threads:
+				thread.start()
+			for thread in threads:
+				thread.join()
+		pollers = [thread.name for thread in threading.enumerate()].count('read-model')
+		self.read_model.stop()
+
+		self.assertEqual(len(loads), 1)
+		self.assertEqual(pollers, 1)
+
+	def test_not_served_when_disabled(self):
+		self.app.config['READ_MODEL_ENABLED'] = False
+		with self.app.app_context():
+			self.read_model.load()
+		self.assertFalse(self.read_model.serving)
+
+
+if __name__ == "__main__":
+	unittest.main()
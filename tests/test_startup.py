@@ -0,0 +1,61 @@
+import unittest
+import json
+import os
+import subprocess
+import sys
+from app import create_app, db
+from app.startup import warm_app, after_fork
+from benchmarks import startup
+
+CHECK_DEFERRED = """
+import json, sys
+from app import create_app
+create_app('testing')
+print(json.dumps([name for name in sys.argv[1:] if name in sys.modules]))
+"""
+
+
+class StartupTestCase(unittest.TestCase):
+	"""test cold start stays within its budget and defers its heavy imports"""
+
+	def test_startup_within_budget(self):
+		# the fastest of 3 cold starts, with room for a loaded machine, see benchmarks/startup.py
+		result = startup.measure(runs=3)
+		self.assertEqual(startup.over_budget(result, slack=startup.SLACK), [], result)
+
+	def test_serving_defers_heavy_imports(self):
+		# in a fresh interpreter, this one has imported them already
+		output = subprocess.check_output(
+			[sys.executable, '-c', CHECK_DEFERRED] + list(startup.DEFERRED_MODULES), cwd=startup.ROOT)
+		self.assertEqual(json.loads(output.decode()), [])
+
+	@unittest.skipUnless(hasattr(os, 'fork'), 'needs fork')
+	def test_forked_worker_does_not_share_connections(self):
+		app = warm_app(create_app(config_name="testing"))
+
+		with app.app_context():
+			parent_pid = db.session.execute('select pg_backend_pid()').scalar()
+			db.session.remove()
+
+		child = os.fork()
+		if child == 0:
+			code = 1
+			try:
+				after_fork(app)
+				with app.app_context():
+					child_pid = db.session.execute('select pg_backend_pid()').scalar()
+				code = 0 if child_pid != parent_pid else 1
+			finally:
+				os._exit(code)
+
+		_, status = os.waitpid(child, 0)
+		self.assertEqual(os.WEXITSTATUS(status), 0)
+
+		# the parent's pooled connection survived the child
+		with app.app_context():
+			self.assertEqual(db.session.execute('select pg_backend_pid()').scalar(), parent_pid)
+			db.session.remove()
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,282 @@
+import unittest
+import json
+import jwt
+import flask_migrate
+from alembic.script import ScriptDirectory
+from app import db
+from app.jobs.queue import run_pending
+from app.models import Job
+from app.tenants import MIGRATIONS_DIRECTORY, create_tenant, host_tenant
+from tests.base import DatabaseTestCase
+
+TENANTS = ('alpha', 'beta')
+
+
+class TenantTestCase(DatabaseTestCase):
+	"""test requests are routed to their library's schema"""
+
+	# tenants are reached on connections of their own
+	transactional = False
+
+	def setUp(self):
+		super().setUp()
+		self.app.config.update(
+			TENANT_ROUTING_ENABLED=True,
+			TENANT_HOST_SUFFIX='.books.test',
+			TENANT_POOL_SIZE=1,
+			TENANT_MAX_OVERFLOW=0,
+			TENANT_POOL_TIMEOUT=0.2)
+		self.router = self.app.extensions['tenants']
+		for tenant in TENANTS:
+			create_tenant(self.app, tenant)
+		self.user_data = {
+			'username': 'tester',
+			'email': 'tester@mail.com',
+			'password': ',5Test_password',
+			'is_admin': True
+		}
+
+	def tearDown(self):
+		self.router.dispose()
+		with self.app.app_context():
+			with db.engine.begin() as connection:
+				for tenant in TENANTS:
+					connection.execute(f'DROP SCHEMA IF EXISTS tenant_{tenant} CASCADE')
+		super().tearDown()
+
+	def request(self, method, url, host='localhost', token=None, body=None):
+		headers = {'Authorization': f'Bearer {token}'} if token else {}
+		res = self.client().open(url, method=method, base_url=f'http://{host}', headers=headers,
+								 data=json.dumps(body) if body is not None else None,
+								 content_type='application/json')
+		return res.status_code, json.loads(res.data.decode())
+
+	def titles(self, host='localhost', token=None):
+		status, result = self.request('GET', '/api/v2/books', host=host, token=token)
+		return [book['title'] for book in result['books']]
+
+	def login(self, host):
+		self.provision(self.user_data, tenant=host_tenant(host, '.books.test'))
+		user = dict(self.user_data)
+		del user['is_admin']
+		return self.request('POST', '/api/v2/auth/login', host=host, body=user)[1]['access_token']
+
+	def test_host_names_tenant(self):
+		self.assertEqual(host_tenant('alpha.books.test:5000', '.books.test'), 'alpha')
+		self.assertIsNone(host_tenant('books.test', '.books.test'))
+		self.assertIsNone(host_tenant('alpha.books.test', None))
+
+	def test_books_are_kept_per_tenant(self):
+		status, _ = self.request('POST', '/api/v2/books', host='alpha.books.test',
+								 body={'title': 'alpha book', 'isbn': '0306406152'})
+		self.assertEqual(status, 201)
+		# the same isbn is free in another library
+		status, _ = self.request('POST', '/api/v2/books', host='beta.books.test',
+								 body={'title': 'beta book', 'isbn': '0306406152'})
+		self.assertEqual(status, 201)
+
+		self.assertEqual(self.titles('alpha.books.test'), ['alpha book'])
+		self.assertEqual(self.titles('beta.books.test'), ['beta book'])
+		self.assertEqual(self.titles(), [])
+
+	def test_token_claim_names_tenant(self):
+		token = self.login('alpha.books.test')
+		with self.app.app_context():
+			claims = jwt.decode(token, str(self.app.config['SECRET']), algorithms=['HS256'])
+		self.assertEqual(claims['tenant'], 'alpha')
+		self.assertEqual(self.request('GET', '/api/v2/admin/profile', host='alpha.books.test', token=token)[0], 200)
+
+		# the token is only good on its own library's host
+		for host in ('localhost', 'beta.books.test'):
+			status, result = self.request('GET', '/api/v2/admin/profile', host=host, token=token)
+			self.assertEqual((status, result['error']), (403, 'token was issued for another library'))
+
+	def test_default_token_is_refused_on_tenant_host(self):
+		# user 1 of the default database is not user 1 of alpha
+		self.provision(self.user_data)
+		self.provision(self.user_data, tenant='alpha')
+		token = self.login('localhost')
+		self.assertEqual(self.request('GET', '/api/v2/admin/profile', token=token)[0], 200)
+
+		status, result = self.request('GET', '/api/v2/admin/profile', host='alpha.books.test', token=token)
+		self.assertEqual((status, result['error']), (403, 'token was issued for another library'))
+
+	def test_refresh_token_is_kept_to_its_tenant(self):
+		self.login('alpha.books.test')
+		user = {key: self.user_data[key] for key in ('username', 'email', 'password')}
+		refresh_token = self.request('POST', '/api/v2/auth/login', host='alpha.books.test', body=user)[1]['refresh_token']
+
+		status, _ = self.request('POST', '/api/v2/auth/refresh', body={'refresh_token': refresh_token})
+		self.assertEqual(status, 401)
+		status, _ = self.request('POST', '/api/v2/auth/refresh', host='alpha.books.test',
+								 body={'refresh_token': refresh_token})
+		self.assertEqual(status, 200)
+
+	def test_group_commit_writes_to_tenant(self):
+		# an update holds the request's connection while the flusher takes another
+		self.app.config.update(GROUP_COMMIT_ENABLED=True, TENANT_POOL_SIZE=2)
+		committer = self.app.extensions['group_commit']
+		try:
+			status, result = self.request('POST', '/api/v2/books', host='alpha.books.test',
+										  body={'title': 'alpha book', 'isbn': '0306406152'})
+			self.assertEqual(status, 201)
+			status, _ = self.request('POST', '/api/v2/books', host='beta.books.test',
+									 body={'title': 'beta book', 'isbn': '0306406152'})
+			self.assertEqual(status, 201)
+			status, _ = self.request('PUT', f"/api/v2/books/{result['book_created']['id']}",
+									 host='alpha.books.test', body={'title': 'renamed'})
+			self.assertEqual(status, 201)
+		finally:
+			committer.stop()
+
+		self.assertEqual(self.titles('alpha.books.test'), ['renamed'])
+		self.assertEqual(self.titles('beta.books.test'), ['beta book'])
+		self.assertEqual(self.titles(), [])
+
+	def test_jobs_run_in_their_tenant(self):
+		token = self.login('alpha.books.test')
+		res = self.client().post('/api/v2/books/import', base_url='http://alpha.books.test',
+								 data=json.dumps({'title': 'imported', 'isbn': '0306406152'}),
+								 content_type='application/x-ndjson', headers={'Authorization': f'Bearer {token}'})
+		self.assertEqual(res.status_code, 202)
+		job_id = json.loads(res.data.decode())['jobs'][0]
+
+		# the queue is the default database's, polled by one worker for every library
+		with self.app.app_context():
+			self.assertEqual(Job.query.get(job_id).tenant, 'alpha')
+			self.assertEqual(run_pending(), 1)
+			self.assertEqual(Job.query.get(job_id).status, 'done')
+		self.assertEqual(self.titles('alpha.books.test'), ['imported'])
+		self.assertEqual(self.titles(), [])
+
+		status, job = self.request('GET', f'/api/v2/jobs/{job_id}', host='alpha.books.test', token=token)
+		self.assertEqual((status, job['job']['result']['created']), (200, 1))
+		beta_token = self.login('beta.books.test')
+		self.assertEqual(self.request('GET', f'/api/v2/jobs/{job_id}', host='beta.books.test', token=beta_token)[0], 404)
+
+	def test_archival_runs_in_its_tenant(self):
+		token = self.login('alpha.books.test')
+		for host, host_token in (('alpha.books.test', token), ('localhost', None)):
+			status, result = self.request('POST', '/api/v2/books', host=host, token=host_token,
+										  body={'title': 'deleted', 'isbn': '0306406152'})
+			self.request('DELETE', f"/api/v2/books/{result['book_created']['id']}", host=host, token=host_token)
+
+		with self.app.app_context():
+			with db.engine.begin() as connection:
+				for table in ('tenant_alpha.bookslist', 'bookslist'):
+					connection.execute(f"UPDATE {table} SET deleted_at = deleted_at - interval '40 days'")
+
+		status, result = self.request('POST', '/api/v2/admin/archive', host='alpha.books.test', token=token,
+									  body={'pause': 0})
+		self.assertEqual(status, 202)
+		with self.app.app_context():
+			self.assertEqual(run_pending(), 1)
+			self.assertEqual(Job.query.get(result['job']['id']).result, {'archived': 1})
+
+			with db.engine.connect() as connection:
+				def count(table):
+					return connection.execute(f'SELECT count(*) FROM {table}').scalar()
+
+				self.assertEqual((count('tenant_alpha.bookslist'), count('tenant_alpha.bookslist_archive')), (0, 1))
+				# the default library's deleted book is left where it was
+				self.assertEqual((count('bookslist'), count('bookslist_archive')), (1, 0))
+
+	def test_tenant_is_migrated_on_its_own(self):
+		head = ScriptDirectory(MIGRATIONS_DIRECTORY).get_current_head()
+		flask_migrate.Migrate(self.app, db, directory=MIGRATIONS_DIRECTORY)
+		self.request('POST', '/api/v2/books', host='alpha.books.test', body={'title': 'alpha book', 'isbn': '0306406152'})
+
+		def columns(schema, table):
+			return [row[0] for row in connection.execute(
+				'SELECT column_name FROM information_schema.columns WHERE table_schema = %s AND table_name = %s',
+				schema, table)]
+
+		with self.app.app_context():
+			connection = db.engine.connect()
+			try:
+				# new libraries start at head, without the shared tables
+				self.assertEqual(connection.execute('SELECT version_num FROM tenant_alpha.alembic_version').scalar(), head)
+				self.assertEqual(columns('tenant_alpha', 'jobs'), [])
+
+				flask_migrate.downgrade(revision='c41d7a9b2e65', x_arg=['tenant=alpha'])
+				self.assertNotIn('isbn_key', columns('tenant_alpha', 'bookslist'))
+				self.assertIn('isbn_key', columns('tenant_beta', 'bookslist'))
+				self.assertIn('isbn_key', columns('public', 'bookslist'))
+
+				flask_migrate.upgrade(x_arg=['tenant=alpha'])
+				self.assertEqual(connection.execute('SELECT version_num FROM tenant_alpha.alembic_version').scalar(), head)
+				self.assertEqual(connection.execute('SELECT isbn_key FROM tenant_alpha.bookslist').scalar(), 9780306406157)
+				self.assertEqual(columns('tenant_alpha', 'jobs'), [])
+				self.assertFalse(connection.execute("SELECT to_regclass('public.alembic_version')").scalar())
+			finally:
+				connection.close()
+
+	def test_audit_trail_is_listed_per_tenant(self):
+		self.provision(self.user_data)
+		self.login('localhost')
+		alpha_token = self.login('alpha.books.test')
+		with self.app.app_context():
+			self.app.extensions['audit'].flush()
+
+		# the events are written to the default database, each with its library
+		status, result = self.request('GET', '/api/v2/admin/audit', host='alpha.books.test', token=alpha_token)
+		self.assertEqual(status, 200)
+		self.assertEqual([(event['kind'], event['tenant']) for event in result['events']], [('login', 'alpha')])
+
+	def test_forged_claim_is_ignored(self):
+		token = jwt.encode({'sub': 1, 'tenant': 'alpha'}, 'not the secret', algorithm='HS256')
+		self.request('POST', '/api/v2/books', host='alpha.books.test',
+					 body={'title': 'alpha book', 'isbn': '0306406152'})
+		self.assertEqual(self.titles(token=token), [])
+
+	def test_unknown_tenant(self):
+		status, result = self.request('GET', '/api/v2/books', host='gamma.books.test')
+		self.assertEqual((status, result['error']), (404, 'unknown library'))
+		self.assertEqual(self.request('GET', '/api/v2/books', host='Bad-Name.books.test')[0], 404)
+		self.assertEqual(self.router.describe()['engines'], 0)
+
+		# with a database per tenant, a missing database is an unknown library too
+		self.app.config.update(
+			TENANT_SCHEMA=None,
+			TENANT_DATABASE_URL=self.app.config['SQLALCHEMY_DATABASE_URI'].rsplit('/', 1)[0] + '/no_library_{tenant}')
+		self.assertEqual(self.request('GET', '/api/v2/books', host='gamma.books.test')[0], 404)
+
+	def test_idle_engines_are_evicted(self):
+		self.app.config['TENANT_MAX_ENGINES'] = 1
+		self.titles('alpha.books.test')
+		self.titles('beta.books.test')
+		self.assertEqual(list(self.router.engines), ['beta'])
+		self.assertEqual(self.router.describe()['evicted'], 1)
+
+		# an engine with connections in use is kept until they are returned
+		with self.router.engine('beta').connect():
+			self.titles('alpha.books.test')
+			self.assertEqual(list(self.router.engines), ['beta', 'alpha'])
+
+	def test_leased_engines_are_not_evicted(self):
+		self.app.config['TENANT_MAX_ENGINES'] = 1
+		# handed out, but no connection checked out yet
+		engine = self.router.engine('alpha', lease=True)
+		self.titles('beta.books.test')
+		self.assertEqual(list(self.router.engines), ['alpha', 'beta'])
+		self.assertEqual(self.router.describe()['leased'], 1)
+
+		with engine.connect() as connection:
+			self.assertEqual(connection.execute('SELECT 1').scalar(), 1)
+			self.assertEqual(self.router.describe()['connections'], 2)
+
+		# the engine over the bound goes once it is released
+		self.router.release('alpha')
+		self.assertEqual(list(self.router.engines), ['beta'])
+		self.assertEqual(self.router.describe()['leased'], 0)
+
+	def test_busy_tenant_does_not_starve_others(self):
+		with self.router.engine('alpha').connect():
+			# alpha's only connection is taken
+			status, result = self.request('GET', '/api/v2/books', host='alpha.books.test')
+			self.assertEqual((status, result['error']), (503, 'service unavailable'))
+			self.assertEqual(self.titles('beta.books.test'), [])
+
+
+if __name__ == "__main__":
+	unittest.main()
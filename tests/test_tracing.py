@@ -0,0 +1,74 @@
+import unittest
+import json
+import os
+import tempfile
+from tests.base import DatabaseTestCase
+
+
+class TracingTestCase(DatabaseTestCase):
+	"""test request ids and phase timings"""
+
+	def setUp(self):
+		super().setUp()
+		self.app.config['TRACE_SAMPLE_RATE'] = 1.0
+
+	def traces(self, method, url, data=None):
+		with self.assertLogs('hello_books.trace', level='INFO') as logs:
+			res = self.client().open(url, method=method, data=json.dumps(data) if data else None,
+									 content_type='application/json')
+		return res, [json.loads(line.split(':', 2)[2]) for line in logs.output]
+
+	def test_request_id_header(self):
+		"""test every response carries a request id, a valid given one is kept"""
+		self.app.config['TRACE_SAMPLE_RATE'] = 0
+		res = self.client().get('/api/v2/books')
+		self.assertEqual(len(res.headers['X-Request-ID']), 32)
+
+		res = self.client().get('/api/v2/books', headers={'X-Request-ID': 'abc-123'})
+		self.assertEqual(res.headers['X-Request-ID'], 'abc-123')
+
+		res = self.client().get('/api/v2/books', headers={'X-Request-ID': 'bad id!'})
+		self.assertNotEqual(res.headers['X-Request-ID'], 'bad id!')
+
+	def test_book_phases_logged(self):
+		"""test sampled requests log their db and serialization time"""
+		res, traces = self.traces('POST', '/api/v2/books', {'title': 'traced', 'isbn': '0306406152'})
+		self.assertEqual(res.status_code, 201)
+		self.assertEqual(traces[0]['request_id'], res.headers['X-Request-ID'])
+		self.assertEqual(traces[0]['status'], 201)
+		self.assertEqual(set(traces[0]['phases']), {'validation', 'db', 'serialization'})
+
+	def test_login_phases_logged(self):
+		"""test sampled logins log their password hashing time"""
+		user = {'username': 'tester', 'email': 'tester@mail.com', 'password': ',5Test_password'}
+		self.client().post('/api/v2/auth/register', data=json.dumps(user), content_type='application/json')
+		res, traces = self.traces('POST', '/api/v2/auth/login', user)
+		self.assertEqual(res.status_code, 200)
+		self.assertTrue({'db', 'validation', 'hashing', 'token', 'serialization'} <= set(traces[0]['phases']))
+
+	def test_unsampled_requests_not_logged(self):
+		self.app.config['TRACE_SAMPLE_RATE'] = 0
+		with self.assertRaises(AssertionError):
+			self.traces('GET', '/api/v2/books')
+
+	def test_file_exporter(self):
+		"""test sampled traces are exported as OTLP/JSON lines"""
+		handle, path = tempfile.mkstemp()
+		os.close(handle)
+		self.app.config['TRACE_EXPORT_FILE'] = path
+		try:
+			res, traces = self.traces('GET', '/api/v2/books')
+			with open(path) as export_file:
+				exported = json.loads(export_file.readline())
+		finally:
+			os.remove(path)
+
+		spans = exported['resourceSpans'][0]['scopeSpans'][0]['spans']
+		self.assertEqual(spans[0]['traceId'], res.headers['X-Request-ID'])
+		self.assertEqual(spans[0]['name'], 'GET /api/v2/books')
+		self.assertEqual([span['name'] for span in spans[1:]], ['db', 'serialization'])
+		self.assertTrue(all(span['parentSpanId'] == spans[0]['spanId'] for span in spans[1:]))
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,157 @@
+import unittest
+import io
+import json
+from app.jobs.queue import run_pending
+from app.models import Booklist, Job
+from app.streaming import StreamError, iter_json_array, iter_ndjson, batches
+from tests.base import DatabaseTestCase
+
+
+class StreamingTestCase(unittest.TestCase):
+	"""test the incremental JSON parsers"""
+
+	def parse(self, text, key='books', chunk_size=3, **options):
+		return list(iter_json_array(io.BytesIO(text.encode()), key=key, chunk_size=chunk_size, **options))
+
+	def test_array_across_chunks(self):
+		items = [{'title': 'Dune', 'isbn': '9780306406157'}, 12345, -1.5e3, 'ü ☃', None, True, [1, [2]], {}]
+		text = json.dumps(items, ensure_ascii=False)
+		for chunk_size in (1, 2, 7, 4096):
+			self.assertEqual(self.parse(text, chunk_size=chunk_size), items)
+
+		self.assertEqual(self.parse(' \n[ 1 ,2 ]\n'), [1, 2])
+		self.assertEqual(self.parse('[]'), [])
+
+	def test_wrapped_array(self):
+		self.assertEqual(self.parse('{"books": [{"a": 1}, 2]}'), [{'a': 1}, 2])
+		self.assertEqual(self.parse('{ "books" : [ ] }'), [])
+
+		for text in ('{"other": []}', '{"books": [], "other": 1}', '{}', '"books"'):
+			with self.assertRaises(StreamError):
+				self.parse(text)
+
+	def test_malformed(self):
+		for text in ('[1, 2', '[1 2]', '[1,]', '[{"a": }]', '[1] 2', '', '[1, tru]'):
+			with self.assertRaises(StreamError, msg=text):
+				self.parse(text)
+
+		# items before the error are yielded as they are parsed
+		items = iter_json_array(io.BytesIO(b'[1, 2, oops]'), chunk_size=2)
+		self.assertEqual((next(items), next(items)), (1, 2))
+		with self.assertRaises(StreamError):
+			next(items)
+
+	def test_item_size(self):
+		text = json.dumps([{'title': 'x' * 100}])
+		with self.assertRaises(StreamError):
+			self.parse(text, max_item_size=50)
+		self.assertEqual(len(self.parse(text, max_item_size=200)), 1)
+
+	def test_ndjson(self):
+		stream = io.BytesIO(b'{"title": "Dune"}\n\n  [1]\r\n2')
+		self.assertEqual(list(iter_ndjson(stream)), [{'title': 'Dune'}, [1], 2])
+
+		with self.assertRaisesRegex(StreamError, 'line 2'):
+			list(iter_ndjson(io.BytesIO(b'1\n{\n')))
+		with self.assertRaisesRegex(StreamError, 'longer'):
+			list(iter_ndjson(io.BytesIO(b'"' + b'x' * 20 + b'"\n'), max_item_size=10))
+
+	def test_batches(self):
+		self.assertEqual(list(batches(range(5), 2)), [[0, 1], [2, 3], [4]])
+		self.assertEqual(list(batches([], 2)), [])
+
+
+class UploadTestCase(DatabaseTestCase):
+	"""test body size limits and streamed bulk imports"""
+
+	def setUp(self):
+		super().setUp()
+		self.user_data = {
+			'username': 'tester',
+			'email': 'tester@mail.com',
+			'password': ',5Test_password',
+			'is_admin': True
+		}
+
+	def token(self):
+		self.provision(self.user_data)
+		user = dict(self.user_data)
+		del user['is_admin']
+		res = self.client().post('/api/v2/auth/login', data=json.dumps(user),
+								 content_type='application/json')
+		return json.loads(res.data.decode())['access_token']
+
+	def upload(self, body, token, content_type='application/x-ndjson', **options):
+		return self.client().post('/api/v2/books/import', data=body, content_type=content_type,
+								  headers={'Authorization': f'Bearer {token}'}, **options)
+
+	def upload_chunked(self, body, token):
+		# no Content-Length, the server hands over the body until it ends
+		return self.upload(b'', token, input_stream=io.BytesIO(body), environ_overrides={
+			'HTTP_TRANSFER_ENCODING': 'chunked', 'wsgi.input_terminated': True})
+
+	def test_body_limits(self):
+		self.app.config['MAX_CONTENT_LENGTH'] = 100
+		res = self.client().post('/api/v2/books', data=json.dumps({'title': 'x' * 100, 'isbn': '1'}),
+								 content_type='application/json')
+		self.assertEqual(res.status_code, 413)
+		self.assertEqual(json.loads(res.data.decode()), {'error': 'request body too large'})
+
+		# per route, here lower than the default
+		self.app.config['ROUTE_BODY_LIMITS'] = {'auth.register_view': 10}
+		res = self.client().post('/api/v2/auth/register', data=json.dumps(self.user_data),
+								 content_type='application/json')
+		self.assertEqual(res.status_code, 413)
+
+	def test_chunked_body_is_cut_off(self):
+		token = self.token()
+		self.app.config['ROUTE_BODY_LIMITS'] = {'api_import_books': 64}
+		body = b''.join(json.dumps({'title': f'book {n}', 'isbn': '9780306406157'}).encode() + b'\n'
+						for n in range(10))
+
+		res = self.upload_chunked(body, token)
+		self.assertEqual(res.status_code, 413)
+		with self.app.app_context():
+			self.assertEqual(Job.query.count(), 0)
+
+		self.app.config['ROUTE_BODY_LIMITS'] = {'api_import_books': len(body)}
+		res = self.upload_chunked(body, token)
+		self.assertEqual(res.status_code, 202)
+
+	def test_ndjson_import_in_batches(self):
+		token = self.token()
+		self.app.config['BOOK_IMPORT_BATCH_SIZE'] = 2
+		books = [
+			{'title': 'Dune', 'isbn': '978-0-306-40615-7'},
+			{'title': 'no isbn'},
+			{'title': 'Emma', 'isbn': '0-19-852663-6'},
+		]
+		res = self.upload('\n'.join(json.dumps(book) for book in books), token)
+		self.assertEqual(res.status_code, 202)
+		queued = json.loads(res.data.decode())
+		self.assertEqual((queued['books'], len(queued['jobs'])), (3, 2))
+
+		with self.app.app_context():
+			self.assertEqual(run_pending(), 2)
+			self.assertEqual(sorted(book.title for book in Booklist.get_all()), ['dune', 'emma'])
+			# errors are numbered across the whole import
+			results = [Job.query.get(job_id).result for job_id in queued['jobs']]
+		self.assertEqual([error['index'] for error in results[0]['errors']], [1])
+		self.assertEqual(results[1]['errors'], [])
+
+	def test_malformed_upload_queues_nothing(self):
+		token = self.token()
+		self.app.config['BOOK_IMPORT_BATCH_SIZE'] = 1
+		res = self.upload('[{"title": "Dune", "isbn": "9780306406157"}, {"title": ', token,
+						  content_type='application/json')
+		self.assertEqual(res.status_code, 400)
+		self.assertIn('invalid JSON', json.loads(res.data.decode())['error'])
+
+		res = self.upload('{"title": "Dune"}\nnot json\n', token)
+		self.assertEqual(res.status_code, 400)
+		with self.app.app_context():
+			self.assertEqual(Job.query.count(), 0)
+
+
+if __name__ == "__main__":
+	unittest.main()